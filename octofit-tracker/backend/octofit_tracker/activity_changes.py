@@ -0,0 +1,97 @@
+"""
+Structures derived from activities, updated on every activity write.
+
+Views and bulk ingestion report writes here rather than to each structure,
+so a new derived structure only has to be hooked in once. Leaderboard rows
+that changed are also stored in ``leaderboard_events``, from where every
+web process relays them to its live stream subscribers (see ``live``).
+
+With ``ACTIVITY_POSTPROCESSING = 'queue'`` the write only enqueues an
+``activity_change`` job (see ``jobs``) and the derived structures catch up
+asynchronously; the default ``'inline'`` updates them before the response.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+
+from . import jobs, leaderboard, live, recommendations, rollups, team_leaderboard
+
+ACTIVITY_FIELDS = ('user_email', 'duration', 'distance', 'calories_burned', 'date', 'team')
+STEPS = ('leaderboard', 'team_leaderboard', 'rollups', 'recommendations')
+
+
+def activity_values(activity):
+    """Return the fields derived structures read, as a dict that can be stored in a job."""
+    if isinstance(activity, dict):
+        return {field: activity.get(field) for field in ACTIVITY_FIELDS}
+    return {field: getattr(activity, field) for field in ACTIVITY_FIELDS}
+
+
+def apply_steps(removed=(), added=(), done=frozenset(), mark=None):
+    """
+    Update the user and team leaderboards, the rollups and workout recommendations.
+
+    Steps named in ``done`` are skipped and ``mark`` is called after each
+    step completes. Returns the changed leaderboard rows and the user deltas.
+    """
+    mark = mark or (lambda step: None)
+    deltas = leaderboard.activity_deltas(removed, added)
+    rows = []
+    if 'leaderboard' not in done:
+        rows = leaderboard.apply_deltas(deltas)
+        mark('leaderboard')
+    if 'team_leaderboard' not in done:
+        team_leaderboard.record_user_deltas(deltas)
+        mark('team_leaderboard')
+    if 'rollups' not in done:
+        rollups.record_activity_change(removed, added)
+        mark('rollups')
+    if 'recommendations' not in done:
+        recommendations.record_activity_change(removed, added)
+        mark('recommendations')
+    return rows, deltas
+
+
+def apply_activity_change(removed=(), added=()):
+    """Update every derived structure and store the changed leaderboard rows for the live stream."""
+    rows, deltas = apply_steps(removed, added)
+    live.store_leaderboard_changes(rows, deltas)
+
+
+@jobs.handler('activity_change')
+def process_activity_change(payload, done, mark):
+    """
+    Apply a queued change one user at a time.
+
+    Each user's share of a step is marked as ``<step>:<email>``, so a retry
+    after a failure part-way through a multi-user change skips the users
+    whose ``$inc`` updates already went through.
+    """
+    by_user = defaultdict(lambda: ([], []))
+    for side, activities in enumerate((payload['removed'], payload['added'])):
+        for activity in activities:
+            by_user[activity['user_email']][side].append(activity)
+    rows, deltas = [], {}
+    for email, (removed, added) in by_user.items():
+        user_done = {step for step in STEPS if step in done or f'{step}:{email}' in done}
+        user_rows, user_deltas = apply_steps(removed, added, user_done, lambda step: mark(f'{step}:{email}'))
+        rows += user_rows
+        deltas.update(user_deltas)
+    live.store_leaderboard_changes(rows, deltas)
+
+
+def record_activity_change(removed=(), added=(), key=None):
+    """
+    Apply or enqueue the derived-structure updates for removed and/or added activities.
+
+    ``key`` is the job's idempotency key in queue mode; the same change
+    reported twice under one key is processed once.
+    """
+    removed, added = list(removed), list(added)
+    if getattr(settings, 'ACTIVITY_POSTPROCESSING', 'inline') == 'queue':
+        jobs.enqueue('activity_change', {
+            'removed': [activity_values(activity) for activity in removed],
+            'added': [activity_values(activity) for activity in added],
+        }, key=key)
+    else:
+        apply_activity_change(removed, added)
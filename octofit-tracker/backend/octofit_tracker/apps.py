@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # Global PyMongo listeners only apply to clients created afterwards,
+        # so register before djongo connects.
+        from pymongo import monitoring
+
+        from .metrics import POOL_METRICS, CommandMetricsListener
+
+        monitoring.register(CommandMetricsListener())
+        monitoring.register(POOL_METRICS)
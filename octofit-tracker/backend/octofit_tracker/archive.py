@@ -0,0 +1,176 @@
+"""
+Tiered storage for old activities.
+
+``archive_activities`` moves activities older than a cutoff from the hot
+``activities`` collection into ``activities_archive``. That collection has
+the same indexes and is block-compressed with ``ACTIVITY_ARCHIVE_COMPRESSOR``.
+The hot collection, and so the working set of the everyday queries, stays small.
+
+Archiving does not change any totals. The leaderboards, rollups and workout
+profiles keep counting archived activities, and the rebuilds read both
+collections (``with_archive(..., whole_history=True)``).
+
+Reads only pay for the archive when they ask for history. Activity lists,
+exports and stats whose ``date`` filter starts on or before the newest
+archived activity also read the archive, and the two tiers are merged. Lists
+without a date range, and any range that starts later, only read the hot
+collection. Archived activities can still be retrieved by id but are read-only.
+"""
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from pymongo.errors import BulkWriteError
+
+from .models import Activity
+from .mongo import get_collection
+
+ARCHIVE_TABLE = f'{Activity._meta.db_table}_archive'
+DUPLICATE_KEY = 11000
+
+
+def get_archive_collection():
+    return get_collection(Activity).database[ARCHIVE_TABLE]
+
+
+def ensure_archive_collection():
+    """Create the compressed archive collection with the hot collection's indexes, if missing."""
+    hot = get_collection(Activity)
+    database = hot.database
+    if ARCHIVE_TABLE not in database.list_collection_names():
+        options = {}
+        compressor = getattr(settings, 'ACTIVITY_ARCHIVE_COMPRESSOR', 'zstd')
+        if compressor:
+            options['storageEngine'] = {'wiredTiger': {'configString': f'block_compressor={compressor}'}}
+        database.create_collection(ARCHIVE_TABLE, **options)
+    archive = database[ARCHIVE_TABLE]
+    existing = archive.index_information()
+    for name, info in hot.index_information().items():
+        if name not in existing:
+            archive.create_index(info['key'], name=name, unique=info.get('unique', False))
+    return archive
+
+
+def _naive(value):
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def archive_boundary(archive=None):
+    """Return the (naive UTC) date of the newest archived activity, or ``None`` when nothing is archived."""
+    archive = archive if archive is not None else get_archive_collection()
+    newest = archive.find_one({}, {'date': 1}, sort=[('date', -1)])
+    return newest['date'] if newest else None
+
+
+def range_reaches(match, boundary):
+    """Whether the ``date`` range of an activity filter starts on or before ``boundary``."""
+    date = (match or {}).get('date')
+    if boundary is None or not isinstance(date, dict):
+        return False
+    lower = date.get('$gte', date.get('$gt'))
+    return lower is None or _naive(lower) <= boundary
+
+
+def reaches_archive(match):
+    """Whether a read with the activity filter ``match`` has to include the archive."""
+    return range_reaches(match, archive_boundary())
+
+
+def activity_collections(match):
+    """Return the collections an activity read with ``match`` must merge."""
+    hot = get_collection(Activity)
+    return [hot, get_archive_collection()] if reaches_archive(match) else [hot]
+
+
+def _leading_match(pipeline):
+    return pipeline[0]['$match'] if pipeline and '$match' in pipeline[0] else None
+
+
+def union_archive(pipeline):
+    """
+    Make an aggregation pipeline over ``activities`` read the archive too.
+
+    A leading ``$match`` is copied into the ``$unionWith`` so both
+    collections use their indexes.
+    """
+    if _leading_match(pipeline) is not None:
+        return [pipeline[0], {'$unionWith': {'coll': ARCHIVE_TABLE, 'pipeline': [pipeline[0]]}}, *pipeline[1:]]
+    return [{'$unionWith': {'coll': ARCHIVE_TABLE}}, *pipeline]
+
+
+def with_archive(pipeline, whole_history=False):
+    """
+    Union the archive into ``pipeline`` when it is needed.
+
+    Report pipelines need the archive only when the date range of their
+    leading ``$match`` reaches it. Rebuilds pass ``whole_history`` to
+    include it whenever it holds anything.
+    """
+    boundary = archive_boundary()
+    if boundary is None or not (whole_history or range_reaches(_leading_match(pipeline), boundary)):
+        return pipeline
+    return union_archive(pipeline)
+
+
+def find_archived(object_id):
+    return get_archive_collection().find_one({'_id': object_id})
+
+
+def archived_duplicates(documents, natural_key):
+    """
+    Return the positions in ``documents`` whose natural key is already archived.
+
+    The hot collection's unique index cannot see archived activities, so
+    writes dated no later than the newest archived activity are checked here
+    with one query. Other writes skip the check.
+    """
+    archive = get_archive_collection()
+    boundary = archive_boundary(archive)
+    if boundary is None:
+        return set()
+    candidates = {
+        position: tuple(_naive(document[field]) if field == 'date' else document[field] for field in natural_key)
+        for position, document in enumerate(documents)
+        if _naive(document['date']) <= boundary
+    }
+    if not candidates:
+        return set()
+    query = {'$or': [dict(zip(natural_key, values)) for values in set(candidates.values())]}
+    archived = {
+        tuple(document[field] for field in natural_key)
+        for document in archive.find(query, {field: 1 for field in natural_key})
+    }
+    return {position for position, values in candidates.items() if values in archived}
+
+
+def count_archivable(cutoff):
+    return get_collection(Activity).count_documents({'date': {'$lt': cutoff}})
+
+
+def archive_activities(cutoff, batch_size=1000, progress=None):
+    """
+    Move every activity dated before ``cutoff`` into the archive; returns how many moved.
+
+    Each batch is inserted into the archive before it is deleted from the
+    hot collection. An interrupted run therefore leaves some activities in
+    both collections, never in neither, and running it again finishes the
+    move. ``progress`` is called with the number moved so far.
+    """
+    hot = get_collection(Activity)
+    archive = ensure_archive_collection()
+    moved = 0
+    while True:
+        batch = list(hot.find({'date': {'$lt': cutoff}}).sort('date', 1).limit(batch_size))
+        if not batch:
+            return moved
+        try:
+            archive.insert_many(batch, ordered=False)
+        except BulkWriteError as exc:
+            # Already archived by an interrupted run
+            if any(error['code'] != DUPLICATE_KEY for error in exc.details['writeErrors']):
+                raise
+        hot.delete_many({'_id': {'$in': [document['_id'] for document in batch]}})
+        moved += len(batch)
+        if progress:
+            progress(moved)
@@ -2,6 +2,9 @@
 ASGI config for octofit_tracker project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The live leaderboard stream is served in front of Django; see ``live.py``.
+It needs an ASGI server, e.g. ``uvicorn octofit_tracker.asgi:application``;
+``manage.py runserver`` serves the WSGI application, without the stream.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -13,4 +16,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready
+from octofit_tracker.live import with_leaderboard_stream  # noqa: E402
+
+application = with_leaderboard_stream(django_application)
@@ -0,0 +1,177 @@
+"""
+Async read path for the hot endpoints.
+
+These are native Django async views. Under an ASGI server a worker keeps
+serving other requests while one waits on the database: each blocking
+pymongo call runs on a thread pool, the way Motor 2 wraps pymongo. (Motor
+itself is not used. Releases that support pymongo 3.12, which djongo pins,
+do not import on Python 3.11.) The pool has one thread per connection the
+client may open (``maxPoolSize``), so that is how many database calls a
+worker runs at once; further requests wait for a thread. They return the
+same JSON as their DRF counterparts:
+
+* ``/api/async/leaderboard/`` mirrors ``/api/leaderboard/``
+* ``/api/async/activities/`` mirrors ``/api/activities/`` (same filters)
+* ``/api/async/stats/<report>/`` mirrors ``/api/stats/<report>/``
+
+Like their counterparts, activity pages and reports whose date range
+reaches archived activities also read the archive.
+
+The views share the sync API's ``MongoClient`` (djongo keeps one per
+process) and so its connection pool.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, JsonResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param
+
+from . import stats
+from .archive import ARCHIVE_TABLE, range_reaches, union_archive
+from .documents import activity_row, leaderboard_row
+from .models import Activity, Leaderboard, User
+from .mongo import get_database
+from .pagination import KeysetCursorPagination, decode_position, document_position, merge_sorted, position_query
+from .views import activity_match, int_param
+
+
+# The loop's default executor has only min(32, CPUs + 4) threads
+THREADS = settings.DATABASES['default'].get('CLIENT', {}).get('maxPoolSize') or 100
+EXECUTOR = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='async-views')
+
+
+async def run(function, *args, **kwargs):
+    """Run a blocking pymongo call on ``EXECUTOR`` so the event loop keeps serving."""
+    return await sync_to_async(function, thread_sensitive=False, executor=EXECUTOR)(*args, **kwargs)
+
+
+def load_users(database, emails):
+    """Return ``email -> user document`` for the given emails with one ``$in`` query."""
+    cursor = database[User._meta.db_table].find(
+        {'email': {'$in': list(set(emails))}},
+        {'_id': 0, 'email': 1, 'name': 1, 'team': 1},
+    )
+    return {user['email']: user for user in cursor}
+
+
+def team_members(database, team):
+    return database[User._meta.db_table].distinct('email', {'team': team})
+
+
+def reaches_archive(database, match):
+    newest = database[ARCHIVE_TABLE].find_one({}, {'date': 1}, sort=[('date', -1)])
+    return range_reaches(match, newest['date'] if newest else None)
+
+
+def fetch_page(collection, match, ordering, limit, archive=None):
+    """Return the first ``limit`` documents of ``collection`` (merged with ``archive``) and their users."""
+    documents = list(collection.find(match).sort(ordering).limit(limit))
+    if archive is not None:
+        archived = list(archive.find(match).sort(ordering).limit(limit))
+        documents = list(merge_sorted([documents, archived], ordering))[:limit]
+    return documents, load_users(collection.database, (document['user_email'] for document in documents))
+
+
+async def keyset_page(request, collection, match, model, ordering, row, archive=None):
+    """
+    Fetch one cursor page of ``collection`` and build the paginated response body.
+
+    With an ``archive`` collection, a page is read from each and the two are merged.
+    """
+    fields = [model._meta.get_field(name) for name, _ in ordering]
+    page_size = KeysetCursorPagination.page_size
+    try:
+        requested = int(request.GET[KeysetCursorPagination.page_size_query_param])
+        if requested > 0:
+            page_size = min(requested, KeysetCursorPagination.max_page_size)
+    except (KeyError, ValueError):
+        pass
+    encoded = request.GET.get(KeysetCursorPagination.cursor_query_param)
+    if encoded is not None:
+        try:
+            position = decode_position(encoded, fields)
+        except (TypeError, ValueError, UnicodeError, DjangoValidationError):
+            raise Http404(KeysetCursorPagination.invalid_cursor_message)
+        match = {'$and': [match, position_query(ordering, position)]} if match else position_query(ordering, position)
+
+    documents, users = await run(fetch_page, collection, match, ordering, page_size + 1, archive)
+    has_next, documents = len(documents) > page_size, documents[:page_size]
+
+    next_link = None
+    if has_next:
+        next_link = replace_query_param(
+            request.build_absolute_uri(), KeysetCursorPagination.cursor_query_param,
+            document_position(documents[-1], [name for name, _ in ordering]),
+        )
+    return {'next': next_link, 'results': row.rows(documents, users)}
+
+
+def bad_request(exc):
+    return JsonResponse(exc.detail, status=400)
+
+
+async def leaderboard(request):
+    """Leaderboard page ordered by rank, filterable by ``user_email`` and ``team``."""
+    database = await run(get_database)
+    try:
+        match = {}
+        if request.GET.get('user_email'):
+            match['user_email'] = request.GET['user_email']
+        if request.GET.get('team'):
+            members = {'$in': await run(team_members, database, request.GET['team'])}
+            if 'user_email' in match:
+                members['$eq'] = match['user_email']
+            match['user_email'] = members
+        body = await keyset_page(
+            request, database[Leaderboard._meta.db_table], match, Leaderboard,
+            [('rank', 1), ('_id', 1)], leaderboard_row,
+        )
+    except ValidationError as exc:
+        return bad_request(exc)
+    return JsonResponse(body)
+
+
+async def activities(request):
+    """Activity page, newest first, with the same filters as ``/api/activities/``."""
+    database = await run(get_database)
+    try:
+        team = request.GET.get('team')
+        match = activity_match(request.GET, await run(team_members, database, team) if team else None)
+        archive = database[ARCHIVE_TABLE] if await run(reaches_archive, database, match) else None
+        body = await keyset_page(
+            request, database[Activity._meta.db_table], match, Activity,
+            [('date', -1), ('_id', -1)], activity_row, archive,
+        )
+    except ValidationError as exc:
+        return bad_request(exc)
+    return JsonResponse(body)
+
+
+STATS_REPORTS = {
+    'users': lambda params, match: stats.user_totals_pipeline(match, limit=int_param(params, 'limit', 100, 1000)),
+    'teams': lambda params, match: stats.team_totals_pipeline(match),
+    'activity-types': lambda params, match: stats.activity_type_totals_pipeline(match),
+    'timeline': lambda params, match: stats.timeline_pipeline(params.get('bucket', 'day'), match),
+}
+
+
+async def stats_report(request, report):
+    """Run one of the ``/api/stats/`` aggregation reports off the event loop."""
+    if report not in STATS_REPORTS:
+        raise Http404
+    database = await run(get_database)
+    try:
+        if request.GET.get('bucket', 'day') not in stats.BUCKET_FORMATS:
+            raise ValidationError({'bucket': f"Expected one of {', '.join(stats.BUCKET_FORMATS)}."})
+        team = request.GET.get('team')
+        match = activity_match(request.GET, await run(team_members, database, team) if team else None)
+        pipeline, key = STATS_REPORTS[report](request.GET, match)
+    except ValidationError as exc:
+        return bad_request(exc)
+    if await run(reaches_archive, database, match):
+        pipeline = union_archive(pipeline)
+    documents = await run(lambda: list(database[Activity._meta.db_table].aggregate(pipeline, allowDiskUse=True)))
+    return JsonResponse({'results': stats.rows(documents, key)})
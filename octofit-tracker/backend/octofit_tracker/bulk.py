@@ -0,0 +1,130 @@
+"""
+Bulk activity ingestion.
+
+Rows are validated individually so one bad row does not reject the batch,
+then written with unordered ``insert_many`` calls of ``ACTIVITY_BULK_CHUNK_SIZE``
+documents. Write errors are reported per row using the index in the
+original request.
+
+An activity is identified by its ``NATURAL_KEY``, which the unique index
+``activity_natural_key_uniq`` enforces. A row that repeats a stored activity
+(or an earlier row in the same request) is rejected by that index as part of
+its insert, so duplicates are found without a read first and without a race
+between concurrent retries. Bulk responses count them as ``duplicates``, not failures.
+Rows dated back into the archive are also checked against it (see ``archive``).
+"""
+from django.conf import settings
+from django.utils import timezone
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from rest_framework.exceptions import ValidationError
+
+from .activity_changes import record_activity_change
+from .archive import archived_duplicates, get_archive_collection
+from .models import Activity
+from .mongo import get_collection
+from .team_leaderboard import user_teams
+
+NATURAL_KEY = ('user_email', 'date', 'activity_type')
+DUPLICATE_KEY = 11000
+
+
+def build_document(model, validated_data, now):
+    """Build the stored document for ``model`` from field values, applying model defaults."""
+    document = {}
+    for field in model._meta.concrete_fields:
+        if field.name in validated_data:
+            document[field.column] = validated_data[field.name]
+        elif getattr(field, 'auto_now_add', False) or getattr(field, 'auto_now', False):
+            document[field.column] = now
+        elif field.has_default():
+            document[field.column] = field.get_default()
+    return document
+
+
+def validate_rows(serializer, rows):
+    """
+    Validate each row with the list serializer's child.
+
+    Returns ``(valid, errors)`` where ``valid`` is a list of ``(index,
+    validated_data)`` and ``errors`` a list of ``{'index', 'errors'}``.
+    """
+    valid, errors = [], []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, serializer.child.run_validation(row)))
+        except ValidationError as exc:
+            errors.append({'index': index, 'errors': exc.detail})
+    return valid, errors
+
+
+def record_teams(documents):
+    """Store each activity's current user team on it (see ``Activity.team``); returns ``documents``."""
+    teams = user_teams(document['user_email'] for document in documents)
+    for document in documents:
+        document['team'] = teams.get(document['user_email']) or ''
+    return documents
+
+
+def create_activity(validated_data):
+    """
+    Insert one activity unless its natural key is taken.
+
+    Returns ``(document, created)``: the new document, or the stored one it duplicates.
+    """
+    # MongoDB stores milliseconds; respond with what a later read returns
+    now = timezone.now()
+    document = build_document(Activity, validated_data, now.replace(microsecond=now.microsecond // 1000 * 1000))
+    record_teams([document])
+    if archived_duplicates([document], NATURAL_KEY):
+        existing = get_archive_collection().find_one({field: document[field] for field in NATURAL_KEY})
+        if existing is not None:
+            return existing, False
+    collection = get_collection(Activity)
+    try:
+        collection.insert_one(document)
+    except DuplicateKeyError:
+        existing = collection.find_one({field: document[field] for field in NATURAL_KEY})
+        if existing is None:
+            # The other key was deleted in between; this one is new after all
+            return create_activity(validated_data)
+        return existing, False
+    record_activity_change(added=[document], key=f"activity:{document['_id']}:created")
+    return document, True
+
+
+def insert_activities(valid):
+    """
+    Insert validated rows in unordered chunks and update the leaderboard.
+
+    Returns ``(inserted, duplicates, errors)``: the stored documents, the
+    request indexes of rows that repeat an existing activity and per-row
+    write errors.
+    """
+    chunk_size = getattr(settings, 'ACTIVITY_BULK_CHUNK_SIZE', 1000)
+    collection = get_collection(Activity)
+    now = timezone.now()
+    inserted, duplicates, errors = [], [], []
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        documents = record_teams([build_document(Activity, data, now) for _, data in chunk])
+        archived = archived_duplicates(documents, NATURAL_KEY)
+        pending = [position for position in range(len(documents)) if position not in archived]
+        failed = {}
+        if pending:
+            try:
+                collection.insert_many([documents[position] for position in pending], ordered=False)
+            except BulkWriteError as exc:
+                for error in exc.details['writeErrors']:
+                    failed[pending[error['index']]] = error
+        for position, ((index, _), document) in enumerate(zip(chunk, documents)):
+            error = failed.get(position)
+            if position in archived:
+                duplicates.append(index)
+            elif error is None:
+                inserted.append(document)
+            elif error['code'] == DUPLICATE_KEY:
+                duplicates.append(index)
+            else:
+                errors.append({'index': index, 'errors': {'non_field_errors': [error['errmsg']]}})
+    record_activity_change(added=inserted)
+    return inserted, duplicates, errors
@@ -0,0 +1,103 @@
+"""
+Response caching for read-heavy viewsets.
+
+Cached list/retrieve responses live in the ``api`` cache alias (size-bounded
+LRU in local memory by default, or a file store). Keys embed a per-viewset
+generation token; any successful write through the viewset replaces the
+token, which makes every cached response for it unreachable at once.
+
+Responses carry an ``ETag`` (hash of the payload) and a ``Last-Modified``
+(time of the last write), so clients revalidating with ``If-None-Match`` or
+``If-Modified-Since`` get a ``304``.
+"""
+import hashlib
+import json
+import time
+import uuid
+
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+CACHE_ALIAS = 'api'
+
+
+def generation_key(basename):
+    return f'viewset:{basename}:generation'
+
+
+def get_generation(basename):
+    """Return the viewset's current ``{'token', 'modified'}``, creating one if missing or evicted."""
+    cache = caches[CACHE_ALIAS]
+    generation = cache.get(generation_key(basename))
+    if generation is None:
+        cache.add(generation_key(basename), {'token': uuid.uuid4().hex, 'modified': time.time()}, timeout=None)
+        generation = cache.get(generation_key(basename))
+    return generation
+
+
+def invalidate_responses(basename):
+    """Drop every cached response for a viewset."""
+    caches[CACHE_ALIAS].set(
+        generation_key(basename),
+        {'token': uuid.uuid4().hex, 'modified': time.time()},
+        timeout=None,
+    )
+
+
+def payload_etag(data):
+    digest = hashlib.md5(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return quote_etag(digest)
+
+
+class CachedResponseMixin:
+    """
+    Cache ``list`` and ``retrieve`` responses until the next write or ``cache_timeout``.
+
+    ``cache_timeout`` defaults to the ``api`` cache's ``TIMEOUT``.
+    """
+    cache_timeout = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        cache = caches[CACHE_ALIAS]
+        generation = get_generation(self.basename)
+        key = ':'.join([
+            'viewset', self.basename, generation['token'],
+            request.accepted_renderer.format, request.get_full_path(),
+        ])
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            entry = {'data': response.data, 'etag': payload_etag(response.data), 'modified': generation['modified']}
+            timeout = self.cache_timeout if self.cache_timeout is not None else cache.default_timeout
+            cache.set(key, entry, timeout)
+
+        response = Response(entry['data'])
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(entry['modified'])
+        patch_cache_control(response, no_cache=True)
+        not_modified = get_conditional_response(
+            request, etag=entry['etag'], last_modified=int(entry['modified']), response=response,
+        )
+        if not_modified is not response:
+            return Response(status=not_modified.status_code, headers={
+                'ETag': entry['etag'],
+                'Last-Modified': response['Last-Modified'],
+                'Cache-Control': response['Cache-Control'],
+            })
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            invalidate_responses(self.basename)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,127 @@
+"""
+API rows built straight from raw MongoDB documents.
+
+Read paths that bypass the ORM (list fast path, async views, streaming
+exports) use these to produce exactly what the DRF serializers would,
+without building model instances or running DRF's per-object field
+machinery.
+
+A ``RowPlan`` inspects a serializer once and compiles every output field
+into a small getter; converting a document is then a single dict
+comprehension. ``users`` is any mapping-like object whose ``get(email)``
+returns a user document with ``name`` and ``team``, or None.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import NOT_PROVIDED
+from rest_framework import fields as drf_fields
+
+from .models import User
+from .mongo import get_collection
+from .serializers import ActivitySerializer, LeaderboardSerializer, UserSerializer, WorkoutSerializer
+
+
+def format_datetime(value):
+    """Format a UTC datetime read from MongoDB the way DRF's DateTimeField does."""
+    if value is None:
+        return None
+    return value.replace(tzinfo=None).isoformat() + 'Z'
+
+
+def load_user_documents(emails):
+    """Return ``email -> user document`` for the given emails with one ``$in`` query."""
+    emails = list(set(emails))
+    if not emails:
+        return {}
+    cursor = get_collection(User).find({'email': {'$in': emails}}, {'_id': 0, 'email': 1, 'name': 1, 'team': 1})
+    return {user['email']: user for user in cursor}
+
+
+def _object_id(document, users):
+    return str(document['_id'])
+
+
+def _user_name(document, users):
+    user = users.get(document['user_email'])
+    return user['name'] if user else document['user_email']
+
+
+def _user_team(document, users):
+    user = users.get(document['user_email'])
+    return (user.get('team') or 'No Team') if user else 'No Team'
+
+
+# Getters for the SerializerMethodFields the serializers declare.
+METHOD_FIELDS = {
+    'id': _object_id,
+    'user': _user_name,
+    'team': _user_team,
+}
+
+# Output conversions matching each DRF field's ``to_representation``.
+CONVERTERS = (
+    (drf_fields.DateTimeField, format_datetime),
+    (drf_fields.IntegerField, int),
+    (drf_fields.FloatField, float),
+)
+
+
+class RowPlan:
+    """
+    Precompiled conversion of raw documents into ``serializer_class`` output rows.
+
+    Compiled on first use, after the app registry is ready.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._getters = None
+
+    @property
+    def getters(self):
+        if self._getters is None:
+            self._getters = self.compile()
+        return self._getters
+
+    @property
+    def needs_users(self):
+        """Whether rows include user fields, so callers must pass ``users``."""
+        return any(getter in (_user_name, _user_team) for _, getter in self.getters)
+
+    def compile(self):
+        getters = []
+        serializer = self.serializer_class()
+        model = serializer.Meta.model
+        for name, field in serializer.fields.items():
+            if isinstance(field, drf_fields.SerializerMethodField):
+                if name not in METHOD_FIELDS:
+                    raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} has no document getter')
+                getters.append((name, METHOD_FIELDS[name]))
+                continue
+            model_field = model._meta.get_field(field.source)
+            default = None if model_field.default is NOT_PROVIDED else model_field.get_default()
+            convert = next((function for kind, function in CONVERTERS if isinstance(field, kind)), None)
+            getters.append((name, self.field_getter(model_field.column, default, convert)))
+        return getters
+
+    @staticmethod
+    def field_getter(column, default, convert):
+        if convert is None:
+            return lambda document, users: document.get(column, default)
+
+        def getter(document, users):
+            value = document.get(column, default)
+            return None if value is None else convert(value)
+        return getter
+
+    def __call__(self, document, users=None):
+        return {name: getter(document, users) for name, getter in self.getters}
+
+    def rows(self, documents, users=None):
+        getters = self.getters
+        return [{name: getter(document, users) for name, getter in getters} for document in documents]
+
+
+user_row = RowPlan(UserSerializer)
+activity_row = RowPlan(ActivitySerializer)
+leaderboard_row = RowPlan(LeaderboardSerializer)
+workout_row = RowPlan(WorkoutSerializer)
@@ -0,0 +1,119 @@
+"""
+Streaming activity exports.
+
+Activities are read from a server-side MongoDB cursor in batches of
+``ACTIVITY_EXPORT_BATCH_SIZE`` and rendered batch by batch, so memory use
+stays constant however many rows are exported. User names are resolved
+through a bounded LRU cache with one ``$in`` query per batch for the misses.
+Exports whose date range reaches archived activities merge in the archive.
+"""
+import csv
+import io
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .archive import activity_collections
+from .documents import activity_row
+from .models import User
+from .mongo import get_collection
+from .pagination import merge_sorted
+from .renderers import CSVRenderer, NDJSONRenderer
+
+EXPORT_FIELDS = [
+    'id', 'user', 'user_email', 'activity_type', 'duration', 'distance', 'calories_burned', 'date', 'created_at',
+]
+
+
+class BoundedUserCache:
+    """
+    ``email -> user document`` LRU cache holding at most ``max_size`` users.
+
+    The users of the batch being loaded are never evicted by that load, so a
+    batch with more distinct users than ``max_size`` briefly grows the cache
+    past it; the next load trims it back.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._users = OrderedDict()
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, email):
+        if email in self._users:
+            self._users.move_to_end(email)
+        return self._users.get(email)
+
+    def load(self, emails):
+        """Fetch the users not already cached with a single query, keeping all of ``emails`` cached."""
+        batch = set(emails)
+        missing = set()
+        for email in batch:
+            if email in self._users:
+                self._users.move_to_end(email)
+            else:
+                missing.add(email)
+        if missing:
+            found = {
+                user['email']: user
+                for user in get_collection(User).find(
+                    {'email': {'$in': list(missing)}}, {'_id': 0, 'email': 1, 'name': 1, 'team': 1},
+                )
+            }
+            for email in missing:
+                self._users[email] = found.get(email)
+        # The batch's users are the most recent, so only older ones are evicted
+        while len(self._users) > self.max_size and next(iter(self._users)) not in batch:
+            self._users.popitem(last=False)
+
+
+def iter_activity_batches(match, batch_size=None, user_cache_size=None):
+    """Yield lists of activity rows, oldest first, read ``batch_size`` documents at a time."""
+    batch_size = batch_size or getattr(settings, 'ACTIVITY_EXPORT_BATCH_SIZE', 1000)
+    users = BoundedUserCache(user_cache_size or getattr(settings, 'ACTIVITY_EXPORT_USER_CACHE_SIZE', 10000))
+    sort = [('date', 1), ('_id', 1)]
+    cursors = [
+        collection.find(match).sort(sort).batch_size(batch_size) for collection in activity_collections(match)
+    ]
+    cursor = cursors[0] if len(cursors) == 1 else merge_sorted(cursors, sort)
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            users.load(document['user_email'] for document in batch)
+            yield activity_row.rows(batch, users)
+            batch = []
+    if batch:
+        users.load(document['user_email'] for document in batch)
+        yield activity_row.rows(batch, users)
+
+
+def stream_ndjson(match, **options):
+    renderer = NDJSONRenderer()
+    for rows in iter_activity_batches(match, **options):
+        yield renderer.render(rows)
+
+
+def _drain(buffer):
+    value = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate(0)
+    return value.encode('utf-8')
+
+
+def stream_csv(match, **options):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    yield _drain(buffer)
+    for rows in iter_activity_batches(match, **options):
+        writer.writerows(rows)
+        yield _drain(buffer)
+
+
+STREAMS = {
+    NDJSONRenderer.format: stream_ndjson,
+    CSVRenderer.format: stream_csv,
+}
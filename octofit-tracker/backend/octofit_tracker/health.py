@@ -0,0 +1,56 @@
+"""
+Liveness and database health for load balancers and orchestrators.
+
+``/health`` pings MongoDB and reports every connection pool's utilisation.
+The status is ``ok``, ``degraded`` when a pool is saturated (at least
+``MONGO_POOL_SATURATION_WARNING`` of ``maxPoolSize`` checked out, or
+requests queueing for a connection) and ``error`` with HTTP 503 when the
+ping fails. Each pool's ``opened`` count and age show whether connections
+are kept between requests (see ``CONN_MAX_AGE``) or rebuilt.
+"""
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+from pymongo.errors import PyMongoError
+
+from .metrics import POOL_METRICS
+from .mongo import get_database
+
+
+def pool_report(pools, warning):
+    """Return ``(saturated, rows)`` for a ``PoolMetricsListener.snapshot()``."""
+    saturated = False
+    rows = {}
+    for address, pool in sorted(pools.items()):
+        busy = pool.saturation >= warning or pool.waiting > 0
+        saturated = saturated or busy
+        rows[address] = {
+            'max_size': pool.max_size,
+            'connections': pool.connections,
+            'in_use': pool.in_use,
+            'waiting': pool.waiting,
+            'saturation': round(pool.saturation, 3),
+            'checkout_failures': pool.checkout_failures,
+            'opened': pool.opened,
+            'age_seconds': round(time.monotonic() - pool.created_at, 1),
+            'saturated': busy,
+        }
+    return saturated, rows
+
+
+def health_view(request):
+    """Report ``ok``, ``degraded`` or ``error`` for this process's MongoDB access."""
+    warning = getattr(settings, 'MONGO_POOL_SATURATION_WARNING', 0.8)
+    body = {'status': 'ok'}
+    started = time.perf_counter()
+    try:
+        get_database().command('ping')
+    except PyMongoError as exc:
+        body.update(status='error', error=str(exc))
+    body['ping_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+    saturated, body['pools'] = pool_report(POOL_METRICS.snapshot(), warning)
+    if saturated and body['status'] == 'ok':
+        body['status'] = 'degraded'
+    return JsonResponse(body, status=503 if body['status'] == 'error' else 200)
@@ -0,0 +1,155 @@
+"""
+Idempotency keys for POST endpoints that clients retry.
+
+A client sends a unique ``Idempotency-Key`` header with a write and reuses it
+when retrying that write. The first request with a key claims it with one
+``insert_one`` that the unique index on ``key`` either accepts or rejects,
+so concurrent retries cannot both run. The claimant's response is stored
+under the key. Later requests with the key get one of these answers:
+
+* the stored response again, with ``Idempotent-Replayed: true``;
+* 409 while the first request is still in progress;
+* 422 if the key was used with a different request.
+
+Failed requests (exceptions and 5xx) release the key so they can be retried.
+A claim left in progress for ``IDEMPOTENCY_KEY_LOCK_SECONDS`` (a worker died
+mid-request) can be taken over. Keys expire ``IDEMPOTENCY_KEY_TTL_SECONDS``
+after first use: a TTL index deletes them, which keeps the store bounded to
+one retry window of writes. Until MongoDB's TTL monitor gets to a key,
+expired keys are treated as absent.
+"""
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+from .mongo import get_collection
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+TTL_INDEX = 'idempotency_key_ttl_idx'
+
+_indexes_ready = False
+
+
+def create_key_indexes(collection):
+    """
+    Create the unique and TTL indexes the store depends on.
+
+    A changed ``IDEMPOTENCY_KEY_TTL_SECONDS`` is applied to the existing TTL index with ``collMod``.
+    """
+    ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL_SECONDS', 86400)
+    collection.create_index([('key', 1)], name='idempotency_key_uniq', unique=True)
+    try:
+        collection.create_index([('created_at', 1)], name=TTL_INDEX, expireAfterSeconds=ttl)
+    except OperationFailure:
+        collection.database.command('collMod', collection.name,
+                                    index={'name': TTL_INDEX, 'expireAfterSeconds': ttl})
+
+
+def request_fingerprint(request):
+    """Hash the method, path and parsed body, so reordered JSON keys still match."""
+    body = json.dumps(request.data, sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def _age(record, now):
+    return (now.replace(tzinfo=None) - record['created_at'].replace(tzinfo=None)).total_seconds()
+
+
+def _error(status_code, detail):
+    return Response({'detail': detail}, status=status_code)
+
+
+def claim(key, fingerprint):
+    """
+    Claim ``key`` for a new request.
+
+    Returns ``None`` when the caller should run the request, or the response
+    to send instead: the stored one, a 409 or a 422.
+    """
+    global _indexes_ready
+    collection = get_collection(IdempotencyKey)
+    if not _indexes_ready:
+        # The store is not safe without its indexes, so it does not wait for ensure_indexes
+        create_key_indexes(collection)
+        _indexes_ready = True
+    ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL_SECONDS', 86400)
+    lock = getattr(settings, 'IDEMPOTENCY_KEY_LOCK_SECONDS', 60)
+    for _ in range(3):
+        now = timezone.now()
+        try:
+            collection.insert_one({
+                'key': key, 'fingerprint': fingerprint, 'created_at': now,
+                'response_status': None, 'response_body': None,
+            })
+            return None
+        except DuplicateKeyError:
+            record = collection.find_one({'key': key})
+        if record is None:
+            # Expired and deleted since the insert failed
+            continue
+        age = _age(record, now)
+        if age >= ttl or (record['response_status'] is None and age >= lock):
+            # Expired or abandoned: remove exactly this record and claim again
+            collection.delete_one({'_id': record['_id'], 'response_status': record['response_status']})
+            continue
+        if record['response_status'] is None:
+            return _error(status.HTTP_409_CONFLICT, f'A request with this {HEADER} is still in progress.')
+        if record['fingerprint'] != fingerprint:
+            return _error(status.HTTP_422_UNPROCESSABLE_ENTITY,
+                          f'{HEADER} was already used with a different request.')
+        response = Response(json.loads(record['response_body']), status=record['response_status'])
+        response[REPLAYED_HEADER] = 'true'
+        return response
+    return _error(status.HTTP_409_CONFLICT, f'A request with this {HEADER} is still in progress.')
+
+
+def complete(key, response):
+    """Store the response to replay for ``key``."""
+    get_collection(IdempotencyKey).update_one({'key': key, 'response_status': None}, {'$set': {
+        'response_status': response.status_code,
+        'response_body': json.dumps(response.data, cls=JSONEncoder),
+    }})
+
+
+def release(key):
+    """Forget an in-progress claim so the request can be retried."""
+    get_collection(IdempotencyKey).delete_one({'key': key, 'response_status': None})
+
+
+def idempotent(method):
+    """
+    Make a viewset action honour the ``Idempotency-Key`` header.
+
+    Requests without the header run as before.
+    """
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            raise ValidationError({HEADER: ['Ensure this header has no more than 255 characters.']})
+        replay = claim(key, request_fingerprint(request))
+        if replay is not None:
+            return replay
+        try:
+            response = method(self, request, *args, **kwargs)
+        except Exception:
+            release(key)
+            raise
+        if response.status_code >= 500:
+            release(key)
+        else:
+            complete(key, response)
+        return response
+    return wrapper
@@ -0,0 +1,223 @@
+"""
+Background job queue backed by the ``jobs`` collection.
+
+``enqueue(kind, payload, key)`` stores a job under an idempotency key. If a
+job with that key already exists, enqueueing it again does nothing, so a
+retried request cannot queue the same work twice. Workers claim the oldest
+due job with one atomic ``find_one_and_update`` and hold it under a lease.
+Jobs whose worker died are claimed again once the lease expires.
+
+A job that raises is retried up to ``JOB_MAX_ATTEMPTS`` times, with
+exponential backoff from ``JOB_RETRY_BACKOFF_SECONDS``, and is then marked
+``failed``. Handlers that do several non-idempotent steps record each one
+with ``mark(step)``. A retry gets the recorded steps in ``done`` and skips
+them. Work is therefore at-least-once per step, not per job, so steps should
+be small: activity changes mark each step per user.
+
+Workers run either in the web process (``JOB_QUEUE_LOCAL_WORKERS`` threads,
+started on the first enqueue) or in separate processes with
+``manage.py run_workers``. Queue depth and lag are exported on ``/metrics``.
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReturnDocument
+
+from .metrics import REGISTRY
+from .models import Job
+from .mongo import get_collection
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+STATUSES = ('pending', 'running', 'done', 'failed')
+
+
+def handler(kind):
+    """Register ``function(payload, done, mark)`` as the handler for jobs of ``kind``."""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def enqueue(kind, payload, key=None, delay=0):
+    """
+    Queue a job unless one with ``key`` exists; returns ``(key, created)``.
+
+    Without a key every call queues a new job.
+    """
+    key = key or f'{kind}:{uuid.uuid4().hex}'
+    now = timezone.now()
+    result = get_collection(Job).update_one({'key': key}, {'$setOnInsert': {
+        'key': key,
+        'kind': kind,
+        'payload': payload,
+        'status': 'pending',
+        'attempts': 0,
+        'steps_done': [],
+        'enqueued_at': now,
+        'run_at': now + timedelta(seconds=delay),
+    }}, upsert=True)
+    created = result.upserted_id is not None
+    if created:
+        wake_local_workers()
+    return key, created
+
+
+def claim(worker_id):
+    """Lease the oldest due job (or one whose lease expired) to ``worker_id``."""
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'JOB_LEASE_SECONDS', 300))
+    return get_collection(Job).find_one_and_update(
+        {'$or': [
+            {'status': 'pending', 'run_at': {'$lte': now}},
+            {'status': 'running', 'locked_until': {'$lt': now}},
+        ]},
+        {'$set': {'status': 'running', 'locked_until': now + lease, 'worker': worker_id},
+         '$inc': {'attempts': 1}},
+        sort=[('run_at', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome; returns the job's new status."""
+    collection = get_collection(Job)
+    done = set(job.get('steps_done') or [])
+
+    def mark(step):
+        collection.update_one({'_id': job['_id']}, {'$addToSet': {'steps_done': step}})
+        done.add(step)
+
+    try:
+        function = HANDLERS.get(job['kind'])
+        if function is None:
+            raise LookupError(f"No handler registered for job kind {job['kind']!r}")
+        function(job['payload'], frozenset(done), mark)
+    except Exception as exc:
+        now = timezone.now()
+        if job['attempts'] >= getattr(settings, 'JOB_MAX_ATTEMPTS', 5):
+            status, changes = 'failed', {'finished_at': now}
+        else:
+            backoff = getattr(settings, 'JOB_RETRY_BACKOFF_SECONDS', 2) * 2 ** (job['attempts'] - 1)
+            status, changes = 'pending', {'run_at': now + timedelta(seconds=backoff)}
+        logger.exception('Job %s (attempt %s) failed; now %s', job['key'], job['attempts'], status)
+        collection.update_one({'_id': job['_id']}, {
+            '$set': {'status': status, 'last_error': repr(exc), **changes},
+            '$unset': {'locked_until': ''},
+        })
+        return status
+    collection.update_one({'_id': job['_id']}, {
+        '$set': {'status': 'done', 'finished_at': timezone.now()},
+        '$unset': {'locked_until': ''},
+    })
+    return 'done'
+
+
+def purge_jobs(older_than=None):
+    """Delete finished jobs older than ``JOB_RETENTION_SECONDS``; failed ones are kept for inspection."""
+    if older_than is None:
+        older_than = getattr(settings, 'JOB_RETENTION_SECONDS', 86400)
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return get_collection(Job).delete_many({'status': 'done', 'finished_at': {'$lt': cutoff}}).deleted_count
+
+
+def queue_stats():
+    """Return job counts by status and the lag of the oldest due pending job, in seconds."""
+    collection = get_collection(Job)
+    stats = {status: collection.count_documents({'status': status}) for status in STATUSES}
+    now = timezone.now()
+    oldest = collection.find_one({'status': 'pending', 'run_at': {'$lte': now}}, {'run_at': 1}, sort=[('run_at', 1)])
+    lag = 0.0
+    if oldest:
+        lag = max((now.replace(tzinfo=None) - oldest['run_at'].replace(tzinfo=None)).total_seconds(), 0.0)
+    stats['lag_seconds'] = round(lag, 3)
+    return stats
+
+
+def metric_lines():
+    stats = queue_stats()
+    lines = ['# HELP octofit_jobs Jobs in the queue by status.', '# TYPE octofit_jobs gauge']
+    lines += [f'octofit_jobs{{status="{status}"}} {stats[status]}' for status in STATUSES]
+    lines += [
+        '# HELP octofit_jobs_lag_seconds Age of the oldest due pending job.',
+        '# TYPE octofit_jobs_lag_seconds gauge',
+        f"octofit_jobs_lag_seconds {stats['lag_seconds']}",
+    ]
+    return lines
+
+
+REGISTRY.add_collector(metric_lines)
+
+
+class WorkerPool:
+    """Threads that claim and run jobs until stopped (or, in burst mode, until the queue is empty)."""
+
+    def __init__(self, threads=1, poll_seconds=None, burst=False):
+        self.threads = threads
+        self.poll_seconds = poll_seconds or getattr(settings, 'JOB_POLL_SECONDS', 1.0)
+        self.burst = burst
+        self.processed = 0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._prefix = f'{socket.gethostname()}:{os.getpid()}'
+
+    def start(self):
+        for number in range(self.threads):
+            worker = threading.Thread(target=self.work, args=(f'{self._prefix}:{number}',),
+                                      name=f'job-worker-{number}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        self.join(timeout)
+
+    def join(self, timeout=None):
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def work(self, worker_id):
+        while not self._stopping.is_set():
+            job = claim(worker_id)
+            if job is None:
+                if self.burst:
+                    return
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                continue
+            run_job(job)
+            with self._lock:
+                self.processed += 1
+
+
+_local_pool = None
+_local_pool_lock = threading.Lock()
+
+
+def wake_local_workers():
+    """Start this process's worker threads if configured, and wake them for new work."""
+    global _local_pool
+    threads = getattr(settings, 'JOB_QUEUE_LOCAL_WORKERS', 0)
+    if not threads:
+        return
+    if _local_pool is None:
+        with _local_pool_lock:
+            if _local_pool is None:
+                pool = WorkerPool(threads)
+                pool.start()
+                _local_pool = pool
+    _local_pool.wake()
@@ -0,0 +1,95 @@
+"""
+Incremental leaderboard maintenance.
+
+Every activity write is turned into a per-user delta of points, calories and
+activity count, applied with an atomic ``$inc``. Ranks use competition ranking
+(``1 + number of users with more points``), so when a user's points move from
+``old`` to ``new`` only the users whose points lie between the two change rank,
+and they all move by exactly one place. That range is shifted with a single
+``update_many`` instead of rewriting the whole ordering. The in-process
+rank index (see ``rank_index``) is updated alongside.
+"""
+from collections import defaultdict
+
+from django.utils import timezone
+from pymongo import ReturnDocument
+
+from .models import Leaderboard
+from .mongo import get_collection
+from .rank_index import record_points
+
+POINTS_PER_ACTIVITY = 10
+POINTS_PER_KM = 50
+
+
+def activity_points(calories_burned, distance):
+    """Points for one activity: 1 per calorie, 10 per activity and 50 per km."""
+    return calories_burned + POINTS_PER_ACTIVITY + int((distance or 0) * POINTS_PER_KM)
+
+
+def activity_deltas(removed=(), added=()):
+    """
+    Aggregate activities into ``{email: [points, calories, activities]}`` deltas.
+
+    ``removed`` and ``added`` are iterables of objects (or dicts) with
+    ``user_email``, ``calories_burned`` and ``distance``; an update is the old
+    version removed plus the new version added.
+    """
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for sign, activities in ((-1, removed), (1, added)):
+        for activity in activities:
+            if isinstance(activity, dict):
+                email, calories, distance = activity['user_email'], activity['calories_burned'], activity.get('distance')
+            else:
+                email, calories, distance = activity.user_email, activity.calories_burned, activity.distance
+            delta = deltas[email]
+            delta[0] += sign * activity_points(calories, distance)
+            delta[1] += sign * calories
+            delta[2] += sign
+    return {email: delta for email, delta in deltas.items() if any(delta)}
+
+
+def apply_delta(user_email, points, calories, activities):
+    """
+    Apply one user's delta and repair the ranks it affects.
+
+    Returns the user's updated leaderboard document.
+    """
+    collection = get_collection(Leaderboard)
+    before = collection.find_one_and_update(
+        {'user_email': user_email},
+        {
+            '$inc': {'total_points': points, 'total_calories': calories, 'total_activities': activities},
+            '$set': {'updated_at': timezone.now()},
+        },
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+    old_points = before['total_points'] if before else None
+    new_points = (old_points or 0) + points
+    record_points(user_email, new_points)
+
+    others = {'user_email': {'$ne': user_email}}
+    if old_points is None:
+        collection.update_many({**others, 'total_points': {'$lt': new_points}}, {'$inc': {'rank': 1}})
+    elif new_points > old_points:
+        collection.update_many({**others, 'total_points': {'$gte': old_points, '$lt': new_points}}, {'$inc': {'rank': 1}})
+    elif new_points < old_points:
+        collection.update_many({**others, 'total_points': {'$gte': new_points, '$lt': old_points}}, {'$inc': {'rank': -1}})
+
+    rank = collection.count_documents({'total_points': {'$gt': new_points}}) + 1
+    return collection.find_one_and_update(
+        {'user_email': user_email},
+        {'$set': {'rank': rank}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def apply_deltas(deltas):
+    """Apply a ``{email: [points, calories, activities]}`` mapping one user at a time."""
+    return [apply_delta(email, *delta) for email, delta in deltas.items()]
+
+
+def record_activity_change(removed=(), added=()):
+    """Update the leaderboard for activities that were removed and/or added."""
+    return apply_deltas(activity_deltas(removed, added))
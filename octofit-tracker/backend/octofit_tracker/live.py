@@ -0,0 +1,406 @@
+"""
+Live leaderboard updates as server-sent events.
+
+Clients subscribe to ``/api/leaderboard/stream/`` instead of polling
+``/api/leaderboard/``. Every activity write produces one event with just
+the leaderboard rows it changed. Each process publishes it once to an
+in-process ``ChangeFeed`` that all of its subscribers share, so the database
+is not queried per subscriber. Each event's ``data`` is a list of changes,
+applied in order:
+
+    {"row": <leaderboard row>, "shift": {"from_points": lo, "to_points": hi, "by": 1}}
+
+``row`` replaces the user's row. Every other user whose points lie in
+``[from_points, to_points)`` moves ``by`` places, exactly as
+``leaderboard.apply_delta`` shifted them in the collection. That keeps the
+event size independent of how many ranks moved.
+
+Events are numbered by the ``seq`` they are stored under in the
+``leaderboard_events`` collection, the same in every process. Every write
+that changes the leaderboard stores its event there, whether it is applied
+inline or by a job worker (``ACTIVITY_POSTPROCESSING = 'queue'``), often in
+another process. Every web process with subscribers runs an ``EventRelay``
+thread that polls the collection and publishes the new events to its feed
+in ``seq`` order. The SSE event id is the ``seq``. A reconnecting client
+sends it as ``Last-Event-ID``, to whichever process it reaches, and gets the
+events after it: from the feed's history, or else from the collection.
+Events it already has are not sent again. When the events it missed are no
+longer stored, or the client falls too far behind, it gets a ``reset``
+event and should re-fetch the leaderboard.
+
+The stream is served by a small ASGI app in front of Django (see
+``asgi.py``), because Django 4.1 cannot stream from async views. It is only
+available when the project runs under an ASGI server such as uvicorn or
+daphne (``octofit_tracker.asgi:application``). Under ``manage.py runserver``
+or another WSGI server, the path answers 501 right away instead of holding
+a worker, and the frontend falls back to polling ``/api/leaderboard/``.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+
+from .documents import leaderboard_row, load_user_documents
+from .mongo import get_database
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = '/api/leaderboard/stream/'
+EVENTS_TABLE = 'leaderboard_events'
+EVENTS_TTL_INDEX = 'leaderboard_event_ttl_idx'
+# Holds the last ``seq`` handed out, next to the events
+COUNTER_ID = 'counter'
+
+# Queued in place of events when a subscriber has to start over.
+RESET = (None, None)
+
+
+class Subscription:
+    """One subscriber's bounded event queue on its own event loop."""
+
+    def __init__(self, feed, loop, max_queue, after=None):
+        self.feed = feed
+        self.loop = loop
+        self.queue = asyncio.Queue(max_queue)
+        # Events up to this id reached the client before, possibly from another process
+        self.after = after
+        # ``(after, until]`` ids the caller reads from the store, when the history is too short
+        self.missing = None
+
+    def push(self, item):
+        """Queue ``(event id, data)`` from any thread."""
+        self.loop.call_soon_threadsafe(self._put, item)
+
+    def _put(self, item):
+        if item[0] is not None and self.after is not None and item[0] <= self.after:
+            return
+        if self.queue.full():
+            # Too far behind: drop the backlog and have the client re-fetch
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            item = RESET
+        self.queue.put_nowait(item)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.feed.unsubscribe(self)
+
+
+def encode(payload):
+    return json.dumps(payload, separators=(',', ':'))
+
+
+class ChangeFeed:
+    """
+    Thread-safe in-process pub/sub with a replay history of recent events.
+
+    Events are published in increasing id order. The history holds every
+    event after ``since`` that is still within ``history_size``.
+    """
+
+    def __init__(self, history_size=256, max_queue=1000):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=history_size)
+        self.last_id = 0
+        self.since = 0
+        self.max_queue = max_queue
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def publish(self, event_id, payload):
+        """Encode ``payload`` once and queue it for every subscriber as event ``event_id``."""
+        item = (event_id, encode(payload))
+        with self._lock:
+            if len(self._history) == self._history.maxlen:
+                self.since = self._history[0][0]
+            self.last_id = event_id
+            self._history.append(item)
+            subscribers = list(self._subscribers)
+        self._push(subscribers, item)
+
+    def skip_to(self, event_id):
+        """Continue after ``event_id`` without the events before it; subscribers are told to reset."""
+        with self._lock:
+            if event_id <= self.last_id:
+                return
+            self.last_id = self.since = event_id
+            self._history.clear()
+            subscribers = list(self._subscribers)
+        self._push(subscribers, RESET)
+
+    def _push(self, subscribers, item):
+        for subscription in subscribers:
+            try:
+                subscription.push(item)
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                self.unsubscribe(subscription)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Subscribe on the running event loop.
+
+        Returns ``(subscription, backlog)``: the events after ``last_event_id``
+        from the history. The backlog is None when the history does not
+        reach back that far; the events in ``subscription.missing`` are then
+        read with ``stored_events``.
+        """
+        subscription = Subscription(self, asyncio.get_running_loop(), self.max_queue, last_event_id)
+        with self._lock:
+            self._subscribers.add(subscription)
+            backlog = []
+            if last_event_id is not None and last_event_id < self.last_id:
+                if last_event_id >= self.since:
+                    backlog = [item for item in self._history if item[0] > last_event_id]
+                else:
+                    backlog = None
+                    subscription.missing = (last_event_id, self.last_id)
+        return subscription, backlog
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+FEED = ChangeFeed(
+    history_size=getattr(settings, 'LEADERBOARD_STREAM_HISTORY', 256),
+    max_queue=getattr(settings, 'LEADERBOARD_STREAM_QUEUE_SIZE', 1000),
+)
+
+
+def stream_unavailable(request):
+    """Answer the stream path when Django is served over WSGI, where it cannot stream."""
+    return JsonResponse({'detail': 'The live leaderboard stream needs an ASGI server; poll /api/leaderboard/ instead.'},
+                        status=501)
+
+
+def leaderboard_changes(rows, deltas, users):
+    """Build the ordered change list for ``leaderboard.apply_deltas`` output."""
+    changes = []
+    for row, delta in zip(rows, deltas.values()):
+        new_points = row['total_points']
+        old_points = new_points - delta[0]
+        # A new entry starts from 0 points; nobody has fewer, so that range
+        # is the same as "everyone below the new score"
+        change = {'row': leaderboard_row(row, users), 'shift': None}
+        if old_points != new_points:
+            change['shift'] = {
+                'from_points': min(old_points, new_points),
+                'to_points': max(old_points, new_points),
+                'by': 1 if new_points > old_points else -1,
+            }
+        changes.append(change)
+    return changes
+
+
+def get_events_collection():
+    return get_database()[EVENTS_TABLE]
+
+
+def create_event_indexes(collection):
+    """Create the ``seq`` index relays read by and the TTL index that expires old events."""
+    ttl = getattr(settings, 'LEADERBOARD_EVENTS_TTL_SECONDS', 3600)
+    collection.create_index([('seq', 1)], name='leaderboard_event_seq_idx')
+    try:
+        collection.create_index([('created_at', 1)], name=EVENTS_TTL_INDEX, expireAfterSeconds=ttl)
+    except OperationFailure:
+        collection.database.command('collMod', collection.name,
+                                    index={'name': EVENTS_TTL_INDEX, 'expireAfterSeconds': ttl})
+
+
+def store_leaderboard_changes(rows, deltas):
+    """Store the rows an activity write changed as the next event for the relays; returns its ``seq``."""
+    if not rows:
+        return None
+    collection = get_events_collection()
+    seq = collection.find_one_and_update(
+        {'_id': COUNTER_ID}, {'$inc': {'value': 1}}, upsert=True, return_document=ReturnDocument.AFTER,
+    )['value']
+    users = load_user_documents(row['user_email'] for row in rows)
+    collection.insert_one({'seq': seq, 'changes': leaderboard_changes(rows, deltas, users),
+                           'created_at': timezone.now()})
+    if _relay is not None:
+        _relay.wake()
+    return seq
+
+
+def stored_events(after, until):
+    """Read the events ``(after, until]`` back as feed items, or ``[RESET]`` when some are gone."""
+    events = get_events_collection().find({'seq': {'$gt': after, '$lte': until}}).sort('seq', 1)
+    items = [(event['seq'], encode(event['changes'])) for event in events]
+    if [seq for seq, _ in items] != list(range(after + 1, until + 1)):
+        return [RESET]
+    return items
+
+
+class EventRelay:
+    """
+    Publishes the events stored in ``leaderboard_events`` to a feed.
+
+    Writers take their ``seq`` before inserting, so a later event can become
+    visible before an earlier one. A missing ``seq`` is therefore waited for,
+    up to ``gap_seconds``, before it is skipped and subscribers are reset.
+    """
+
+    def __init__(self, feed, poll_seconds=0.5, gap_seconds=2.0):
+        self.feed = feed
+        self.poll_seconds = poll_seconds
+        self.gap_seconds = gap_seconds
+        self.last_seq = None
+        self._gap_since = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def poll(self):
+        """Publish the events stored since the last poll; returns how many were published."""
+        with self._lock:
+            collection = get_events_collection()
+            if self.last_seq is None:
+                # Start from now: earlier events are read from the store on demand
+                counter = collection.find_one({'_id': COUNTER_ID})
+                self.last_seq = counter['value'] if counter else 0
+                self.feed.skip_to(self.last_seq)
+                return 0
+            published = 0
+            for event in collection.find({'seq': {'$gt': self.last_seq}}).sort('seq', 1):
+                if event['seq'] != self.last_seq + 1:
+                    now = time.monotonic()
+                    if self._gap_since is None:
+                        self._gap_since = now
+                    if now - self._gap_since < self.gap_seconds:
+                        break
+                    self.feed.skip_to(event['seq'] - 1)
+                self._gap_since = None
+                self.feed.publish(event['seq'], event['changes'])
+                self.last_seq = event['seq']
+                published += 1
+            return published
+
+    def wake(self):
+        """Poll now instead of at the next interval, e.g. after this process stored an event."""
+        self._wake.set()
+
+    def run(self):
+        while True:
+            if self.feed.has_subscribers:
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception('Relaying leaderboard events failed')
+            else:
+                # Nobody to replay a gap to; pick up from the latest event on the next subscriber
+                with self._lock:
+                    self.last_seq = None
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def start_relay():
+    """Start this process's relay thread, and position it at the latest event if it is idle."""
+    global _relay
+    with _relay_lock:
+        if _relay is None:
+            relay = EventRelay(FEED, getattr(settings, 'LEADERBOARD_EVENTS_POLL_SECONDS', 0.5))
+            threading.Thread(target=relay.run, name='leaderboard-event-relay', daemon=True).start()
+            _relay = relay
+    if _relay.last_seq is None:
+        # Before the subscriber is added, so it cannot be reset for events it never missed
+        _relay.poll()
+
+
+def format_event(item):
+    event_id, data = item
+    if event_id is None:
+        return b'event: reset\ndata: {}\n\n'
+    return f'id: {event_id}\nevent: leaderboard\ndata: {data}\n\n'.encode()
+
+
+def _last_event_id(scope):
+    for name, value in scope.get('headers', ()):
+        if name == b'last-event-id':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def leaderboard_stream(scope, receive, send):
+    """ASGI app streaming leaderboard changes until the client disconnects."""
+    if scope['method'] != 'GET':
+        await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, start_relay)
+    subscription, backlog = FEED.subscribe(_last_event_id(scope))
+    try:
+        if backlog is None:
+            backlog = await loop.run_in_executor(None, stored_events, *subscription.missing)
+        headers = [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # Stop nginx and similar proxies from buffering the stream
+            (b'x-accel-buffering', b'no'),
+        ]
+        if getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False):
+            headers.append((b'access-control-allow-origin', b'*'))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        retry = getattr(settings, 'LEADERBOARD_STREAM_RETRY_MS', 3000)
+        body = f'retry: {retry}\n\n'.encode() + b''.join(format_event(item) for item in backlog)
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+        heartbeat = getattr(settings, 'LEADERBOARD_STREAM_HEARTBEAT_SECONDS', 15)
+        disconnected = asyncio.ensure_future(receive())
+        event = None
+        try:
+            while True:
+                if event is None:
+                    event = asyncio.ensure_future(subscription.get())
+                done, _ = await asyncio.wait({event, disconnected}, timeout=heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    if disconnected.result()['type'] == 'http.disconnect':
+                        return
+                    disconnected = asyncio.ensure_future(receive())
+                if event in done:
+                    chunk = format_event(event.result())
+                    event = None
+                elif not done:
+                    chunk = b': keepalive\n\n'
+                else:
+                    continue
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            disconnected.cancel()
+            if event is not None:
+                event.cancel()
+    finally:
+        subscription.close()
+
+
+def with_leaderboard_stream(application):
+    """Wrap the Django ASGI application so ``STREAM_PATH`` is served by ``leaderboard_stream``."""
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+            return await leaderboard_stream(scope, receive, send)
+        return await application(scope, receive, send)
+    return router
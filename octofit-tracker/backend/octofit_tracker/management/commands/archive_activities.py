@@ -0,0 +1,46 @@
+import re
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from octofit_tracker.archive import archive_activities, count_archivable
+
+AGE = re.compile(r'^(\d+)([hdw]?)$')
+UNITS = {'h': 'hours', 'd': 'days', 'w': 'weeks', '': 'days'}
+
+
+def parse_age(value):
+    """Parse ``12h``, ``365d`` or ``52w`` (plain numbers are days) into a ``timedelta``."""
+    match = AGE.match(value.strip())
+    if not match:
+        raise CommandError(f'Invalid age {value!r}; expected e.g. 365d, 52w or 12h')
+    return timedelta(**{UNITS[match.group(2)]: int(match.group(1))})
+
+
+class Command(BaseCommand):
+    help = ('Move activities older than --older-than from the activities collection into the compressed '
+            'activities_archive collection; totals and rollups are unchanged')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', required=True, help='Age of the activities to archive, e.g. 365d')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Activities moved per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Count the activities without moving them')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be >= 1')
+        cutoff = timezone.now() - parse_age(options['older_than'])
+        if options['dry_run']:
+            self.stdout.write(f'{count_archivable(cutoff):,} activities dated before {cutoff:%Y-%m-%d %H:%M}')
+            return
+        started = time.perf_counter()
+        moved = archive_activities(cutoff, batch_size=options['batch_size'], progress=self.progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved:,} activities dated before {cutoff:%Y-%m-%d %H:%M} in {elapsed:.1f}s'
+        ))
+
+    def progress(self, moved):
+        self.stdout.write(f'  {moved:,} activities')
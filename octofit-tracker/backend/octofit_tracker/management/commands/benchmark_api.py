@@ -0,0 +1,238 @@
+import itertools
+import json
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from octofit_tracker.models import Activity, Leaderboard, Team, User, Workout
+from octofit_tracker.mongo import get_collection
+from octofit_tracker.urls import router
+
+from .benchmark_read_path import percentile
+
+# Dataset sizes as (users, activities per user)
+SCALES = {
+    '1k': (100, 10),
+    '100k': (2000, 50),
+    '1m': (10000, 100),
+}
+
+# GET endpoints that need query parameters; values are formatted with the sample
+ACTION_PARAMS = {
+    'search-list': {'q': '{team}'},
+    'leaderboard-me': {'email': '{email}'},
+    'leaderboard-around': {'email': '{email}'},
+    'stats-rollups': {'team': '{team}'},
+    'workout-recommended': {'email': '{email}'},
+}
+
+# Streaming exports read the whole collection and are not request/response shaped
+SKIPPED_ACTIONS = {'activity-export'}
+
+CREATE_PAYLOADS = {
+    'user': lambda n, sample: {
+        'username': f'bench{n}', 'name': f'Bench User {n}', 'email': f'bench{n}@bench.octofit.test',
+        'team': sample['team'],
+    },
+    'team': lambda n, sample: {'name': f'Bench Team {n}', 'description': 'Benchmark team'},
+    'activity': lambda n, sample: {
+        'user_email': sample['email'], 'activity_type': 'running', 'duration': 30, 'distance': 5.0,
+        # Distinct dates, so concurrent creates are not deduplicated as repeats
+        'calories_burned': 300, 'date': (timezone.now() + timedelta(milliseconds=n)).isoformat(),
+    },
+    'workout': lambda n, sample: {
+        'name': f'Bench Workout {n}', 'description': 'Benchmark workout', 'difficulty': 'Beginner',
+        'duration': 20, 'calories_estimate': 150,
+    },
+}
+
+DB_COMMANDS = re.compile(r'desc="(\d+) commands"')
+
+
+def endpoint_cases(sample):
+    """Yield ``(label, method, url, payload factory)`` for every router endpoint."""
+    def query(label):
+        params = {name: value.format(**sample) for name, value in ACTION_PARAMS.get(label, {}).items()}
+        return '?' + urlencode(params) if params else ''
+
+    for prefix, viewset, basename in router.registry:
+        yield f'{basename}-list', 'GET', f'/api/{prefix}/' + query(f'{basename}-list'), None
+        queryset = getattr(viewset, 'queryset', None)
+        if queryset is not None:
+            document = get_collection(queryset.model).find_one({}, {'_id': 1})
+            if document:
+                yield f'{basename}-detail', 'GET', f"/api/{prefix}/{document['_id']}/", None
+        for extra in viewset.get_extra_actions():
+            label = f'{basename}-{extra.url_name}'
+            if 'get' not in extra.mapping or extra.detail or label in SKIPPED_ACTIONS:
+                continue
+            yield label, 'GET', f"/api/{prefix}/{extra.url_path}/" + query(label), None
+        if basename in CREATE_PAYLOADS and hasattr(viewset, 'create'):
+            yield f'{basename}-create', 'POST', f'/api/{prefix}/', CREATE_PAYLOADS[basename]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a deterministic dataset (into an empty database unless --reset) and drive every router '
+        'endpoint with concurrent clients, optionally failing on regressions against a stored baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='1k',
+                            help='Dataset size in activities')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the dataset')
+        data = parser.add_mutually_exclusive_group()
+        data.add_argument('--reset', action='store_true',
+                          help='Replace the data in the database with the seeded dataset (populate_db)')
+        data.add_argument('--skip-seed', action='store_true', help='Benchmark the data already in the database')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+        parser.add_argument('--endpoint', action='append', default=[],
+                            help='Only run endpoints whose label contains this text (repeatable)')
+        parser.add_argument('--baseline', help='JSON results to compare against; regressions fail the run')
+        parser.add_argument('--save-baseline', help='Write this run\'s results to a JSON file')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative p95 latency increase or req/s drop against the baseline')
+        parser.add_argument('--in-process', action='store_true',
+                            help='Run against an in-memory mongomock database instead of MongoDB')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be >= 1')
+        if options['in_process']:
+            self.use_in_process_database()
+        # Seeding goes through populate_db, which deletes everything first
+        if not options['skip_seed'] and not options['reset'] and self.has_data():
+            raise CommandError('The database already has data; pass --reset to replace it with the seeded '
+                               'dataset or --skip-seed to benchmark it as is')
+        if not options['skip_seed']:
+            users, per_user = SCALES[options['scale']]
+            self.stdout.write(f"Seeding {options['scale']} activities (seed {options['seed']})...")
+            call_command('populate_db', users=users, activities_per_user=per_user, days=365,
+                         seed=options['seed'], stdout=self.stdout)
+
+        leader = get_collection(Leaderboard).find_one({}, {'user_email': 1}) or {}
+        team = get_collection(Team).find_one({}, {'name': 1}) or {}
+        sample = {'email': leader.get('user_email', ''), 'team': team.get('name', '')}
+
+        cases = [
+            case for case in endpoint_cases(sample)
+            if not options['endpoint'] or any(text in case[0] for text in options['endpoint'])
+        ]
+        # Writes last, so reads see the seeded dataset
+        cases.sort(key=lambda case: case[1] != 'GET')
+
+        results = {}
+        self.stdout.write(f"{options['requests']} requests per endpoint, {options['concurrency']} concurrent")
+        self.stdout.write(f"{'endpoint':<28} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                          f"{'db cmds':>8} {'errors':>7}")
+        # The test client always sends Host: testserver; DB command counts come from Server-Timing
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                               REQUEST_METRICS_SERVER_TIMING=True):
+            for label, method, url, payload in cases:
+                results[label] = self.run_case(method, url, payload, sample, options)
+                self.report(label, results[label])
+
+        document = {'scale': options['scale'], 'seed': options['seed'], 'results': results}
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as handle:
+                json.dump(document, handle, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved results to {options['save_baseline']}")
+        if options['baseline']:
+            self.compare(document, options['baseline'], options['tolerance'])
+
+    def has_data(self):
+        return any(get_collection(model).find_one({}, {'_id': 1})
+                   for model in (User, Team, Activity, Leaderboard, Workout))
+
+    def use_in_process_database(self):
+        """Point the default connection at a fresh mongomock database and create the schema."""
+        try:
+            import mongomock
+        except ImportError:
+            raise CommandError('--in-process needs the mongomock package (pip install mongomock)')
+        import djongo.database
+
+        client = mongomock.MongoClient()
+        djongo.database.connect = lambda *args, **kwargs: client
+        connections['default'].close()
+        call_command('migrate', run_syncdb=True, verbosity=0)
+
+    def run_case(self, method, url, payload, sample, options):
+        counter = itertools.count()
+        local = threading.local()
+
+        def fetch(_):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            started = time.perf_counter()
+            if method == 'GET':
+                response = client.get(url)
+            else:
+                response = client.post(url, payload(next(counter), sample), content_type='application/json')
+            elapsed = time.perf_counter() - started
+            commands = DB_COMMANDS.search(response.get('Server-Timing', ''))
+            return elapsed, response.status_code, int(commands.group(1)) if commands else 0
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            samples = list(pool.map(fetch, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency * 1000 for latency, _, _ in samples]
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for _, status, _ in samples if status >= 400),
+            'rps': round(len(samples) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'db_commands': round(statistics.mean(commands for _, _, commands in samples), 2),
+        }
+
+    def report(self, label, result):
+        style = self.style.ERROR if result['errors'] else (lambda text: text)
+        self.stdout.write(style(
+            f"{label:<28} {result['rps']:>9.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+            f"{result['p99_ms']:>8.1f} {result['db_commands']:>8.1f} {result['errors']:>7}"
+        ))
+
+    def compare(self, document, path, tolerance):
+        """Fail when an endpoint got slower, lost throughput or issues more DB commands than the baseline."""
+        with open(path) as handle:
+            baseline = json.load(handle)
+        if baseline.get('scale') != document['scale']:
+            raise CommandError(f"Baseline is for scale {baseline.get('scale')}, this run is {document['scale']}")
+
+        regressions = []
+        for label, result in document['results'].items():
+            expected = baseline['results'].get(label)
+            if expected is None:
+                continue
+            if result['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{label}: p95 {expected['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms")
+            if result['rps'] < expected['rps'] * (1 - tolerance):
+                regressions.append(f"{label}: {expected['rps']:.1f} -> {result['rps']:.1f} req/s")
+            # Command counts are deterministic for a given dataset, so any growth is an N+1 smell
+            if result['db_commands'] > expected['db_commands'] + 0.5:
+                regressions.append(
+                    f"{label}: {expected['db_commands']:.1f} -> {result['db_commands']:.1f} DB commands per request"
+                )
+            if result['errors'] > expected['errors']:
+                regressions.append(f"{label}: {expected['errors']} -> {result['errors']} errors")
+        if regressions:
+            raise CommandError('Regressions against baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {path} (tolerance {tolerance:.0%})'))
@@ -0,0 +1,78 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from octofit_tracker.async_views import THREADS
+
+ENDPOINTS = {
+    'leaderboard': ('/api/leaderboard/', '/api/async/leaderboard/'),
+    'activities': ('/api/activities/', '/api/async/activities/'),
+    'stats': ('/api/stats/teams/', '/api/async/stats/teams/'),
+}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = 'Compare the sync (WSGI) and async (ASGI) read paths under concurrent in-process load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='leaderboard')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50)
+
+    def handle(self, *args, **options):
+        sync_url, async_url = ENDPOINTS[options['endpoint']]
+        total, concurrency = options['requests'], options['concurrency']
+        self.stdout.write(f'{total} requests, {concurrency} concurrent')
+        # The test clients always send Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            self.report('sync (WSGI, threads)', *self.run_sync(sync_url, total, concurrency))
+            # Async requests run at most THREADS database calls at once
+            self.report(f'async (ASGI, {THREADS} threads)', *asyncio.run(self.run_async(async_url, total, concurrency)))
+
+    def run_sync(self, url, total, concurrency):
+        def fetch(_):
+            client = Client()
+            started = time.perf_counter()
+            status = client.get(url).status_code
+            return time.perf_counter() - started, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(fetch, range(total)))
+        return results, time.perf_counter() - started
+
+    async def run_async(self, url, total, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url)
+                return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(fetch() for _ in range(total)))
+        return results, time.perf_counter() - started
+
+    def report(self, label, results, elapsed):
+        latencies = [latency * 1000 for latency, _ in results]
+        errors = sum(1 for _, status in results if status != 200)
+        self.stdout.write(
+            f'{label:<26} {len(results) / elapsed:>8.1f} req/s  '
+            f'p50 {statistics.median(latencies):.1f} ms  '
+            f'p95 {percentile(latencies, 0.95):.1f} ms  '
+            f'p99 {percentile(latencies, 0.99):.1f} ms  '
+            f'errors {errors}'
+        )
@@ -0,0 +1,55 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from octofit_tracker.documents import activity_row
+from octofit_tracker.middleware import brotli
+from octofit_tracker.renderers import ORJSONRenderer
+
+from .benchmark_serializers import activity_documents
+
+
+class Command(BaseCommand):
+    help = 'Measure JSON rendering and response compression on a large activity list payload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Rows in the rendered list')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs; the best is reported')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError('--rows and --repeat must be >= 1')
+        now = timezone.now().replace(tzinfo=None)
+        users = {f'athlete{n}@octofit.test': {'name': f'Athlete {n}', 'team': 'Team A'} for n in range(100)}
+        payload = {'next': None, 'results': activity_row.rows(activity_documents(options['rows'], now), users)}
+
+        self.stdout.write(f"Rendering {options['rows']:,} activity rows, best of {options['repeat']}")
+        for label, renderer in (('drf json', JSONRenderer()), ('orjson', ORJSONRenderer())):
+            seconds, body = self.best(options['repeat'], lambda: renderer.render(payload))
+            self.stdout.write(f'  {label:<10} {seconds * 1000:8.1f} ms  {len(body) / seconds / 2 ** 20:8.1f} MiB/s')
+
+        self.stdout.write(f'Compressing the {len(body):,} byte body')
+        codecs = [(f'gzip -{level}', lambda level=level: gzip.compress(body, compresslevel=level))
+                  for level in (1, 6, 9)]
+        if brotli is not None:
+            codecs += [(f'br q{quality}', lambda quality=quality: brotli.compress(body, quality=quality))
+                       for quality in (1, 4, 11)]
+        else:
+            self.stdout.write(self.style.WARNING('  brotli not installed; skipping br'))
+        for label, compress in codecs:
+            seconds, compressed = self.best(options['repeat'], compress)
+            self.stdout.write(
+                f'  {label:<10} {seconds * 1000:8.1f} ms  {len(compressed):>10,} bytes '
+                f'({len(compressed) / len(body):.1%})'
+            )
+
+    def best(self, repeat, function):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - started)
+        return min(timings), result
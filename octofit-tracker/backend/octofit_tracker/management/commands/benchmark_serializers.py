@@ -0,0 +1,93 @@
+import time
+from datetime import timedelta
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from octofit_tracker.documents import activity_row, leaderboard_row
+from octofit_tracker.models import Activity, Leaderboard, User
+from octofit_tracker.serializers import ActivitySerializer, LeaderboardSerializer
+
+
+def activity_documents(count, now):
+    return [
+        {
+            '_id': ObjectId(),
+            'user_email': f'athlete{n % 100}@octofit.test',
+            'activity_type': 'running',
+            'duration': 30 + n % 60,
+            'distance': round(n % 20 * 0.5, 2),
+            'calories_burned': 200 + n % 400,
+            'date': now - timedelta(minutes=n),
+            'created_at': now,
+        }
+        for n in range(count)
+    ]
+
+
+def leaderboard_documents(count, now):
+    return [
+        {
+            '_id': ObjectId(),
+            'user_email': f'athlete{n % 100}@octofit.test',
+            'total_points': 10000 - n,
+            'total_calories': 9000 - n,
+            'total_activities': 50,
+            'rank': n + 1,
+            'updated_at': now,
+        }
+        for n in range(count)
+    ]
+
+
+BENCHMARKS = {
+    'activities': (Activity, ActivitySerializer, activity_row, activity_documents),
+    'leaderboard': (Leaderboard, LeaderboardSerializer, leaderboard_row, leaderboard_documents),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF serializer and precompiled row plan throughput on in-memory list pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(BENCHMARKS), default='activities')
+        parser.add_argument('--rows', type=int, default=5000, help='Rows per serialized list')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs; the best is reported')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError('--rows and --repeat must be >= 1')
+        model, serializer_class, plan, build = BENCHMARKS[options['endpoint']]
+        now = timezone.now().replace(tzinfo=None)
+        documents = build(options['rows'], now)
+        user_documents = {
+            f'athlete{n}@octofit.test': {'email': f'athlete{n}@octofit.test', 'name': f'Athlete {n}', 'team': 'Team A'}
+            for n in range(100)
+        }
+        # The serializer path gets the same preloaded user map the list views build.
+        users = {email: User(**user) for email, user in user_documents.items()}
+        instances = [
+            model(**{field.attname: document[field.column] for field in model._meta.concrete_fields
+                     if field.column in document})
+            for document in documents
+        ]
+
+        serializer_time = self.best(options['repeat'], lambda: serializer_class(
+            instances, many=True, context={'users': users},
+        ).data)
+        plan_time = self.best(options['repeat'], lambda: plan.rows(documents, user_documents))
+
+        rows = options['rows']
+        self.stdout.write(f"{options['endpoint']}: {rows:,} rows, best of {options['repeat']}")
+        self.stdout.write(f'  serializer: {rows / serializer_time:>12,.0f} rows/s')
+        self.stdout.write(f'  row plan:   {rows / plan_time:>12,.0f} rows/s')
+        self.stdout.write(self.style.SUCCESS(f'  speedup:    {serializer_time / plan_time:.1f}x'))
+
+    def best(self, repeat, function):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.activity_changes import record_activity_change
+from octofit_tracker.bulk import NATURAL_KEY
+from octofit_tracker.models import Activity
+from octofit_tracker.mongo import get_collection
+
+
+class Command(BaseCommand):
+    help = ('Delete activities that repeat another one\'s (user_email, date, activity_type), keeping the first '
+            'stored, so the unique index on that key can be built')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report duplicates without deleting them')
+
+    def handle(self, *args, **options):
+        collection = get_collection(Activity)
+        groups = collection.aggregate([
+            {'$sort': {'_id': 1}},
+            {'$group': {
+                '_id': {field: f'${field}' for field in NATURAL_KEY},
+                'ids': {'$push': '$_id'},
+                'count': {'$sum': 1},
+            }},
+            {'$match': {'count': {'$gt': 1}}},
+        ], allowDiskUse=True)
+        extra = [object_id for group in groups for object_id in group['ids'][1:]]
+        if options['dry_run']:
+            self.stdout.write(f'{len(extra):,} duplicate activities')
+            return
+        # Take the duplicates back out of the leaderboards, rollups and recommendations as well
+        for start in range(0, len(extra), 1000):
+            chunk = extra[start:start + 1000]
+            removed = list(collection.find({'_id': {'$in': chunk}}))
+            collection.delete_many({'_id': {'$in': chunk}})
+            record_activity_change(removed=removed)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {len(extra):,} duplicate activities'))
@@ -0,0 +1,146 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import UniqueConstraint
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from octofit_tracker.idempotency import TTL_INDEX, create_key_indexes
+from octofit_tracker.live import EVENTS_TTL_INDEX, create_event_indexes, get_events_collection
+from octofit_tracker.models import Activity, ActivityRollup, IdempotencyKey, Leaderboard, User, WorkoutProfile
+from octofit_tracker.mongo import get_collection
+
+# Query shapes served by the API; each must be answered by an index.
+HOT_QUERIES = [
+    (Activity, {}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    (Activity, {'user_email': 'user@example.com'}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    (Activity, {'activity_type': 'running'}, [('date', DESCENDING)]),
+    (Leaderboard, {}, [('rank', ASCENDING), ('_id', ASCENDING)]),
+    (Leaderboard, {'user_email': 'user@example.com'}, None),
+    (Leaderboard, {'total_points': {'$gt': 100}}, None),
+    (User, {'team': 'Team Octocats'}, None),
+    (ActivityRollup, {'scope': 'team', 'key': 'Team Octocats', 'period': 'day'}, [('bucket_start', ASCENDING)]),
+    (WorkoutProfile, {'user_email': 'user@example.com'}, None),
+]
+
+
+def index_keys(model, index):
+    """Translate a Django ``Meta.indexes`` entry or unique constraint into a PyMongo key list."""
+    keys = []
+    for field_name in index.fields:
+        direction = DESCENDING if field_name.startswith('-') else ASCENDING
+        keys.append((model._meta.get_field(field_name.lstrip('-')).column, direction))
+    return keys
+
+
+def declared_indexes(app_label='octofit_tracker'):
+    """
+    Yield ``(model, index name, keys, unique)`` for every index declared on the app's models.
+
+    ``UniqueConstraint`` entries in ``Meta.constraints`` become unique indexes.
+    """
+    for model in apps.get_app_config(app_label).get_models():
+        for index in model._meta.indexes:
+            yield model, index.name, index_keys(model, index), False
+        for constraint in model._meta.constraints:
+            if isinstance(constraint, UniqueConstraint):
+                yield model, constraint.name, index_keys(model, constraint), True
+
+
+def plan_stages(plan):
+    """Yield every stage name in an explain() plan tree."""
+    yield plan.get('stage')
+    for child in ('inputStage', 'queryPlan'):
+        if child in plan:
+            yield from plan_stages(plan[child])
+    for stage in plan.get('inputStages', []):
+        yield from plan_stages(stage)
+
+
+class Command(BaseCommand):
+    help = 'Create the MongoDB indexes declared on the models and verify that hot queries use them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report missing indexes without creating them')
+        parser.add_argument('--check-plans', action='store_true', help='Fail if a hot query plan contains a COLLSCAN')
+
+    def handle(self, *args, **options):
+        collections = {}
+        missing = []
+        for model, name, keys, unique in declared_indexes():
+            collection = collections.setdefault(model, get_collection(model))
+            existing = collection.index_information()
+            if name in existing:
+                self.stdout.write(f'{collection.name}.{name}: present')
+            elif options['dry_run']:
+                missing.append(f'{collection.name}.{name}')
+                self.stdout.write(self.style.WARNING(f'{collection.name}.{name}: missing'))
+            else:
+                try:
+                    collection.create_index(keys, name=name, unique=unique, background=True)
+                except OperationFailure as exc:
+                    # A unique index cannot be built over existing duplicates
+                    missing.append(f'{collection.name}.{name}')
+                    hint = ' (run dedupe_activities first)' if model is Activity else ''
+                    self.stdout.write(self.style.ERROR(f'{collection.name}.{name}: failed{hint}: {exc}'))
+                    continue
+                self.stdout.write(self.style.SUCCESS(f'{collection.name}.{name}: created'))
+
+        # The expiry of idempotency keys cannot be declared on the model
+        keys = collections.setdefault(IdempotencyKey, get_collection(IdempotencyKey))
+        if TTL_INDEX in keys.index_information():
+            self.stdout.write(f'{keys.name}.{TTL_INDEX}: present')
+        elif options['dry_run']:
+            missing.append(f'{keys.name}.{TTL_INDEX}')
+            self.stdout.write(self.style.WARNING(f'{keys.name}.{TTL_INDEX}: missing'))
+        else:
+            create_key_indexes(keys)
+            self.stdout.write(self.style.SUCCESS(f'{keys.name}.{TTL_INDEX}: created'))
+
+        # Nor can the expiry of queued leaderboard stream events, which have no model
+        events = get_events_collection()
+        if EVENTS_TTL_INDEX in events.index_information():
+            self.stdout.write(f'{events.name}.{EVENTS_TTL_INDEX}: present')
+        elif options['dry_run']:
+            missing.append(f'{events.name}.{EVENTS_TTL_INDEX}')
+            self.stdout.write(self.style.WARNING(f'{events.name}.{EVENTS_TTL_INDEX}: missing'))
+        else:
+            create_event_indexes(events)
+            self.stdout.write(self.style.SUCCESS(f'{events.name}.{EVENTS_TTL_INDEX}: created'))
+
+        self.report_usage(collections.values())
+
+        if options['check_plans']:
+            scans = self.check_plans()
+            if scans:
+                raise CommandError('Collection scans in hot query plans:\n' + '\n'.join(scans))
+        if missing:
+            raise CommandError(f'{len(missing)} declared index(es) missing: {", ".join(missing)}')
+
+    def report_usage(self, collections):
+        """Print indexes that have not been used since the server started, via $indexStats."""
+        for collection in collections:
+            try:
+                stats = list(collection.aggregate([{'$indexStats': {}}]))
+            except (OperationFailure, NotImplementedError) as exc:
+                self.stdout.write(self.style.WARNING(f'{collection.name}: $indexStats unavailable ({exc})'))
+                continue
+            for stat in stats:
+                if stat['name'] != '_id_' and stat['accesses']['ops'] == 0:
+                    self.stdout.write(self.style.WARNING(f"{collection.name}.{stat['name']}: unused"))
+
+    def check_plans(self):
+        """Explain every hot query and return descriptions of those that scan the collection."""
+        scans = []
+        for model, query, sort in HOT_QUERIES:
+            cursor = get_collection(model).find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            plan = cursor.explain()['queryPlanner']['winningPlan']
+            stages = set(plan_stages(plan))
+            description = f'{model._meta.db_table} find({query}) sort({sort})'
+            if 'COLLSCAN' in stages:
+                scans.append(description)
+                self.stdout.write(self.style.ERROR(f'{description}: COLLSCAN'))
+            else:
+                self.stdout.write(f'{description}: {", ".join(sorted(s for s in stages if s))}')
+        return scans
@@ -1,276 +1,345 @@
-from django.core.management.base import BaseCommand
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime, timedelta
+from datetime import timedelta
 import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from octofit_tracker.archive import get_archive_collection
+from octofit_tracker.bulk import build_document
+from octofit_tracker.models import (
+    User, Team, Activity, ActivityRollup, Leaderboard, TeamLeaderboard, Workout, WorkoutProfile,
+)
+from octofit_tracker.mongo import get_collection
+from octofit_tracker.rank_index import reset_rank_index
+from octofit_tracker.recommendations import rebuild_recommendations, reset_catalog
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.team_leaderboard import rebuild_team_leaderboard
+from octofit_tracker.stats import iter_user_totals_by_points
+
+TEAMS = [
+    {
+        'name': 'Team Marvel',
+        'description': 'Earth\'s Mightiest Heroes - Assembling fitness champions!'
+    },
+    {
+        'name': 'Team DC',
+        'description': 'Justice League Champions - Fighting for fitness and strength!'
+    },
+    {
+        'name': 'Team GitHub',
+        'description': 'Open Source Athletes - Collaborating for peak performance!'
+    },
+    {
+        'name': 'Team Octocats',
+        'description': 'The Elite Squad - Building better bodies, one commit at a time!'
+    },
+]
+
+# Default roster, used unless --users asks for synthetic users
+HERO_USERS = [
+    # Team Marvel
+    {'username': 'ironman', 'first_name': 'Tony', 'last_name': 'Stark', 'email': 'ironman@marvel.com', 'team': 'Team Marvel'},
+    {'username': 'captainamerica', 'first_name': 'Steve', 'last_name': 'Rogers', 'email': 'captainamerica@marvel.com', 'team': 'Team Marvel'},
+    {'username': 'thor', 'first_name': 'Thor', 'last_name': 'Odinson', 'email': 'thor@marvel.com', 'team': 'Team Marvel'},
+    {'username': 'hulk', 'first_name': 'Bruce', 'last_name': 'Banner', 'email': 'hulk@marvel.com', 'team': 'Team Marvel'},
+    {'username': 'blackwidow', 'first_name': 'Natasha', 'last_name': 'Romanoff', 'email': 'blackwidow@marvel.com', 'team': 'Team Marvel'},
+    {'username': 'spiderman', 'first_name': 'Peter', 'last_name': 'Parker', 'email': 'spiderman@marvel.com', 'team': 'Team Marvel'},
+
+    # Team DC
+    {'username': 'batman', 'first_name': 'Bruce', 'last_name': 'Wayne', 'email': 'batman@dc.com', 'team': 'Team DC'},
+    {'username': 'superman', 'first_name': 'Clark', 'last_name': 'Kent', 'email': 'superman@dc.com', 'team': 'Team DC'},
+    {'username': 'wonderwoman', 'first_name': 'Diana', 'last_name': 'Prince', 'email': 'wonderwoman@dc.com', 'team': 'Team DC'},
+    {'username': 'flash', 'first_name': 'Barry', 'last_name': 'Allen', 'email': 'flash@dc.com', 'team': 'Team DC'},
+    {'username': 'aquaman', 'first_name': 'Arthur', 'last_name': 'Curry', 'email': 'aquaman@dc.com', 'team': 'Team DC'},
+    {'username': 'greenlantern', 'first_name': 'Hal', 'last_name': 'Jordan', 'email': 'greenlantern@dc.com', 'team': 'Team DC'},
+
+    # Team GitHub
+    {'username': 'octocat', 'first_name': 'Octo', 'last_name': 'Cat', 'email': 'octocat@github.com', 'team': 'Team GitHub'},
+    {'username': 'mona', 'first_name': 'Mona', 'last_name': 'Lisa', 'email': 'mona@github.com', 'team': 'Team GitHub'},
+    {'username': 'hubber', 'first_name': 'Happy', 'last_name': 'Hubber', 'email': 'hubber@github.com', 'team': 'Team GitHub'},
+    {'username': 'coder', 'first_name': 'Elite', 'last_name': 'Coder', 'email': 'coder@github.com', 'team': 'Team GitHub'},
+
+    # Team Octocats
+    {'username': 'daftpunktocat', 'first_name': 'Daft', 'last_name': 'Punk', 'email': 'daftpunk@octocats.com', 'team': 'Team Octocats'},
+    {'username': 'yogitocat', 'first_name': 'Yogi', 'last_name': 'Tocat', 'email': 'yogi@octocats.com', 'team': 'Team Octocats'},
+    {'username': 'scubatocat', 'first_name': 'Scuba', 'last_name': 'Tocat', 'email': 'scuba@octocats.com', 'team': 'Team Octocats'},
+    {'username': 'surftocat', 'first_name': 'Surf', 'last_name': 'Tocat', 'email': 'surf@octocats.com', 'team': 'Team Octocats'},
+]
+
+WORKOUTS = [
+    {
+        'name': 'Morning Energizer',
+        'description': 'Start your day with a gentle stretch and light cardio routine',
+        'difficulty': 'beginner',
+        'duration': 20,
+        'calories_estimate': 150
+    },
+    {
+        'name': 'Super Soldier Training',
+        'description': 'High-intensity workout designed by Captain America for peak performance',
+        'difficulty': 'advanced',
+        'duration': 60,
+        'calories_estimate': 800
+    },
+    {
+        'name': 'Asgardian Warrior Routine',
+        'description': 'Thor\'s legendary strength and endurance training from the halls of Asgard',
+        'difficulty': 'advanced',
+        'duration': 90,
+        'calories_estimate': 1200
+    },
+    {
+        'name': 'Spider-Sense Agility',
+        'description': 'Web-slinger\'s agility, flexibility, and reflexes workout',
+        'difficulty': 'intermediate',
+        'duration': 45,
+        'calories_estimate': 600
+    },
+    {
+        'name': 'Bat-Training',
+        'description': 'Batman\'s dark knight conditioning for stealth and strength',
+        'difficulty': 'advanced',
+        'duration': 75,
+        'calories_estimate': 950
+    },
+    {
+        'name': 'Kryptonian Power Workout',
+        'description': 'Superman\'s ultimate strength and endurance training regimen',
+        'difficulty': 'advanced',
+        'duration': 120,
+        'calories_estimate': 1500
+    },
+    {
+        'name': 'Amazonian Combat Training',
+        'description': 'Wonder Woman\'s warrior workout combining strength and grace',
+        'difficulty': 'advanced',
+        'duration': 60,
+        'calories_estimate': 850
+    },
+    {
+        'name': 'Speed Force Cardio',
+        'description': 'Flash\'s lightning-fast cardio routine for explosive speed',
+        'difficulty': 'intermediate',
+        'duration': 30,
+        'calories_estimate': 700
+    },
+    {
+        'name': 'Yoga Flow for Beginners',
+        'description': 'Gentle yoga poses to improve flexibility and mindfulness',
+        'difficulty': 'beginner',
+        'duration': 30,
+        'calories_estimate': 200
+    },
+    {
+        'name': 'HIIT Blast',
+        'description': 'High-Intensity Interval Training for maximum calorie burn',
+        'difficulty': 'intermediate',
+        'duration': 25,
+        'calories_estimate': 400
+    },
+    {
+        'name': 'Core Crusher',
+        'description': 'Intense abdominal and core strengthening exercises',
+        'difficulty': 'intermediate',
+        'duration': 20,
+        'calories_estimate': 250
+    },
+    {
+        'name': 'Marathon Training',
+        'description': 'Long-distance running program for endurance athletes',
+        'difficulty': 'advanced',
+        'duration': 90,
+        'calories_estimate': 1100
+    },
+]
+
+# Speeds in km/h, calorie burn per minute
+ACTIVITY_TYPES_WITH_DISTANCE = {
+    'running': {'speed_range': (5, 15), 'cal_per_min': (10, 15)},
+    'cycling': {'speed_range': (15, 30), 'cal_per_min': (8, 12)},
+    'swimming': {'speed_range': (2, 4), 'cal_per_min': (11, 14)},
+    'walking': {'speed_range': (3, 6), 'cal_per_min': (4, 6)},
+}
+
+ACTIVITY_TYPES_NO_DISTANCE = {
+    'yoga': {'cal_per_min': (3, 5)},
+    'strength': {'cal_per_min': (6, 9)},
+    'crossfit': {'cal_per_min': (12, 16)},
+    'boxing': {'cal_per_min': (10, 14)},
+    'martial arts': {'cal_per_min': (8, 12)},
+    'pilates': {'cal_per_min': (4, 6)},
+    'hiit': {'cal_per_min': (14, 18)},
+}
+
+ALL_ACTIVITY_TYPES = list(ACTIVITY_TYPES_WITH_DISTANCE) + list(ACTIVITY_TYPES_NO_DISTANCE)
 
 
 class Command(BaseCommand):
-    help = 'Populate the octofit_db database with test data'
+    help = 'Populate the octofit_db database with test data, optionally at load-test scale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=0,
+                            help='Generate this many synthetic users instead of the superhero roster')
+        parser.add_argument('--activities-per-user', type=int, default=None,
+                            help='Activities per user (default: random 8-15)')
+        parser.add_argument('--days', type=int, default=30,
+                            help='Spread activities over this many past days')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Random seed for a reproducible dataset')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Documents per insert_many call')
+
+    def handle(self, *args, **options):
+        if options['users'] < 0 or options['batch_size'] < 1 or options['days'] < 1:
+            raise CommandError('--users must be >= 0, --batch-size and --days must be >= 1')
+        if options['activities_per_user'] is not None and options['activities_per_user'] < 0:
+            raise CommandError('--activities-per-user must be >= 0')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
 
-    def handle(self, *args, **kwargs):
         self.stdout.write('Clearing existing data...')
-        
-        # Delete existing data
-        User.objects.all().delete()
-        Team.objects.all().delete()
-        Activity.objects.all().delete()
-        Leaderboard.objects.all().delete()
-        Workout.objects.all().delete()
+        for model in (User, Team, Activity, Leaderboard, Workout):
+            get_collection(model).delete_many({})
+        # The rebuilds below count archived activities too
+        get_archive_collection().drop()
 
         self.stdout.write('Creating teams...')
-        
-        # Create teams
-        teams_data = [
-            {
-                'name': 'Team Marvel',
-                'description': 'Earth\'s Mightiest Heroes - Assembling fitness champions!'
-            },
-            {
-                'name': 'Team DC',
-                'description': 'Justice League Champions - Fighting for fitness and strength!'
-            },
-            {
-                'name': 'Team GitHub',
-                'description': 'Open Source Athletes - Collaborating for peak performance!'
-            },
-            {
-                'name': 'Team Octocats',
-                'description': 'The Elite Squad - Building better bodies, one commit at a time!'
-            },
-        ]
-        
-        created_teams = []
-        for team_data in teams_data:
-            team = Team.objects.create(**team_data)
-            created_teams.append(team)
+        self.insert(Team, TEAMS)
 
         self.stdout.write('Creating users...')
-        
-        # Create users with more realistic data
-        users_data = [
-            # Team Marvel
-            {'username': 'ironman', 'first_name': 'Tony', 'last_name': 'Stark', 'email': 'ironman@marvel.com', 'team': 'Team Marvel'},
-            {'username': 'captainamerica', 'first_name': 'Steve', 'last_name': 'Rogers', 'email': 'captainamerica@marvel.com', 'team': 'Team Marvel'},
-            {'username': 'thor', 'first_name': 'Thor', 'last_name': 'Odinson', 'email': 'thor@marvel.com', 'team': 'Team Marvel'},
-            {'username': 'hulk', 'first_name': 'Bruce', 'last_name': 'Banner', 'email': 'hulk@marvel.com', 'team': 'Team Marvel'},
-            {'username': 'blackwidow', 'first_name': 'Natasha', 'last_name': 'Romanoff', 'email': 'blackwidow@marvel.com', 'team': 'Team Marvel'},
-            {'username': 'spiderman', 'first_name': 'Peter', 'last_name': 'Parker', 'email': 'spiderman@marvel.com', 'team': 'Team Marvel'},
-            
-            # Team DC
-            {'username': 'batman', 'first_name': 'Bruce', 'last_name': 'Wayne', 'email': 'batman@dc.com', 'team': 'Team DC'},
-            {'username': 'superman', 'first_name': 'Clark', 'last_name': 'Kent', 'email': 'superman@dc.com', 'team': 'Team DC'},
-            {'username': 'wonderwoman', 'first_name': 'Diana', 'last_name': 'Prince', 'email': 'wonderwoman@dc.com', 'team': 'Team DC'},
-            {'username': 'flash', 'first_name': 'Barry', 'last_name': 'Allen', 'email': 'flash@dc.com', 'team': 'Team DC'},
-            {'username': 'aquaman', 'first_name': 'Arthur', 'last_name': 'Curry', 'email': 'aquaman@dc.com', 'team': 'Team DC'},
-            {'username': 'greenlantern', 'first_name': 'Hal', 'last_name': 'Jordan', 'email': 'greenlantern@dc.com', 'team': 'Team DC'},
-            
-            # Team GitHub
-            {'username': 'octocat', 'first_name': 'Octo', 'last_name': 'Cat', 'email': 'octocat@github.com', 'team': 'Team GitHub'},
-            {'username': 'mona', 'first_name': 'Mona', 'last_name': 'Lisa', 'email': 'mona@github.com', 'team': 'Team GitHub'},
-            {'username': 'hubber', 'first_name': 'Happy', 'last_name': 'Hubber', 'email': 'hubber@github.com', 'team': 'Team GitHub'},
-            {'username': 'coder', 'first_name': 'Elite', 'last_name': 'Coder', 'email': 'coder@github.com', 'team': 'Team GitHub'},
-            
-            # Team Octocats
-            {'username': 'daftpunktocat', 'first_name': 'Daft', 'last_name': 'Punk', 'email': 'daftpunk@octocats.com', 'team': 'Team Octocats'},
-            {'username': 'yogitocat', 'first_name': 'Yogi', 'last_name': 'Tocat', 'email': 'yogi@octocats.com', 'team': 'Team Octocats'},
-            {'username': 'scubatocat', 'first_name': 'Scuba', 'last_name': 'Tocat', 'email': 'scuba@octocats.com', 'team': 'Team Octocats'},
-            {'username': 'surftocat', 'first_name': 'Surf', 'last_name': 'Tocat', 'email': 'surf@octocats.com', 'team': 'Team Octocats'},
-        ]
-
-        created_users = []
-        for user_data in users_data:
-            user = User.objects.create(
-                username=user_data['username'],
-                name=f"{user_data['first_name']} {user_data['last_name']}",
-                first_name=user_data['first_name'],
-                last_name=user_data['last_name'],
-                email=user_data['email'],
-                team=user_data['team']
-            )
-            created_users.append(user)
+        users = self.synthetic_users(options['users']) if options['users'] else self.hero_users()
+        emails, teams = [], {}
+        self.insert(User, self.remember_emails(users, emails, teams), total=options['users'] or None)
 
         self.stdout.write('Creating workouts...')
-        
-        # Create diverse workouts with proper difficulty levels
-        workouts_data = [
-            {
-                'name': 'Morning Energizer',
-                'description': 'Start your day with a gentle stretch and light cardio routine',
-                'difficulty': 'beginner',
-                'duration': 20,
-                'calories_estimate': 150
-            },
-            {
-                'name': 'Super Soldier Training',
-                'description': 'High-intensity workout designed by Captain America for peak performance',
-                'difficulty': 'advanced',
-                'duration': 60,
-                'calories_estimate': 800
-            },
-            {
-                'name': 'Asgardian Warrior Routine',
-                'description': 'Thor\'s legendary strength and endurance training from the halls of Asgard',
-                'difficulty': 'advanced',
-                'duration': 90,
-                'calories_estimate': 1200
-            },
-            {
-                'name': 'Spider-Sense Agility',
-                'description': 'Web-slinger\'s agility, flexibility, and reflexes workout',
-                'difficulty': 'intermediate',
-                'duration': 45,
-                'calories_estimate': 600
-            },
-            {
-                'name': 'Bat-Training',
-                'description': 'Batman\'s dark knight conditioning for stealth and strength',
-                'difficulty': 'advanced',
-                'duration': 75,
-                'calories_estimate': 950
-            },
-            {
-                'name': 'Kryptonian Power Workout',
-                'description': 'Superman\'s ultimate strength and endurance training regimen',
-                'difficulty': 'advanced',
-                'duration': 120,
-                'calories_estimate': 1500
-            },
-            {
-                'name': 'Amazonian Combat Training',
-                'description': 'Wonder Woman\'s warrior workout combining strength and grace',
-                'difficulty': 'advanced',
-                'duration': 60,
-                'calories_estimate': 850
-            },
-            {
-                'name': 'Speed Force Cardio',
-                'description': 'Flash\'s lightning-fast cardio routine for explosive speed',
-                'difficulty': 'intermediate',
-                'duration': 30,
-                'calories_estimate': 700
-            },
-            {
-                'name': 'Yoga Flow for Beginners',
-                'description': 'Gentle yoga poses to improve flexibility and mindfulness',
-                'difficulty': 'beginner',
-                'duration': 30,
-                'calories_estimate': 200
-            },
-            {
-                'name': 'HIIT Blast',
-                'description': 'High-Intensity Interval Training for maximum calorie burn',
-                'difficulty': 'intermediate',
-                'duration': 25,
-                'calories_estimate': 400
-            },
-            {
-                'name': 'Core Crusher',
-                'description': 'Intense abdominal and core strengthening exercises',
-                'difficulty': 'intermediate',
-                'duration': 20,
-                'calories_estimate': 250
-            },
-            {
-                'name': 'Marathon Training',
-                'description': 'Long-distance running program for endurance athletes',
-                'difficulty': 'advanced',
-                'duration': 90,
-                'calories_estimate': 1100
-            },
-        ]
-        
-        for workout_data in workouts_data:
-            Workout.objects.create(**workout_data)
+        self.insert(Workout, WORKOUTS)
 
         self.stdout.write('Creating activities...')
-        
-        # Create diverse activities with distances
-        activity_types_with_distance = {
-            'running': {'speed_range': (5, 15), 'cal_per_min': (10, 15)},  # km/h
-            'cycling': {'speed_range': (15, 30), 'cal_per_min': (8, 12)},
-            'swimming': {'speed_range': (2, 4), 'cal_per_min': (11, 14)},
-            'walking': {'speed_range': (3, 6), 'cal_per_min': (4, 6)},
-        }
-        
-        activity_types_no_distance = {
-            'yoga': {'cal_per_min': (3, 5)},
-            'strength': {'cal_per_min': (6, 9)},
-            'crossfit': {'cal_per_min': (12, 16)},
-            'boxing': {'cal_per_min': (10, 14)},
-            'martial arts': {'cal_per_min': (8, 12)},
-            'pilates': {'cal_per_min': (4, 6)},
-            'hiit': {'cal_per_min': (14, 18)},
-        }
-        
-        all_activity_types = list(activity_types_with_distance.keys()) + list(activity_types_no_distance.keys())
-        
-        for user in created_users:
-            # Create 8-15 random activities per user over the last 30 days
-            num_activities = random.randint(8, 15)
-            for i in range(num_activities):
-                days_ago = random.randint(0, 30)
-                activity_date = datetime.now() - timedelta(days=days_ago)
-                activity_type = random.choice(all_activity_types)
-                duration = random.randint(15, 120)
-                
+        per_user = options['activities_per_user']
+        self.insert(
+            Activity,
+            self.activities(emails, teams, per_user, options['days']),
+            total=len(emails) * per_user if per_user is not None else None,
+        )
+
+        # Sum every user's activities in a single aggregation pipeline
+        self.stdout.write('Creating leaderboard...')
+        self.insert(Leaderboard, self.leaderboard_rows(), total=len(emails))
+        reset_rank_index()
+        rebuild_team_leaderboard()
+
+        self.stdout.write('Creating rollups...')
+        rebuild_rollups(batch_size=self.batch_size)
+
+        self.stdout.write('Creating workout recommendations...')
+        reset_catalog()
+        rebuild_recommendations(batch_size=self.batch_size)
+
+        self.stdout.write(self.style.SUCCESS('Successfully populated the database!'))
+        for model, label in ((User, 'users'), (Team, 'teams'), (Activity, 'activities'),
+                             (Workout, 'workouts'), (Leaderboard, 'leaderboard entries'),
+                             (TeamLeaderboard, 'team leaderboard entries'), (ActivityRollup, 'rollups'),
+                             (WorkoutProfile, 'workout profiles')):
+            self.stdout.write(f'Created {get_collection(model).count_documents({})} {label}')
+
+    def insert(self, model, rows, total=None):
+        """Write ``rows`` with unordered insert_many batches, reporting progress and throughput."""
+        collection = get_collection(model)
+        started = time.perf_counter()
+        written = 0
+        batch = []
+        for row in rows:
+            batch.append(build_document(model, row, self.now))
+            if len(batch) >= self.batch_size:
+                written += self.flush(collection, batch, written, total, started)
+                batch = []
+        if batch:
+            written += self.flush(collection, batch, written, total, started)
+        return written
+
+    def flush(self, collection, batch, written, total, started):
+        collection.insert_many(batch, ordered=False)
+        written += len(batch)
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        progress = f'{written:,}/{total:,}' if total else f'{written:,}'
+        self.stdout.write(f'  {collection.name}: {progress} ({written / elapsed:,.0f} docs/s)')
+        return len(batch)
+
+    def remember_emails(self, users, emails, teams):
+        """Pass users through while collecting their emails and teams for activity generation."""
+        for user in users:
+            emails.append(user['email'])
+            teams[user['email']] = user.get('team') or ''
+            yield user
+
+    def hero_users(self):
+        for user_data in HERO_USERS:
+            yield {**user_data, 'name': f"{user_data['first_name']} {user_data['last_name']}"}
+
+    def synthetic_users(self, count):
+        first_names = [user['first_name'] for user in HERO_USERS]
+        last_names = [user['last_name'] for user in HERO_USERS]
+        teams = [team['name'] for team in TEAMS]
+        for number in range(1, count + 1):
+            first_name = self.rng.choice(first_names)
+            last_name = self.rng.choice(last_names)
+            yield {
+                'username': f'athlete{number}',
+                'name': f'{first_name} {last_name}',
+                'first_name': first_name,
+                'last_name': last_name,
+                'email': f'athlete{number}@octofit.test',
+                'team': teams[number % len(teams)],
+            }
+
+    def activities(self, emails, teams, per_user, days):
+        rng = self.rng
+        span = days * 24 * 60 * 60
+        for email in emails:
+            count = per_user if per_user is not None else rng.randint(8, 15)
+            seen = set()
+            for _ in range(count):
+                activity_type = rng.choice(ALL_ACTIVITY_TYPES)
+                duration = rng.randint(15, 120)
+
                 # Calculate distance and calories based on activity type
-                if activity_type in activity_types_with_distance:
-                    config = activity_types_with_distance[activity_type]
-                    speed_kmh = random.uniform(*config['speed_range'])
-                    distance = round((speed_kmh * duration / 60), 2)
-                    cal_per_min = random.randint(*config['cal_per_min'])
+                if activity_type in ACTIVITY_TYPES_WITH_DISTANCE:
+                    config = ACTIVITY_TYPES_WITH_DISTANCE[activity_type]
+                    distance = round(rng.uniform(*config['speed_range']) * duration / 60, 2)
                 else:
-                    config = activity_types_no_distance[activity_type]
+                    config = ACTIVITY_TYPES_NO_DISTANCE[activity_type]
                     distance = 0.0
-                    cal_per_min = random.randint(*config['cal_per_min'])
-                
-                calories = duration * cal_per_min
-                
-                Activity.objects.create(
-                    user_email=user.email,
-                    activity_type=activity_type,
-                    duration=duration,
-                    distance=distance,
-                    calories_burned=calories,
-                    date=activity_date
-                )
+                calories = duration * rng.randint(*config['cal_per_min'])
 
-        self.stdout.write('Creating leaderboard...')
-        
-        # Calculate leaderboard data with points
-        leaderboard_data = []
-        for user in created_users:
-            activities = Activity.objects.filter(user_email=user.email)
-            total_calories = sum(activity.calories_burned for activity in activities)
-            total_activities = activities.count()
-            total_distance = sum(activity.distance for activity in activities)
-            
-            # Calculate points: 1 point per calorie, 10 points per activity, 50 points per km
-            total_points = total_calories + (total_activities * 10) + int(total_distance * 50)
-            
-            leaderboard_data.append({
-                'user_email': user.email,
-                'total_points': total_points,
-                'total_calories': total_calories,
-                'total_activities': total_activities
-            })
-        
-        # Sort by total points and assign ranks
-        leaderboard_data.sort(key=lambda x: x['total_points'], reverse=True)
-        
-        for rank, data in enumerate(leaderboard_data, start=1):
-            Leaderboard.objects.create(
-                user_email=data['user_email'],
-                total_points=data['total_points'],
-                total_calories=data['total_calories'],
-                total_activities=data['total_activities'],
-                rank=rank
-            )
+                # (user_email, date, activity_type) is unique; redraw the rare collision
+                offset = rng.randrange(span)
+                while (activity_type, offset) in seen:
+                    offset = rng.randrange(span)
+                seen.add((activity_type, offset))
 
-        self.stdout.write(self.style.SUCCESS('Successfully populated the database!'))
-        self.stdout.write(f'Created {User.objects.count()} users')
-        self.stdout.write(f'Created {Team.objects.count()} teams')
-        self.stdout.write(f'Created {Activity.objects.count()} activities')
-        self.stdout.write(f'Created {Workout.objects.count()} workouts')
-        self.stdout.write(f'Created {Leaderboard.objects.count()} leaderboard entries')
+                yield {
+                    'user_email': email,
+                    'activity_type': activity_type,
+                    'duration': duration,
+                    'distance': distance,
+                    'calories_burned': calories,
+                    'date': self.now - timedelta(seconds=offset),
+                    # As recorded by the API; see Activity.team
+                    'team': teams[email],
+                }
 
+    def leaderboard_rows(self):
+        """Yield ranked leaderboard rows (competition ranking) from the per-user totals pipeline."""
+        rank, previous_points = 0, None
+        for position, totals in enumerate(iter_user_totals_by_points(batch_size=self.batch_size), start=1):
+            if totals['total_points'] != previous_points:
+                rank, previous_points = position, totals['total_points']
+            yield {
+                'user_email': totals['_id'],
+                'total_points': totals['total_points'],
+                'total_calories': totals['total_calories'],
+                'total_activities': totals['activities'],
+                'rank': rank,
+            }
@@ -0,0 +1,108 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PHASES = ('django', 'settings', 'apps', 'urls', 'middleware', 'first_request')
+
+
+def import_times(stderr):
+    """Sum ``-X importtime`` self times (in seconds) by top-level package."""
+    totals = Counter()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        totals[name.strip().split('.')[0]] += int(self_us) / 1e6
+    return totals
+
+
+def ms(seconds):
+    return f'{seconds * 1000:7.1f} ms'
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure cold start to first response in fresh interpreters: time per boot phase, per app '
+        '(import, models, ready) and import time per package, for one or more settings modules'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--settings-module', action='append', dest='modules',
+                            help='Settings module to boot (repeat to compare); defaults to the current one')
+        parser.add_argument('--url', default='/api/leaderboard/?page_size=1', help='First request to serve')
+        parser.add_argument('--runs', type=int, default=5, help='Boots per settings module; medians are reported')
+        parser.add_argument('--top', type=int, default=15, help='Packages listed by import time')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be >= 1')
+        modules = options['modules'] or [os.environ.get('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')]
+        cold_starts = {}
+        for module in modules:
+            cold_starts[module] = self.profile(module, options)
+        if len(modules) > 1:
+            baseline = cold_starts[modules[0]]
+            for module in modules[1:]:
+                change = cold_starts[module] / baseline - 1
+                self.stdout.write(self.style.SUCCESS(
+                    f'{module}: {ms(cold_starts[module]).strip()} vs {ms(baseline).strip()} '
+                    f'for {modules[0]} ({change:+.0%})'
+                ))
+
+    def boot(self, module, url, importtime=False):
+        """Run the probe in a new interpreter; returns ``(report, cold start seconds, stderr)``."""
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': module}
+        command = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-m',
+                   'octofit_tracker.startup_probe', url]
+        started = time.time()
+        result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(f'{module} failed to boot:\n{result.stderr[-2000:]}')
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        return report, report['finished_at'] - started, result.stderr
+
+    def profile(self, module, options):
+        """Print the medians of ``--runs`` boots of ``module``; returns the median cold start."""
+        reports, cold_starts = [], []
+        for _ in range(options['runs']):
+            report, cold_start, _ = self.boot(module, options['url'])
+            reports.append(report)
+            cold_starts.append(cold_start)
+        cold_start = statistics.median(cold_starts)
+
+        last = reports[-1]
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{module} (median of {options['runs']} boots)"))
+        self.stdout.write(f"  cold start to first response  {ms(cold_start)}  "
+                          f"(HTTP {last['status']}, {last['modules']} modules loaded)")
+        self.stdout.write('  phases')
+        self.stdout.write(f"    {'interpreter':<16}{ms(cold_start - sum(last['phases'].values()))}")
+        for phase in PHASES:
+            self.stdout.write(f"    {phase:<16}{ms(statistics.median(r['phases'][phase] for r in reports))}")
+        self.stdout.write(f"  apps{'':<28}{'import':>10}{'models':>10}{'ready':>10}")
+        for app in last['apps']:
+            row = [statistics.median(r['apps'][app].get(step, 0.0) for r in reports)
+                   for step in ('import', 'models', 'ready')]
+            self.stdout.write(f'    {app:<28}' + ''.join(f'{value * 1000:7.1f} ms' for value in row))
+
+        # One extra boot: -X importtime slows imports down, so it is kept out of the medians
+        _, _, stderr = self.boot(module, options['url'], importtime=True)
+        packages = import_times(stderr)
+        total = ms(sum(packages.values())).strip()
+        self.stdout.write(f'  import time by package (self, one -X importtime boot; total {total})')
+        for package, seconds in packages.most_common(options['top']):
+            self.stdout.write(f'    {package:<28}{ms(seconds)}')
+
+        if last['uncompiled']:
+            self.stdout.write(self.style.WARNING(
+                f"  {len(last['uncompiled'])} modules had no up-to-date bytecode and were compiled while booting "
+                f"(e.g. {', '.join(sorted(last['uncompiled'])[:5])}); run `python -m compileall` when building "
+                'the image'
+            ))
+        return cold_start
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker.recommendations import rebuild_recommendations, reset_catalog
+
+
+class Command(BaseCommand):
+    help = 'Recompute every user\'s activity totals and recommended workouts from the activities collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Profiles per insert_many call')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be >= 1')
+        started = time.perf_counter()
+        reset_catalog()
+        written = rebuild_recommendations(batch_size=options['batch_size'], progress=self.progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written:,} workout profiles in {elapsed:.1f}s'))
+
+    def progress(self, written):
+        self.stdout.write(f'  {written:,} profiles')
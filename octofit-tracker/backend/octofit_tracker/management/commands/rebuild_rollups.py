@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-user and per-team activity rollups from the activities collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rollup documents per insert_many call')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be >= 1')
+        started = time.perf_counter()
+        written = rebuild_rollups(batch_size=options['batch_size'], progress=self.progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written:,} rollups in {elapsed:.1f}s'))
+
+    def progress(self, period, scope, count):
+        self.stdout.write(f'  {scope} {period}: {count:,}')
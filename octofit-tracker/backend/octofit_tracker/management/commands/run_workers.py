@@ -0,0 +1,52 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker import activity_changes  # noqa: F401  registers the job handlers
+from octofit_tracker.jobs import WorkerPool, purge_jobs, queue_stats
+
+PURGE_INTERVAL_SECONDS = 3600
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers (activity post-processing) until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Worker threads')
+        parser.add_argument('--poll', type=float, default=None,
+                            help='Seconds between queue polls when idle (default JOB_POLL_SECONDS)')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no due jobs are left instead of waiting for more')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1:
+            raise CommandError('--threads must be >= 1')
+        pool = WorkerPool(options['threads'], poll_seconds=options['poll'], burst=options['burst'])
+        stats = queue_stats()
+        self.stdout.write(
+            f"Starting {options['threads']} workers: {stats['pending']:,} pending, {stats['running']:,} running, "
+            f"{stats['failed']:,} failed, lag {stats['lag_seconds']:.1f}s"
+        )
+        pool.start()
+        if options['burst']:
+            pool.join()
+        else:
+            self.supervise(pool)
+        self.stdout.write(self.style.SUCCESS(f'Processed {pool.processed:,} jobs'))
+
+    def supervise(self, pool):
+        stopping = []
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopping.append(True))
+        last_purge = 0.0
+        while not stopping:
+            if time.monotonic() - last_purge > PURGE_INTERVAL_SECONDS:
+                purged = purge_jobs()
+                if purged:
+                    self.stdout.write(f'Purged {purged:,} finished jobs')
+                last_purge = time.monotonic()
+            time.sleep(1)
+        self.stdout.write('Stopping; waiting for running jobs to finish...')
+        pool.stop()
+
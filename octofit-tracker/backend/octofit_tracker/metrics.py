@@ -0,0 +1,312 @@
+"""
+Per-request performance metrics.
+
+``RequestMetricsMiddleware`` opens a ``RequestMetrics`` for every request in
+a context variable. A PyMongo command listener (registered when the app is
+ready, so it sees every client) counts the database commands the request
+issues and their server round-trip time; serializers and renderers add
+their time through ``timed()``. High command counts point straight at N+1
+query patterns.
+
+Each response gets a ``Server-Timing`` header, and totals per view are
+kept in-process for the Prometheus text endpoint at ``/metrics``. Work done
+while a streaming response is consumed is not attributed to the request.
+
+A second listener follows PyMongo's connection pools (open, in-use and
+waiting connections, checkout failures) so pool exhaustion shows up in
+``/metrics`` and ``/health`` before requests start timing out.
+"""
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.http import HttpResponse
+from pymongo import monitoring
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+
+class RequestMetrics:
+    __slots__ = ('db_commands', 'db_seconds', 'serializer_seconds', 'render_seconds')
+
+    def __init__(self):
+        self.db_commands = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.render_seconds = 0.0
+
+    def server_timing(self, total_seconds):
+        """Format the metrics as a ``Server-Timing`` header value (durations in ms)."""
+        return ', '.join([
+            f'db;dur={self.db_seconds * 1000:.2f};desc="{self.db_commands} commands"',
+            f'serialize;dur={self.serializer_seconds * 1000:.2f}',
+            f'render;dur={self.render_seconds * 1000:.2f}',
+            f'total;dur={total_seconds * 1000:.2f}',
+        ])
+
+
+def start_request():
+    """Begin collecting metrics; returns ``(metrics, token)`` for ``finish_request``."""
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def current_metrics():
+    return _current.get()
+
+
+@contextmanager
+def timed(kind):
+    """Add the duration of the block to the current request's ``<kind>_seconds``."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        attribute = f'{kind}_seconds'
+        setattr(metrics, attribute, getattr(metrics, attribute) + time.perf_counter() - started)
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Count MongoDB commands and their duration against the current request."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.record(event)
+
+    def failed(self, event):
+        self.record(event)
+
+    @staticmethod
+    def record(event):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.db_commands += 1
+            metrics.db_seconds += event.duration_micros / 1e6
+
+
+class PoolStats:
+    __slots__ = ('max_size', 'connections', 'in_use', 'waiting', 'checkouts', 'checkout_failures', 'clears',
+                 'opened', 'created_at')
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # Times this process has opened a pool to the address; more than one
+        # means clients are being closed and rebuilt rather than kept
+        self.opened = 0
+        self.created_at = time.monotonic()
+        self.connections = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.clears = 0
+
+    @property
+    def saturation(self):
+        """Share of ``max_size`` connections checked out; 0 for unbounded pools."""
+        return self.in_use / self.max_size if self.max_size else 0.0
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Track the state of every PyMongo connection pool in this process, per server address."""
+
+    # PyMongo's default maxPoolSize; pool_created only reports non-default options
+    DEFAULT_MAX_POOL_SIZE = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pools = {}
+        self._opened = defaultdict(int)
+
+    def _pool(self, event):
+        pool = self.pools.get(event.address)
+        if pool is None:
+            pool = self.pools[event.address] = PoolStats(self.DEFAULT_MAX_POOL_SIZE)
+        return pool
+
+    def snapshot(self):
+        """Return ``{'host:port': PoolStats copy}``."""
+        with self._lock:
+            copies = {}
+            for (host, port), pool in self.pools.items():
+                copy = copies[f'{host}:{port}'] = PoolStats(pool.max_size)
+                for name in PoolStats.__slots__:
+                    setattr(copy, name, getattr(pool, name))
+            return copies
+
+    def pool_created(self, event):
+        with self._lock:
+            self._opened[event.address] += 1
+            pool = self._pool(event)
+            pool.max_size = event.options.get('maxPoolSize', self.DEFAULT_MAX_POOL_SIZE)
+            pool.opened = self._opened[event.address]
+            pool.created_at = time.monotonic()
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._pool(event).clears += 1
+
+    def pool_closed(self, event):
+        with self._lock:
+            self.pools.pop(event.address, None)
+
+    def connection_created(self, event):
+        with self._lock:
+            self._pool(event).connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            pool = self._pool(event)
+            pool.connections = max(pool.connections - 1, 0)
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self._pool(event).waiting += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            pool = self._pool(event)
+            pool.waiting = max(pool.waiting - 1, 0)
+            pool.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            pool = self._pool(event)
+            pool.waiting = max(pool.waiting - 1, 0)
+            pool.in_use += 1
+            pool.checkouts += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            pool = self._pool(event)
+            pool.in_use = max(pool.in_use - 1, 0)
+
+
+POOL_METRICS = PoolMetricsListener()
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe in-process request metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collectors = []
+        self.reset()
+
+    def add_collector(self, collector):
+        """Add a callable returning extra exposition lines, gathered on every scrape."""
+        self._collectors.append(collector)
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+            self.commands = defaultdict(lambda: Histogram(COMMAND_BUCKETS))
+            self.db_seconds = defaultdict(float)
+            self.serializer_seconds = defaultdict(float)
+            self.render_seconds = defaultdict(float)
+
+    def observe(self, view, method, status, metrics, total_seconds):
+        with self._lock:
+            self.requests[(view, method, str(status))] += 1
+            key = (view, method)
+            self.durations[key].observe(total_seconds)
+            self.commands[key].observe(metrics.db_commands)
+            self.db_seconds[key] += metrics.db_seconds
+            self.serializer_seconds[key] += metrics.serializer_seconds
+            self.render_seconds[key] += metrics.render_seconds
+
+    def render(self):
+        lines = []
+        with self._lock:
+            self._counter(lines, 'octofit_http_requests_total', 'Requests handled.',
+                          self.requests, ('view', 'method', 'status'))
+            self._histogram(lines, 'octofit_http_request_duration_seconds', 'Request duration.', self.durations)
+            self._histogram(lines, 'octofit_db_commands_per_request', 'MongoDB commands per request.', self.commands)
+            for name, help_text, values in (
+                ('octofit_db_seconds_total', 'Time spent in MongoDB commands.', self.db_seconds),
+                ('octofit_serializer_seconds_total', 'Time spent serializing.', self.serializer_seconds),
+                ('octofit_render_seconds_total', 'Time spent rendering responses.', self.render_seconds),
+            ):
+                self._counter(lines, name, help_text, values, ('view', 'method'))
+        self._pools(lines, POOL_METRICS.snapshot())
+        for collector in self._collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _labels(names, values, **extra):
+        pairs = list(zip(names, values)) + list(extra.items())
+        return ','.join(f'{name}="{value}"' for name, value in pairs)
+
+    def _counter(self, lines, name, help_text, values, label_names):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for labels, value in sorted(values.items()):
+            lines.append(f'{name}{{{self._labels(label_names, labels)}}} {value}')
+
+    def _pools(self, lines, pools):
+        for name, kind, help_text, attribute in (
+            ('octofit_mongo_pool_max_size', 'gauge', 'Configured maxPoolSize.', 'max_size'),
+            ('octofit_mongo_pool_connections', 'gauge', 'Open pooled connections.', 'connections'),
+            ('octofit_mongo_pool_in_use', 'gauge', 'Connections checked out.', 'in_use'),
+            ('octofit_mongo_pool_waiting', 'gauge', 'Threads waiting for a connection.', 'waiting'),
+            ('octofit_mongo_pool_checkouts_total', 'counter', 'Connection checkouts.', 'checkouts'),
+            ('octofit_mongo_pool_checkout_failures_total', 'counter',
+             'Failed checkouts, including wait queue timeouts.', 'checkout_failures'),
+            ('octofit_mongo_pool_clears_total', 'counter', 'Pool clears after network errors.', 'clears'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for address, pool in sorted(pools.items()):
+                lines.append(f'{name}{{address="{address}"}} {getattr(pool, attribute)}')
+
+    def _histogram(self, lines, name, help_text, histograms):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for labels, histogram in sorted(histograms.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{{{self._labels(("view", "method"), labels, le=bound)}}} {count}')
+            lines.append(f'{name}_bucket{{{self._labels(("view", "method"), labels, le="+Inf")}}} {histogram.count}')
+            lines.append(f'{name}_sum{{{self._labels(("view", "method"), labels)}}} {histogram.sum}')
+            lines.append(f'{name}_count{{{self._labels(("view", "method"), labels)}}} {histogram.count}')
+
+
+REGISTRY = MetricsRegistry()
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint for this process's request metrics."""
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,212 @@
+"""
+Response middleware: negotiated compression and request metrics.
+
+``CompressionMiddleware`` replaces Django's ``GZipMiddleware``: it picks the
+best encoding the client accepts from ``API_COMPRESSION_ENCODINGS`` (Brotli
+when the ``brotli`` package is installed, then gzip) and skips bodies
+smaller than ``API_COMPRESSION_MIN_SIZE`` bytes, where compression costs
+more CPU than it saves on the wire. Streaming responses are compressed
+chunk by chunk.
+
+``RequestMetricsMiddleware`` collects the per-request metrics described in
+``metrics`` and adds the ``Server-Timing`` header.
+
+Both run in the mode of the handler (sync under WSGI, async under ASGI), so
+async views are not moved onto a thread for them.
+"""
+import gzip
+import io
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .metrics import REGISTRY, finish_request, start_request, timed
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+
+def accepted_encodings(header):
+    """Return ``{encoding: quality}`` from an Accept-Encoding header."""
+    encodings = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            encodings[name.lower()] = quality
+    return encodings
+
+
+def choose_encoding(header, available):
+    """Return the first of ``available`` the client accepts with q > 0, or None."""
+    accepted = accepted_encodings(header)
+    for encoding in available:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def gzip_compressor():
+    buffer = io.BytesIO()
+    level = getattr(settings, 'API_COMPRESSION_GZIP_LEVEL', 6)
+    stream = gzip.GzipFile(mode='wb', fileobj=buffer, compresslevel=level)
+
+    def compress(chunk):
+        stream.write(chunk)
+        stream.flush()
+        return drain(buffer)
+
+    def finish():
+        stream.close()
+        return drain(buffer)
+    return compress, finish
+
+
+def brotli_compressor():
+    compressor = brotli.Compressor(quality=getattr(settings, 'API_COMPRESSION_BROTLI_QUALITY', 4))
+    return compressor.process, compressor.finish
+
+
+def drain(buffer):
+    value = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return value
+
+
+COMPRESSORS = {
+    'br': brotli_compressor,
+    'gzip': gzip_compressor,
+}
+
+
+class CompressionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        encodings = [
+            encoding for encoding in getattr(settings, 'API_COMPRESSION_ENCODINGS', ['br', 'gzip'])
+            if encoding in COMPRESSORS and (encoding != 'br' or brotli is not None)
+        ]
+        if not encodings or response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, 'API_COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), encodings)
+        if encoding is None:
+            return response
+
+        compress, finish = COMPRESSORS[encoding]()
+        if response.streaming:
+            # Django 4.2+ streams responses from async iterators under ASGI
+            if getattr(response, 'is_async', False):
+                response.streaming_content = self.compress_async_stream(response.streaming_content, compress, finish)
+            else:
+                response.streaming_content = self.compress_stream(response.streaming_content, compress, finish)
+            del response['Content-Length']
+        else:
+            compressed = compress(response.content) + finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # The body differs from the uncompressed one, so a strong ETag must not match it.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def compress_stream(chunks, compress, finish):
+        for chunk in chunks:
+            compressed = compress(chunk)
+            if compressed:
+                yield compressed
+        yield finish()
+
+    @staticmethod
+    async def compress_async_stream(chunks, compress, finish):
+        async for chunk in chunks:
+            compressed = compress(chunk)
+            if compressed:
+                yield compressed
+        yield finish()
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        metrics, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            finish_request(token)
+        return self.record(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        metrics, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            finish_request(token)
+        return self.record(request, response, metrics, started)
+
+    def record(self, request, response, metrics, started):
+        total = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        REGISTRY.observe(view, request.method, response.status_code, metrics, total)
+        if getattr(settings, 'REQUEST_METRICS_SERVER_TIMING', True):
+            response['Server-Timing'] = metrics.server_timing(total)
+        return response
+
+    def process_template_response(self, request, response):
+        """Time DRF's deferred rendering, which Django runs right after this hook."""
+        render = response.render
+
+        def timed_render():
+            with timed('render'):
+                return render()
+        response.render = timed_render
+        return response
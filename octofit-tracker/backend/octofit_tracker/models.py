@@ -14,6 +14,9 @@ class User(models.Model):
 
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team'], name='user_team_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -41,9 +44,23 @@ class Activity(models.Model):
     calories_burned = models.IntegerField()
     date = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # The user's team when the activity was recorded ('' for none), so the
+    # rollups can take it back out of that team; None on older activities
+    team = models.CharField(max_length=255, blank=True, null=True)
 
     class Meta:
         db_table = 'activities'
+        # Ascending keys also serve the newest-first sorts: MongoDB walks them
+        # backwards, and djongo cannot declare descending keys.
+        indexes = [
+            models.Index(fields=['date', '_id'], name='activity_date_idx'),
+            models.Index(fields=['user_email', 'date'], name='activity_user_date_idx'),
+            models.Index(fields=['activity_type', 'date'], name='activity_type_date_idx'),
+        ]
+        # Natural key: a retried create collides here instead of adding a duplicate
+        constraints = [
+            models.UniqueConstraint(fields=['user_email', 'date', 'activity_type'], name='activity_natural_key_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.user_email} - {self.activity_type}"
@@ -61,11 +78,123 @@ class Leaderboard(models.Model):
     class Meta:
         db_table = 'leaderboard'
         ordering = ['rank']
+        indexes = [
+            models.Index(fields=['user_email'], name='leaderboard_user_idx'),
+            models.Index(fields=['rank', '_id'], name='leaderboard_rank_idx'),
+            models.Index(fields=['total_points'], name='leaderboard_points_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user_email} - Rank {self.rank}"
 
 
+class TeamLeaderboard(models.Model):
+    _id = models.ObjectIdField(db_column='_id', default=ObjectId)
+    team = models.CharField(max_length=255)
+    members = models.IntegerField(default=0)
+    total_points = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_activities = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'team_leaderboard'
+        constraints = [
+            models.UniqueConstraint(fields=['team'], name='team_leaderboard_team_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.team} - {self.total_points} points"
+
+
+class ActivityRollup(models.Model):
+    _id = models.ObjectIdField(db_column='_id', default=ObjectId)
+    scope = models.CharField(max_length=10)  # 'user' or 'team'
+    key = models.CharField(max_length=255)  # user email or team name
+    period = models.CharField(max_length=10)  # 'day', 'week' or 'month'
+    bucket_start = models.DateTimeField()  # UTC start of the day, ISO week or month
+    activities = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    total_distance = models.FloatField(default=0.0)  # in kilometers
+    total_calories = models.IntegerField(default=0)
+    total_points = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'activity_rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key', 'period', 'bucket_start'], name='rollup_bucket_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} - {self.period} {self.bucket_start:%Y-%m-%d}"
+
+
+class WorkoutProfile(models.Model):
+    _id = models.ObjectIdField(db_column='_id', default=ObjectId)
+    user_email = models.EmailField()
+    activities = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    total_calories = models.IntegerField(default=0)
+    catalog = models.CharField(max_length=32, blank=True, null=True)  # workout catalog version scored against
+    recommendations = models.JSONField(default=list)  # top workouts as [{'workout_id', 'score'}]
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'workout_profiles'
+        constraints = [
+            models.UniqueConstraint(fields=['user_email'], name='workout_profile_user_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_email} - {self.activities} activities"
+
+
+class Job(models.Model):
+    _id = models.ObjectIdField(db_column='_id', default=ObjectId)
+    key = models.CharField(max_length=255)  # idempotency key; enqueueing it again is a no-op
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, default='pending')  # pending, running, done or failed
+    attempts = models.IntegerField(default=0)
+    steps_done = models.JSONField(default=list)  # steps a retry must not repeat
+    last_error = models.TextField(blank=True, null=True)
+    enqueued_at = models.DateTimeField()
+    run_at = models.DateTimeField()  # not before; pushed back between retries
+    locked_until = models.DateTimeField(blank=True, null=True)  # worker lease on running jobs
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'jobs'
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+            models.Index(fields=['status', 'locked_until'], name='job_status_lease_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['key'], name='job_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.key} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    _id = models.ObjectIdField(db_column='_id', default=ObjectId)
+    key = models.CharField(max_length=255)  # client-supplied Idempotency-Key header
+    fingerprint = models.CharField(max_length=64)  # hash of the request the key was first used with
+    response_status = models.IntegerField(blank=True, null=True)  # null while the request is in progress
+    response_body = models.TextField(blank=True, null=True)  # JSON, replayed to retries
+    created_at = models.DateTimeField()  # expired by a TTL index after IDEMPOTENCY_KEY_TTL_SECONDS
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        constraints = [
+            models.UniqueConstraint(fields=['key'], name='idempotency_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.response_status or 'in progress'})"
+
+
 class Workout(models.Model):
     _id = models.ObjectIdField(db_column='_id', default=ObjectId)
     name = models.CharField(max_length=255)
@@ -0,0 +1,28 @@
+from django.db import connections
+from pymongo.errors import DuplicateKeyError
+
+
+def get_database(alias='default'):
+    """
+    Return the PyMongo ``Database`` behind a djongo connection.
+
+    Used where the SQL translation layer cannot express an operation, such as
+    atomic ``$inc`` updates or aggregation pipelines.
+    """
+    connection = connections[alias]
+    connection.ensure_connection()
+    return connection.connection
+
+
+def get_collection(model, alias='default'):
+    """Return the PyMongo collection that stores ``model``."""
+    return get_database(alias)[model._meta.db_table]
+
+
+def is_duplicate_key(exc):
+    """Whether an ORM error was caused by a unique index rejecting the write."""
+    while exc is not None:
+        if isinstance(exc, DuplicateKeyError):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
@@ -0,0 +1,207 @@
+import base64
+import heapq
+import itertools
+import json
+from collections import OrderedDict
+from datetime import datetime
+from functools import cmp_to_key
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .documents import format_datetime
+from .mongo import get_collection
+
+
+def encode_position(values):
+    """Encode a list of string ordering values as an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_position(encoded, fields):
+    """
+    Decode a cursor into Python values for ``fields``.
+
+    Raises ``ValueError`` (or a Django ``ValidationError``) for malformed cursors.
+    """
+    values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ValueError('Cursor does not match the ordering')
+    return [field.to_python(value) for field, value in zip(fields, values)]
+
+
+def document_position(document, columns):
+    """Encode the cursor for a raw MongoDB document ordered on ``columns``."""
+    return encode_position([
+        format_datetime(document[column]) if isinstance(document[column], datetime) else str(document[column])
+        for column in columns
+    ])
+
+
+def position_query(ordering, position):
+    """MongoDB equivalent of ``KeysetCursorPagination.get_position_filter`` for ``(column, direction)`` pairs."""
+    clauses = []
+    equal = {}
+    for (name, direction), value in zip(ordering, position):
+        clauses.append({**equal, name: {'$lt' if direction < 0 else '$gt': value}})
+        equal[name] = value
+    return {'$or': clauses}
+
+
+def merge_sorted(sources, sort):
+    """
+    Merge document iterables that are each sorted on ``sort`` into one sorted stream.
+
+    Documents with the same values for every sort column are yielded once,
+    so a document briefly present in two sources is not repeated.
+    """
+    def compare(a, b):
+        for column, direction in sort:
+            if a[column] != b[column]:
+                return direction if a[column] > b[column] else -direction
+        return 0
+
+    previous = None
+    for document in heapq.merge(*sources, key=cmp_to_key(compare)):
+        if previous is None or compare(previous, document):
+            yield document
+        previous = document
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Forward-only cursor pagination keyed on a unique ordering tuple.
+
+    The cursor is an opaque, base64-encoded copy of the ordering values of the
+    last row on the page. The next page is fetched with a range filter on
+    those values, e.g. ``date < d OR (date = d AND _id < id)`` for
+    ``('-date', '-_id')``, so every page is an index seek rather than an
+    OFFSET scan. The last ordering field must be unique (normally ``_id``).
+
+    Views choose their key with a ``cursor_ordering`` attribute.
+
+    ``paginate_documents`` does the same over raw MongoDB documents for
+    views that skip model instances entirely.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('_id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.ordering = self.get_ordering(view)
+        self.fields = [queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def paginate_documents(self, model, match, request, view=None, collections=None):
+        """
+        Return one page of raw ``model`` documents matching the MongoDB filter ``match``.
+
+        ``collections`` defaults to the model's collection. With several,
+        each returns at most one page and the pages are merged.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(view)
+        self.fields = [model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+        self.columns = [field.column for field in self.fields]
+        sort = [(field.column, -1 if name.startswith('-') else 1) for name, field in zip(self.ordering, self.fields)]
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            after = position_query(sort, position)
+            match = {'$and': [match, after]} if match else after
+
+        cursors = [
+            collection.find(match).sort(sort).limit(self.page_size + 1)
+            for collection in collections or [get_collection(model)]
+        ]
+        if len(cursors) == 1:
+            results = list(cursors[0])
+        else:
+            results = list(itertools.islice(merge_sorted(cursors, sort), self.page_size + 1))
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_position_filter(self, position):
+        """Build ``(a > x) OR (a = x AND b > y) OR ...`` honouring each field's direction."""
+        condition = Q()
+        equal = {}
+        for name, field, value in zip(self.ordering, self.fields, position):
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{field.name}__{lookup}': value})
+            equal[field.name] = value
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            return decode_position(encoded, self.fields)
+        except (TypeError, ValueError, UnicodeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj):
+        if isinstance(obj, dict):
+            encoded = document_position(obj, self.columns)
+        else:
+            encoded = encode_position([field.value_to_string(obj) for field in self.fields])
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
@@ -0,0 +1,126 @@
+"""
+Per-process caches of derived structures that are refreshed in the background.
+
+Structures such as the leaderboard rank index are built from MongoDB on
+first use in each process. Writes made through the process keep them
+current, and they are rebuilt periodically to pick up other processes'
+writes. Only the first build blocks, because there is nothing to serve
+before it. After that, the first reader to find the value older than its
+refresh setting starts a single background rebuild. Every reader, that one
+included, keeps getting the stale value until the fresh one is swapped in.
+
+Changes applied through ``ProcessCache.apply`` while a build runs are
+logged and replayed onto the fresh value before the swap. That way a write
+that lands after the build has scanned past it is not lost. Changes must
+therefore be idempotent, e.g. "set X to N" rather than "add N to X".
+``reset`` discards the value along with any build in flight.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessCache:
+    """
+    Lazily built value with ``loaded_at`` that ``load()`` rebuilds after
+    ``refresh_setting`` seconds.
+
+    A refresh setting of 0 disables refreshing.
+    """
+
+    def __init__(self, load, refresh_setting, name):
+        self._load = load
+        self._refresh_setting = refresh_setting
+        self._name = name
+        self._value = None
+        self._generation = 0
+        self._logs = []
+        self._lock = threading.Lock()
+        self._first_build = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    @property
+    def value(self):
+        """The current value, or None if it has not been built."""
+        return self._value
+
+    def get(self):
+        """Return the value, building it first if needed; refresh it when stale."""
+        value = self._value
+        if value is None:
+            with self._first_build:
+                value = self._value
+                if value is None:
+                    value = self._build()
+            return value
+        max_age = getattr(settings, self._refresh_setting, 60)
+        stale = max_age and time.monotonic() - value.loaded_at > max_age
+        if stale and self._refreshing.acquire(blocking=False):
+            try:
+                threading.Thread(
+                    target=self._refresh, name=f'{self._name}-refresh', daemon=True
+                ).start()
+            except Exception:
+                self._refreshing.release()
+                raise
+        return value
+
+    def _build(self):
+        """Load a value, replay the changes made meanwhile; install unless reset."""
+        log = []
+        with self._lock:
+            generation = self._generation
+            self._logs.append(log)
+        try:
+            fresh = self._load()
+            replayed = 0
+            while True:
+                with self._lock:
+                    pending = log[replayed:]
+                    if not pending:
+                        if self._generation == generation:
+                            self._value = fresh
+                        return fresh
+                for change in pending:
+                    change(fresh)
+                replayed += len(pending)
+        finally:
+            with self._lock:
+                self._logs = [other for other in self._logs if other is not log]
+
+    def _refresh(self):
+        try:
+            self._build()
+        except Exception:
+            logger.exception(
+                'Refreshing the %s failed; serving the stale one', self._name
+            )
+            # Retry after another interval rather than on every request
+            stale = self._value
+            if stale is not None:
+                stale.loaded_at = time.monotonic()
+        finally:
+            self._refreshing.release()
+
+    def apply(self, change):
+        """Call ``change(value)`` on the built value and on any being built."""
+        with self._lock:
+            value = self._value
+            for log in self._logs:
+                log.append(change)
+        if value is not None:
+            change(value)
+
+    def reset(self):
+        """
+        Drop the value so the next access rebuilds it.
+
+        Builds already running are not installed.
+        """
+        with self._lock:
+            self._generation += 1
+            self._value = None
@@ -0,0 +1,222 @@
+"""
+In-process order-statistic index over leaderboard scores.
+
+Entries are kept in an indexable skip list ordered by ``(-total_points,
+user_email)``: every forward link also stores how many entries it skips, so
+finding an entry's position, or the entry at a given position, takes
+O(log n) expected time. That answers "rank of user X", "top K" and "users
+around X" without touching the ``rank`` column.
+
+The index is built from the leaderboard collection on first use in each
+process and kept current by ``leaderboard.apply_delta``. Writes made by other
+processes are picked up by a background rebuild (see ``process_cache``)
+started once the index is ``RANK_INDEX_REFRESH_SECONDS`` old. Requests keep
+using the current index meanwhile.
+"""
+import random
+import threading
+import time
+
+from .models import Leaderboard
+from .mongo import get_collection
+from .process_cache import ProcessCache
+
+MAX_LEVEL = 32
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level
+
+
+class IndexableSkipList:
+    """Sorted collection of unique keys with O(log n) insert, remove, rank and select."""
+
+    def __init__(self, seed=None):
+        self._random = random.Random(seed)
+        self._head = _Node(None, MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self):
+        level = 1
+        while level < MAX_LEVEL and self._random.random() < 0.5:
+            level += 1
+        return level
+
+    def _find(self, key):
+        """Return the rightmost node before ``key`` on every level and its position."""
+        update = [self._head] * MAX_LEVEL
+        position = [0] * MAX_LEVEL
+        node, index = self._head, 0
+        for level in reversed(range(self._level)):
+            while node.next[level] is not None and node.next[level].key < key:
+                index += node.width[level]
+                node = node.next[level]
+            update[level] = node
+            position[level] = index
+        return update, position
+
+    def insert(self, key):
+        update, position = self._find(key)
+        level = self._random_level()
+        if level > self._level:
+            for extra in range(self._level, level):
+                update[extra] = self._head
+                position[extra] = 0
+                self._head.width[extra] = self._size + 1
+            self._level = level
+
+        node = _Node(key, level)
+        index = position[0] + 1
+        for i in range(level):
+            before = update[i]
+            node.next[i] = before.next[i]
+            before.next[i] = node
+            node.width[i] = before.width[i] - (index - position[i]) + 1
+            before.width[i] = index - position[i]
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        update, _ = self._find(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(self._level):
+            before = update[i]
+            if before.next[i] is node:
+                before.width[i] += node.width[i] - 1
+                before.next[i] = node.next[i]
+            else:
+                before.width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+
+    def bisect_left(self, key):
+        """Return how many keys sort before ``key``."""
+        _, position = self._find(key)
+        return position[0]
+
+    def slice(self, start, stop):
+        """Return the keys at positions ``start`` (inclusive) to ``stop`` (exclusive)."""
+        start, stop = max(start, 0), min(stop, self._size)
+        if start >= stop:
+            return []
+        node, index = self._head, -1
+        for level in reversed(range(self._level)):
+            while node.next[level] is not None and index + node.width[level] <= start:
+                index += node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not None and len(keys) < stop - start:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class RankIndex:
+    """
+    Competition ranking (``1 + users with more points``) over user scores.
+
+    All methods are thread-safe.
+    """
+
+    def __init__(self, entries=()):
+        self._lock = threading.RLock()
+        self._points = {}
+        self._keys = IndexableSkipList()
+        self.loaded_at = time.monotonic()
+        for user_email, total_points in entries:
+            self.update(user_email, total_points)
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, user_email):
+        return user_email in self._points
+
+    def update(self, user_email, total_points):
+        with self._lock:
+            old_points = self._points.get(user_email)
+            if old_points == total_points:
+                return
+            if old_points is not None:
+                self._keys.remove((-old_points, user_email))
+            self._keys.insert((-total_points, user_email))
+            self._points[user_email] = total_points
+
+    def remove(self, user_email):
+        with self._lock:
+            total_points = self._points.pop(user_email)
+            self._keys.remove((-total_points, user_email))
+
+    def points(self, user_email):
+        return self._points.get(user_email)
+
+    def rank(self, user_email):
+        """Return the user's rank, or None if they are not on the leaderboard."""
+        with self._lock:
+            total_points = self._points.get(user_email)
+            if total_points is None:
+                return None
+            return self._keys.bisect_left((-total_points, '')) + 1
+
+    def _rows(self, start, stop):
+        keys = self._keys.slice(start, stop)
+        if not keys:
+            return []
+        rank = self._keys.bisect_left((keys[0][0], '')) + 1
+        rows = []
+        for offset, (negative_points, user_email) in enumerate(keys):
+            if offset and negative_points != keys[offset - 1][0]:
+                rank = start + offset + 1
+            rows.append({'user_email': user_email, 'total_points': -negative_points, 'rank': rank})
+        return rows
+
+    def top(self, k):
+        """Return the ``k`` highest-scoring users as ``user_email``/``total_points``/``rank`` rows."""
+        with self._lock:
+            return self._rows(0, k)
+
+    def around(self, user_email, radius):
+        """Return the user's row with up to ``radius`` neighbours on each side."""
+        with self._lock:
+            total_points = self._points.get(user_email)
+            if total_points is None:
+                return None
+            position = self._keys.bisect_left((-total_points, user_email))
+            return self._rows(position - radius, position + radius + 1)
+
+
+def load_rank_index():
+    """Build a fresh index from the leaderboard collection."""
+    cursor = get_collection(Leaderboard).find({}, {'_id': 0, 'user_email': 1, 'total_points': 1})
+    return RankIndex((entry['user_email'], entry.get('total_points') or 0) for entry in cursor)
+
+
+_index = ProcessCache(load_rank_index, 'RANK_INDEX_REFRESH_SECONDS', 'rank index')
+
+
+def get_rank_index():
+    """Return this process's index, building it on first use and refreshing it in the background."""
+    return _index.get()
+
+
+def record_points(user_email, total_points):
+    """Apply a score change to the index if this process has loaded (or is loading) it."""
+    _index.apply(lambda index: index.update(user_email, total_points))
+
+
+def reset_rank_index():
+    """Drop the cached index so the next access rebuilds it."""
+    _index.reset()
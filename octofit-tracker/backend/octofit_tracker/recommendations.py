@@ -0,0 +1,231 @@
+"""
+Workout recommendations from each user's activity history.
+
+Workouts and users are compared as feature vectors of ``(intensity in
+calories per minute, duration in minutes, level)``. A workout's level comes
+from its difficulty. A user's level grows with the number of activities
+they have logged, and their intensity and duration are their averages
+raised by ``PROGRESSION``, so recommendations push slightly beyond what
+they already do. Workouts closest to that target, by scaled Euclidean
+distance, rank first.
+
+Scoring every workout on each request is avoided: each user's top
+``WORKOUT_RECOMMENDATIONS_K`` workouts are stored in ``workout_profiles``
+next to the running totals they were computed from, so a request is one
+indexed ``find_one``. Activity writes ``$inc`` the totals of the users they
+touch and rescore only those users. The workout catalog is held in memory
+per process, like the rank index. It is reloaded in the background every
+``WORKOUT_CATALOG_REFRESH_SECONDS`` (see ``process_cache``) and dropped
+after a workout write. A stored top-K scored against an older catalog is
+rescored when it is next read. ``rebuild_recommendations`` recomputes every
+profile from the activities, archived ones included.
+"""
+import hashlib
+import heapq
+import math
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from .archive import with_archive
+from .documents import workout_row
+from .models import Activity, Workout, WorkoutProfile
+from .mongo import get_collection
+from .process_cache import ProcessCache
+
+DIFFICULTY_LEVELS = {'beginner': 0.0, 'intermediate': 0.5, 'advanced': 1.0}
+# Distance scale of each feature: roughly the spread between workouts for
+# intensity and duration; level counts half as much, since what users
+# actually do says more than how long they have been at it
+FEATURE_SCALES = (20.0, 120.0, 2.0)
+# Users count as advanced once they have logged this many activities
+ADVANCED_AFTER_ACTIVITIES = 60
+PROGRESSION = 1.1
+# Target for users without activities: short, light beginner workouts
+NEWCOMER_TARGET = (5.0, 20.0, 0.0)
+
+
+def workout_vector(workout):
+    duration = workout.get('duration') or 1
+    level = DIFFICULTY_LEVELS.get((workout.get('difficulty') or '').lower(), 0.5)
+    return (workout.get('calories_estimate', 0) / duration, duration, level)
+
+
+def profile_target(activities, total_duration, total_calories):
+    """Return the feature vector a user's recommendations should be close to."""
+    if activities <= 0 or total_duration <= 0:
+        return NEWCOMER_TARGET
+    return (
+        total_calories / total_duration * PROGRESSION,
+        total_duration / activities * PROGRESSION,
+        min(activities / ADVANCED_AFTER_ACTIVITIES, 1.0),
+    )
+
+
+def distance(a, b):
+    return math.sqrt(sum(((x - y) / scale) ** 2 for x, y, scale in zip(a, b, FEATURE_SCALES)))
+
+
+class WorkoutCatalog:
+    """Every workout's feature vector and API row, with a version that changes with them."""
+
+    def __init__(self, workouts=()):
+        self.vectors = []
+        self.rows = {}
+        digest = hashlib.md5()
+        for workout in sorted(workouts, key=lambda workout: str(workout['_id'])):
+            workout_id = str(workout['_id'])
+            vector = workout_vector(workout)
+            self.vectors.append((workout_id, vector))
+            self.rows[workout_id] = workout_row(workout)
+            digest.update(repr((workout_id, vector)).encode())
+        self.version = digest.hexdigest()
+        self.loaded_at = time.monotonic()
+
+    def top(self, target, k):
+        """Return the ``k`` workouts nearest ``target`` as ``[{'workout_id', 'score'}]``."""
+        nearest = heapq.nsmallest(k, ((distance(target, vector), workout_id) for workout_id, vector in self.vectors))
+        return [{'workout_id': workout_id, 'score': round(1 / (1 + gap), 4)} for gap, workout_id in nearest]
+
+    def recommend(self, profile):
+        """Score a ``workout_profiles`` document (or totals dict) against this catalog."""
+        target = profile_target(
+            profile.get('activities', 0), profile.get('total_duration', 0), profile.get('total_calories', 0),
+        )
+        return self.top(target, getattr(settings, 'WORKOUT_RECOMMENDATIONS_K', 10))
+
+
+def load_catalog():
+    return WorkoutCatalog(get_collection(Workout).find({}))
+
+
+_catalog = ProcessCache(load_catalog, 'WORKOUT_CATALOG_REFRESH_SECONDS', 'workout catalog')
+
+
+def get_catalog():
+    """Return this process's catalog, loading it on first use and refreshing it in the background."""
+    return _catalog.get()
+
+
+def reset_catalog():
+    """Drop the cached catalog so the next access reloads it."""
+    _catalog.reset()
+
+
+def profile_deltas(removed=(), added=()):
+    """Aggregate activities into ``{email: [activities, duration, calories]}`` deltas."""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for sign, activities in ((-1, removed), (1, added)):
+        for activity in activities:
+            if isinstance(activity, dict):
+                email, duration, calories = activity['user_email'], activity['duration'], activity['calories_burned']
+            else:
+                email, duration, calories = activity.user_email, activity.duration, activity.calories_burned
+            delta = deltas[email]
+            delta[0] += sign
+            delta[1] += sign * duration
+            delta[2] += sign * calories
+    return {email: delta for email, delta in deltas.items() if any(delta)}
+
+
+def record_activity_change(removed=(), added=()):
+    """Update the totals of the users the activities belong to and rescore only them."""
+    deltas = profile_deltas(removed, added)
+    if not deltas:
+        return
+    collection = get_collection(WorkoutProfile)
+    collection.bulk_write([
+        UpdateOne(
+            {'user_email': email},
+            {'$inc': {'activities': delta[0], 'total_duration': delta[1], 'total_calories': delta[2]}},
+            upsert=True,
+        )
+        for email, delta in deltas.items()
+    ], ordered=False)
+
+    catalog = get_catalog()
+    now = timezone.now()
+    profiles = collection.find({'user_email': {'$in': list(deltas)}})
+    collection.bulk_write([
+        UpdateOne({'_id': profile['_id']}, {'$set': {
+            'recommendations': catalog.recommend(profile), 'catalog': catalog.version, 'updated_at': now,
+        }})
+        for profile in profiles
+    ], ordered=False)
+
+
+def recommended_workouts(email, limit=None):
+    """Return the user's top workouts as workout rows with a ``score``, best first."""
+    catalog = get_catalog()
+    collection = get_collection(WorkoutProfile)
+    profile = collection.find_one({'user_email': email}, {'recommendations': 1, 'catalog': 1, 'activities': 1,
+                                                          'total_duration': 1, 'total_calories': 1})
+    if profile is None:
+        recommendations = catalog.recommend({})
+    elif profile.get('catalog') != catalog.version:
+        recommendations = catalog.recommend(profile)
+        collection.update_one({'_id': profile['_id']}, {'$set': {
+            'recommendations': recommendations, 'catalog': catalog.version, 'updated_at': timezone.now(),
+        }})
+    else:
+        recommendations = profile['recommendations']
+    rows = [
+        {**catalog.rows[entry['workout_id']], 'score': entry['score']}
+        for entry in recommendations if entry['workout_id'] in catalog.rows
+    ]
+    return rows[:limit] if limit is not None else rows
+
+
+def rebuild_recommendations(batch_size=1000, progress=None):
+    """
+    Recompute every user's totals and top workouts from the activities collection.
+
+    Profiles are written to a staging collection that then replaces the
+    live one, as ``rollups.rebuild_rollups`` does. ``progress`` is called
+    with the number of profiles written so far. Returns the number of profiles.
+    """
+    live = get_collection(WorkoutProfile)
+    staging = live.database[f'{live.name}_rebuild']
+    staging.drop()
+    for name, info in live.index_information().items():
+        if name != '_id_':
+            staging.create_index(info['key'], name=name, unique=info.get('unique', False))
+
+    catalog = get_catalog()
+    now = timezone.now()
+    cursor = get_collection(Activity).aggregate(with_archive([
+        {'$group': {
+            '_id': '$user_email',
+            'activities': {'$sum': 1},
+            'total_duration': {'$sum': '$duration'},
+            'total_calories': {'$sum': '$calories_burned'},
+        }},
+    ], whole_history=True), allowDiskUse=True, batchSize=batch_size)
+
+    written = 0
+    batch = []
+    for totals in cursor:
+        profile = {'user_email': totals.pop('_id'), **totals}
+        batch.append({**profile, 'catalog': catalog.version, 'recommendations': catalog.recommend(profile),
+                      'updated_at': now})
+        if len(batch) >= batch_size:
+            staging.insert_many(batch, ordered=False)
+            written += len(batch)
+            batch = []
+            if progress:
+                progress(written)
+    if batch:
+        staging.insert_many(batch, ordered=False)
+        written += len(batch)
+        if progress:
+            progress(written)
+
+    if written:
+        staging.rename(live.name, dropTarget=True)
+    else:
+        staging.drop()
+        live.delete_many({})
+    return written
@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+from decimal import Decimal
+
+import orjson
+from bson import ObjectId
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def orjson_default(value):
+    """Serialize the types orjson does not handle natively, as DRF's ``JSONEncoder`` does."""
+    if isinstance(value, Promise):
+        return force_str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, ObjectId):
+        return str(value)
+    if hasattr(value, '__iter__'):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Drop-in ``JSONRenderer`` backed by orjson.
+
+    Datetimes, UUIDs and dataclasses are encoded natively in C (naive
+    datetimes are taken as UTC, as MongoDB returns them, and UTC is written
+    as ``Z``); ObjectIds become strings. ``indent`` in the Accept header
+    selects two-space indentation.
+    """
+    options = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = self.options
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=orjson_default, option=options)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders a list as newline-delimited JSON, one object per line.
+
+    Anything else (e.g. an error body) is rendered as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row, cls=JSONEncoder) + '\n' for row in rows).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Renders a list of flat dicts as CSV with a header row taken from the first row.
+
+    A single dict (e.g. an error body) is rendered as a one-row table.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        if not rows:
+            return b''
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(rows[0]), extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode(self.charset)
@@ -0,0 +1,227 @@
+"""
+Precomputed activity totals per user and per team, by day, ISO week and month.
+
+Each rollup document holds the totals of one ``(scope, key, period,
+bucket_start)`` bucket, where ``scope`` is ``user`` (keyed by email) or
+``team`` (keyed by team name, ``No Team`` for users without one) and
+``bucket_start`` is the UTC start of the day, ISO week or month. Range
+queries such as "daily totals for a team over the last 90 days" read one
+small document per bucket instead of aggregating the raw activities.
+
+Activity writes are applied incrementally with ``$inc`` upserts. An activity
+counts towards the team its user belonged to when it was recorded, which is
+stored on it (``Activity.team``), so deleting or editing it after a team
+change takes it back out of that team. Older activities without a stored team
+count towards the user's current team. ``rebuild_rollups`` recomputes
+everything from the activities, archived ones included, the same way.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from pymongo import UpdateOne
+
+from .archive import with_archive
+from .leaderboard import activity_points
+from .models import Activity, ActivityRollup, User
+from .mongo import get_collection
+from .stats import BUCKET_FORMATS, TOTALS
+from .team_leaderboard import user_teams
+
+PERIODS = ('day', 'week', 'month')
+NO_TEAM = 'No Team'
+TOTAL_FIELDS = ('activities', 'total_duration', 'total_distance', 'total_calories', 'total_points')
+
+# Aggregation equivalents of ``bucket_start``. A week starts on the Monday
+# before (or of) the activity: ``$dayOfWeek`` counts from Sunday = 1.
+DAY_START = {'$dateFromParts': {
+    'year': {'$year': '$date'}, 'month': {'$month': '$date'}, 'day': {'$dayOfMonth': '$date'},
+}}
+BUCKET_STARTS = {
+    'day': DAY_START,
+    'week': {'$subtract': [
+        DAY_START,
+        {'$multiply': [{'$mod': [{'$add': [{'$dayOfWeek': '$date'}, 5]}, 7]}, 24 * 60 * 60 * 1000]},
+    ]},
+    'month': {'$dateFromParts': {'year': {'$year': '$date'}, 'month': {'$month': '$date'}, 'day': 1}},
+}
+
+
+def bucket_start(value, period):
+    """Return the naive UTC start of the day, ISO week or month containing ``value``."""
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    day = datetime(value.year, value.month, value.day)
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    raise ValueError(f'Unknown rollup period: {period}')
+
+
+def _value(activity, name, default=None):
+    if isinstance(activity, dict):
+        return activity.get(name, default)
+    return getattr(activity, name, default)
+
+
+def rollup_deltas(removed=(), added=(), team_of=None):
+    """
+    Aggregate activities into ``{(scope, key, period, bucket_start): totals}`` deltas.
+
+    Activities count towards their stored ``team``. For activities without
+    one, ``team_of`` maps the user email to a team name. An empty or None
+    team counts towards ``No Team``. Totals are lists in ``TOTAL_FIELDS`` order.
+    """
+    team_of = team_of or (lambda email: None)
+    deltas = defaultdict(lambda: [0, 0, 0.0, 0, 0])
+    for sign, activities in ((-1, removed), (1, added)):
+        for activity in activities:
+            email = _value(activity, 'user_email')
+            calories = _value(activity, 'calories_burned')
+            distance = _value(activity, 'distance') or 0.0
+            totals = (1, _value(activity, 'duration'), distance, calories, activity_points(calories, distance))
+            team = _value(activity, 'team')
+            if team is None:
+                team = team_of(email)
+            for period in PERIODS:
+                start = bucket_start(_value(activity, 'date'), period)
+                for key in (('user', email), ('team', team or NO_TEAM)):
+                    delta = deltas[key + (period, start)]
+                    for position, amount in enumerate(totals):
+                        delta[position] += sign * amount
+    return {bucket: delta for bucket, delta in deltas.items() if any(delta)}
+
+
+def apply_rollup_deltas(deltas):
+    """Apply deltas with one unordered bulk write, dropping buckets that became empty."""
+    if not deltas:
+        return
+    collection = get_collection(ActivityRollup)
+    requests = []
+    for (scope, key, period, start), delta in deltas.items():
+        requests.append(UpdateOne(
+            {'scope': scope, 'key': key, 'period': period, 'bucket_start': start},
+            {'$inc': dict(zip(TOTAL_FIELDS, delta))},
+            upsert=True,
+        ))
+    collection.bulk_write(requests, ordered=False)
+
+    emptied = [
+        {'scope': scope, 'key': key, 'period': period, 'bucket_start': start}
+        for (scope, key, period, start), delta in deltas.items() if delta[0] < 0
+    ]
+    if emptied:
+        collection.delete_many({'$or': emptied, 'activities': {'$lte': 0}})
+
+
+def record_activity_change(removed=(), added=()):
+    """Update the rollups for activities that were removed and/or added."""
+    teams = user_teams(
+        _value(activity, 'user_email') for activity in (*removed, *added) if _value(activity, 'team') is None
+    )
+    apply_rollup_deltas(rollup_deltas(removed, added, teams.get))
+
+
+def rebuild_pipelines(period):
+    """Return the ``(scope, pipeline)`` pairs that compute every ``period`` rollup from activities."""
+    per_user = {'$group': {'_id': {'key': '$user_email', 'bucket_start': BUCKET_STARTS[period]}, **TOTALS}}
+    per_user_team = {'$group': {
+        '_id': {'key': '$user_email', 'team': '$team', 'bucket_start': BUCKET_STARTS[period]}, **TOTALS,
+    }}
+    # The stored team, else the user's current one; '' means no team
+    team = {'$ifNull': ['$_id.team', {'$ifNull': ['$user.team', '']}]}
+    sums = {field: {'$sum': f'${field}'} for field in TOTAL_FIELDS}
+    return [
+        ('user', [per_user]),
+        ('team', [
+            per_user_team,
+            {'$lookup': {
+                'from': User._meta.db_table,
+                'localField': '_id.key',
+                'foreignField': 'email',
+                'as': 'user',
+            }},
+            {'$unwind': {'path': '$user', 'preserveNullAndEmptyArrays': True}},
+            {'$group': {
+                '_id': {'key': {'$cond': [{'$eq': [team, '']}, NO_TEAM, team]}, 'bucket_start': '$_id.bucket_start'},
+                **sums,
+            }},
+        ]),
+    ]
+
+
+def rebuild_rollups(batch_size=1000, progress=None):
+    """
+    Recompute every rollup from the activities collection.
+
+    Rollups are written to a staging collection that then atomically
+    replaces the live one, so readers never see a partial rebuild. Activity
+    writes made while the rebuild runs may be lost from the result; run it
+    when writes are quiet. ``progress`` is called with ``(period, scope,
+    documents written)``. Returns the number of rollup documents.
+    """
+    live = get_collection(ActivityRollup)
+    staging = live.database[f'{live.name}_rebuild']
+    staging.drop()
+    for name, info in live.index_information().items():
+        if name != '_id_':
+            staging.create_index(info['key'], name=name, unique=info.get('unique', False))
+
+    activities = get_collection(Activity)
+    written = 0
+    for period in PERIODS:
+        for scope, pipeline in rebuild_pipelines(period):
+            batch = []
+            count = 0
+            cursor = activities.aggregate(with_archive(pipeline, whole_history=True), allowDiskUse=True,
+                                          batchSize=batch_size)
+            for document in cursor:
+                bucket = document.pop('_id')
+                batch.append({'scope': scope, 'key': bucket['key'], 'period': period,
+                              'bucket_start': bucket['bucket_start'], **document})
+                if len(batch) >= batch_size:
+                    staging.insert_many(batch, ordered=False)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                staging.insert_many(batch, ordered=False)
+                count += len(batch)
+            written += count
+            if progress:
+                progress(period, scope, count)
+
+    if written:
+        staging.rename(live.name, dropTarget=True)
+    else:
+        staging.drop()
+        live.delete_many({})
+    return written
+
+
+def rollup_series(scope, key, period='day', date_from=None, date_to=None):
+    """
+    Return the rollup rows of one user or team, oldest bucket first.
+
+    Rows have the same shape as ``stats.timeline`` rows: the bucket label
+    under the period name followed by the totals. Buckets overlapping
+    ``date_from``/``date_to`` (exclusive) are included whole.
+    """
+    query = {'scope': scope, 'key': key, 'period': period}
+    date_range = {}
+    if date_from:
+        date_range['$gte'] = bucket_start(date_from, period)
+    if date_to:
+        date_range['$lt'] = date_to
+    if date_range:
+        query['bucket_start'] = date_range
+    cursor = get_collection(ActivityRollup).find(query, {'_id': 0}).sort('bucket_start', 1)
+    return [
+        {
+            period: document['bucket_start'].strftime(BUCKET_FORMATS[period]),
+            **{field: document.get(field, 0) for field in TOTAL_FIELDS},
+            'total_distance': round(document.get('total_distance', 0), 2),
+        }
+        for document in cursor
+    ]
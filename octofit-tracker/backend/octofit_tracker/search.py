@@ -0,0 +1,180 @@
+"""
+Typeahead search over users, teams and workouts.
+
+Each process keeps an inverted index from lower-cased word tokens to the
+entries containing them: users by ``username`` and ``name``, teams by
+``name`` and workouts by ``name`` and ``description``. Tokens are also kept
+sorted, so the entries for every token starting with a prefix are found by
+binary search. A query matches entries that contain, for each of its
+words, a token starting with that word. "spee cardio" finds the workout
+"Speed Force Cardio".
+
+The index is built from MongoDB on first use and updated by writes made
+through this process's viewsets. Like the rank index, it is rebuilt in the
+background once it is ``SEARCH_INDEX_REFRESH_SECONDS`` old, to pick up other
+processes' writes (see ``process_cache``).
+"""
+import bisect
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .models import Team, User, Workout
+from .mongo import get_collection
+from .process_cache import ProcessCache
+
+TOKEN = re.compile(r'\w+')
+
+# kind -> (model, {field: weight}, title field, subtitle field)
+SOURCES = {
+    'user': (User, {'username': 2, 'name': 3}, 'name', 'username'),
+    'team': (Team, {'name': 3}, 'name', 'description'),
+    'workout': (Workout, {'name': 3, 'description': 1}, 'name', 'difficulty'),
+}
+
+
+def tokenize(text):
+    return TOKEN.findall(text.casefold()) if text else []
+
+
+def entry(kind, document):
+    """Return the entry key, result row and ``{token: weight}`` of a raw document of ``kind``."""
+    _, fields, title, subtitle = SOURCES[kind]
+    key = (kind, str(document['_id']))
+    weights = {}
+    for field, weight in fields.items():
+        for token in tokenize(document.get(field)):
+            weights[token] = max(weights.get(token, 0), weight)
+    row = {'type': kind, 'id': key[1], 'title': document.get(title), 'subtitle': document.get(subtitle)}
+    return key, row, weights
+
+
+class SearchIndex:
+    """Thread-safe prefix-searchable inverted index of ``(kind, id)`` entries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = []  # sorted unique tokens
+        self._postings = defaultdict(dict)  # token -> {entry key: field weight}
+        self._entries = {}  # entry key -> (result row, tokens)
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def build(cls, documents):
+        """Index ``(kind, document)`` pairs with unique ids, sorting the tokens once at the end."""
+        index = cls()
+        for kind, document in documents:
+            key, row, weights = entry(kind, document)
+            for token, weight in weights.items():
+                index._postings[token][key] = weight
+            index._entries[key] = (row, tuple(weights))
+        index._tokens = sorted(index._postings)
+        return index
+
+    def add(self, kind, document):
+        """Index (or re-index) a raw document of ``kind``."""
+        key, row, weights = entry(kind, document)
+        with self._lock:
+            self._remove(key)
+            for token, weight in weights.items():
+                if token not in self._postings:
+                    bisect.insort(self._tokens, token)
+                self._postings[token][key] = weight
+            self._entries[key] = (row, tuple(weights))
+
+    def remove(self, kind, entry_id):
+        with self._lock:
+            self._remove((kind, str(entry_id)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for token in entry[1]:
+            postings = self._postings[token]
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def _matches(self, prefix, max_expansions):
+        """Return ``{entry key: best weight}`` over the first tokens starting with ``prefix``."""
+        matches = {}
+        start = bisect.bisect_left(self._tokens, prefix)
+        for token in self._tokens[start:start + max_expansions]:
+            if not token.startswith(prefix):
+                break
+            # Whole-word matches outrank prefix matches
+            bonus = 1 if token == prefix else 0
+            for key, weight in self._postings[token].items():
+                if weight + bonus > matches.get(key, 0):
+                    matches[key] = weight + bonus
+        return matches
+
+    def search(self, query, kinds=None, limit=10):
+        """Return result rows matching every word of ``query``, best first."""
+        words = tokenize(query)
+        if not words:
+            return []
+        max_expansions = getattr(settings, 'SEARCH_MAX_EXPANSIONS', 50)
+        with self._lock:
+            scores = None
+            # Longest words first: they match the fewest entries
+            for word in sorted(set(words), key=len, reverse=True):
+                matches = self._matches(word, max_expansions)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+                if not scores:
+                    return []
+            if kinds:
+                scores = {key: score for key, score in scores.items() if key[0] in kinds}
+            ranked = sorted(
+                scores.items(),
+                key=lambda item: (-item[1], len(self._entries[item[0]][0]['title'] or ''), item[0]),
+            )
+            return [{**self._entries[key][0], 'score': score} for key, score in ranked[:limit]]
+
+
+def load_search_index():
+    """Build a fresh index from the users, teams and workouts collections."""
+    def documents():
+        for kind, (model, fields, title, subtitle) in SOURCES.items():
+            projection = {field: 1 for field in {*fields, title, subtitle}}
+            for document in get_collection(model).find({}, projection):
+                yield kind, document
+    return SearchIndex.build(documents())
+
+
+_index = ProcessCache(load_search_index, 'SEARCH_INDEX_REFRESH_SECONDS', 'search index')
+
+
+def get_search_index():
+    """Return this process's index, building it on first use and refreshing it in the background."""
+    return _index.get()
+
+
+def reset_search_index():
+    """Drop the cached index so the next access rebuilds it."""
+    _index.reset()
+
+
+def record_change(kind, instance):
+    """Keep a loaded (or loading) index current after a model instance of ``kind`` is saved."""
+    _, fields, title, subtitle = SOURCES[kind]
+    document = {'_id': instance._id}
+    for field in {*fields, title, subtitle}:
+        document[field] = getattr(instance, field)
+    _index.apply(lambda index: index.add(kind, document))
+
+
+def record_delete(kind, entry_id):
+    """Drop a deleted entry from a loaded (or loading) index."""
+    _index.apply(lambda index: index.remove(kind, entry_id))
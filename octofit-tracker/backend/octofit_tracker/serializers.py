@@ -1,11 +1,48 @@
 from rest_framework import serializers
 from .models import User, Team, Activity, Leaderboard, Workout
+from .metrics import timed
+from .user_lookup import load_user_map
 
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedListSerializer(serializers.ListSerializer):
+    """List serializer that records the time spent building ``.data`` in the request metrics."""
+
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+
+class TimedDataMixin:
+    """Record the time spent building ``.data`` in the request metrics."""
+
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+
+class UserLookupMixin:
+    """
+    Resolve ``user_email`` through the ``users`` map in the serializer context.
+
+    List views preload the map for the whole page with one query; when it is
+    missing (single objects, nested use) users are loaded on demand and cached
+    in the context so each email is only fetched once.
+    """
+
+    def lookup_user(self, obj):
+        users = self.context.setdefault('users', {})
+        if obj.user_email not in users:
+            users.update(load_user_map([obj.user_email]))
+        return users[obj.user_email]
+
+
+class UserSerializer(TimedDataMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = User
         fields = ['id', 'username', 'name', 'first_name', 'last_name', 'email', 'team', 'created_at']
 
@@ -13,10 +50,11 @@ class UserSerializer(serializers.ModelSerializer):
         return str(obj._id) if hasattr(obj, '_id') else str(obj.pk) if obj.pk else None
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(TimedDataMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Team
         fields = ['id', 'name', 'description', 'created_at']
 
@@ -24,11 +62,12 @@ class TeamSerializer(serializers.ModelSerializer):
         return str(obj._id) if hasattr(obj, '_id') else str(obj.pk) if obj.pk else None
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(TimedDataMixin, UserLookupMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
     user = serializers.SerializerMethodField()
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Activity
         fields = ['id', 'user', 'user_email', 'activity_type', 'duration', 'distance', 'calories_burned', 'date', 'created_at']
 
@@ -36,19 +75,17 @@ class ActivitySerializer(serializers.ModelSerializer):
         return str(obj._id) if hasattr(obj, '_id') else str(obj.pk) if obj.pk else None
     
     def get_user(self, obj):
-        try:
-            user = User.objects.get(email=obj.user_email)
-            return user.name
-        except User.DoesNotExist:
-            return obj.user_email
+        user = self.lookup_user(obj)
+        return user.name if user else obj.user_email
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class LeaderboardSerializer(TimedDataMixin, UserLookupMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
     user = serializers.SerializerMethodField()
     team = serializers.SerializerMethodField()
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Leaderboard
         fields = ['id', 'user', 'user_email', 'team', 'total_points', 'total_calories', 'total_activities', 'rank', 'updated_at']
 
@@ -56,24 +93,19 @@ class LeaderboardSerializer(serializers.ModelSerializer):
         return str(obj._id) if hasattr(obj, '_id') else str(obj.pk) if obj.pk else None
     
     def get_user(self, obj):
-        try:
-            user = User.objects.get(email=obj.user_email)
-            return user.name
-        except User.DoesNotExist:
-            return obj.user_email
+        user = self.lookup_user(obj)
+        return user.name if user else obj.user_email
     
     def get_team(self, obj):
-        try:
-            user = User.objects.get(email=obj.user_email)
-            return user.team if user.team else 'No Team'
-        except User.DoesNotExist:
-            return 'No Team'
+        user = self.lookup_user(obj)
+        return user.team if user and user.team else 'No Team'
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(TimedDataMixin, serializers.ModelSerializer):
     id = serializers.SerializerMethodField()
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Workout
         fields = ['id', 'name', 'description', 'difficulty', 'duration', 'calories_estimate', 'created_at']
 
@@ -57,6 +57,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'octofit_tracker.middleware.RequestMetricsMiddleware',
+    'octofit_tracker.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,18 +92,120 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# CLIENT holds the MongoClient options. djongo builds one client per process
+# from it, and the async read path shares that client and its pool.
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
+        # Keep the connection between requests: closing it closes the shared
+        # MongoClient and its pool, which then reconnects on the next request
+        'CONN_MAX_AGE': None,
         'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+            'host': os.environ.get('MONGO_HOST', 'localhost'),
+            'port': int(os.environ.get('MONGO_PORT', 27017)),
+            # Keep warm connections for bursts and cap them per process
+            'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', 5)),
+            'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+            'maxIdleTimeMS': int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000)),
+            # Fail fast instead of queueing forever when the pool is exhausted
+            'waitQueueTimeoutMS': int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+            'connectTimeoutMS': int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+            'serverSelectionTimeoutMS': int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            'retryWrites': os.environ.get('MONGO_RETRY_WRITES', 'true').lower() == 'true',
+            'retryReads': os.environ.get('MONGO_RETRY_READS', 'true').lower() == 'true',
+            # e.g. secondaryPreferred to offload reads to replica set secondaries
+            'readPreference': os.environ.get('MONGO_READ_PREFERENCE', 'primary'),
         }
     }
 }
 
+# Wire compression, e.g. 'zstd,snappy,zlib' (zstd needs the zstandard package,
+# snappy needs python-snappy); the server picks the first one it supports
+if os.environ.get('MONGO_COMPRESSORS'):
+    DATABASES['default']['CLIENT']['compressors'] = os.environ['MONGO_COMPRESSORS']
+
+# /health reports the database as degraded once this share of a pool's
+# maxPoolSize connections is checked out
+MONGO_POOL_SATURATION_WARNING = float(os.environ.get('MONGO_POOL_SATURATION_WARNING', 0.8))
+
+
+# Django REST Framework
+# Every list endpoint is keyset-paginated; see octofit_tracker/pagination.py
+
+# JSON renderer for API responses: 'orjson' or 'drf' (DRF's stdlib json renderer)
+API_JSON_RENDERER = os.environ.get('API_JSON_RENDERER', 'orjson')
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 50,
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.ORJSONRenderer' if API_JSON_RENDERER == 'orjson'
+        else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Response compression: encodings in order of preference ('br' needs the
+# brotli package), the smallest body worth compressing, and effort levels
+API_COMPRESSION_ENCODINGS = os.environ.get('API_COMPRESSION_ENCODINGS', 'br,gzip').split(',')
+API_COMPRESSION_MIN_SIZE = int(os.environ.get('API_COMPRESSION_MIN_SIZE', 1024))
+API_COMPRESSION_GZIP_LEVEL = int(os.environ.get('API_COMPRESSION_GZIP_LEVEL', 6))
+API_COMPRESSION_BROTLI_QUALITY = int(os.environ.get('API_COMPRESSION_BROTLI_QUALITY', 4))
+
+# Add a Server-Timing header (DB commands and time, serializer and render
+# time) to every response; metrics are always kept for /metrics
+REQUEST_METRICS_SERVER_TIMING = os.environ.get('REQUEST_METRICS_SERVER_TIMING', 'true').lower() == 'true'
+
+# Serve user, activity and leaderboard lists straight from MongoDB documents
+# through precompiled row plans instead of the DRF serializers
+API_FAST_LIST_SERIALIZATION = os.environ.get('API_FAST_LIST_SERIALIZATION', 'true').lower() == 'true'
+
+# Seconds before a worker rebuilds its in-process leaderboard rank index,
+# search index and workout catalog in the background, to pick up writes made
+# by other workers; 0 keeps each one as first built (plus this worker's writes)
+RANK_INDEX_REFRESH_SECONDS = int(os.environ.get('RANK_INDEX_REFRESH_SECONDS', 60))
+SEARCH_INDEX_REFRESH_SECONDS = int(os.environ.get('SEARCH_INDEX_REFRESH_SECONDS', 60))
+WORKOUT_CATALOG_REFRESH_SECONDS = int(os.environ.get('WORKOUT_CATALOG_REFRESH_SECONDS', 60))
+
+# How many distinct words one typeahead prefix may expand to
+SEARCH_MAX_EXPANSIONS = int(os.environ.get('SEARCH_MAX_EXPANSIONS', 50))
+
+# Workouts stored per user by /api/workouts/recommended/
+WORKOUT_RECOMMENDATIONS_K = int(os.environ.get('WORKOUT_RECOMMENDATIONS_K', 10))
+
+# POST /api/activities/bulk/ limits: rows per request and rows per insert_many
+ACTIVITY_BULK_MAX_ROWS = 10000
+ACTIVITY_BULK_CHUNK_SIZE = 1000
+
+# GET /api/activities/export/: documents per cursor batch and the most user
+# names kept in memory while streaming
+ACTIVITY_EXPORT_BATCH_SIZE = 1000
+ACTIVITY_EXPORT_USER_CACHE_SIZE = 10000
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The 'api' alias holds cached API responses (see octofit_tracker/caching.py).
+# LocMemCache evicts least recently used entries beyond MAX_ENTRIES; set
+# API_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache and
+# API_CACHE_LOCATION to a directory to share the cache between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': os.environ.get('API_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('API_CACHE_LOCATION', 'octofit-api'),
+        'TIMEOUT': int(os.environ.get('API_CACHE_TIMEOUT', 300)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('API_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -144,6 +248,44 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Activity post-processing (leaderboards, rollups, live stream): 'inline'
+# during the write, or 'queue' to enqueue a background job. Queued jobs are
+# run by JOB_QUEUE_LOCAL_WORKERS threads in each web process and/or by
+# `manage.py run_workers`.
+ACTIVITY_POSTPROCESSING = os.environ.get('ACTIVITY_POSTPROCESSING', 'inline')
+JOB_QUEUE_LOCAL_WORKERS = int(os.environ.get('JOB_QUEUE_LOCAL_WORKERS', 0))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_BACKOFF_SECONDS = float(os.environ.get('JOB_RETRY_BACKOFF_SECONDS', 2))
+# A running job whose worker has not finished within the lease is retried
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 1))
+# Finished jobs (and so their idempotency keys) are kept this long
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 86400))
+
+# Idempotency-Key support on activity creates: how long a key's response is
+# replayed to retries, and after how long an unfinished request's claim on a
+# key may be taken over
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_SECONDS', 86400))
+IDEMPOTENCY_KEY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_KEY_LOCK_SECONDS', 60))
+
+# Block compressor of the activities_archive collection created by
+# `manage.py archive_activities` (zstd, zlib or snappy; empty for the server default)
+ACTIVITY_ARCHIVE_COMPRESSOR = os.environ.get('ACTIVITY_ARCHIVE_COMPRESSOR', 'zstd')
+
+# Live leaderboard stream (/api/leaderboard/stream/, ASGI only): events kept
+# in memory for reconnecting clients (older ones are read back from MongoDB),
+# events a slow client may have queued before it is told to re-fetch, idle
+# keepalive interval and the client reconnect delay
+LEADERBOARD_STREAM_HISTORY = int(os.environ.get('LEADERBOARD_STREAM_HISTORY', 256))
+LEADERBOARD_STREAM_QUEUE_SIZE = int(os.environ.get('LEADERBOARD_STREAM_QUEUE_SIZE', 1000))
+LEADERBOARD_STREAM_HEARTBEAT_SECONDS = int(os.environ.get('LEADERBOARD_STREAM_HEARTBEAT_SECONDS', 15))
+LEADERBOARD_STREAM_RETRY_MS = int(os.environ.get('LEADERBOARD_STREAM_RETRY_MS', 3000))
+# Leaderboard writes store stream events in MongoDB; web processes with
+# subscribers poll for them this often, and the stored events expire after
+# LEADERBOARD_EVENTS_TTL_SECONDS
+LEADERBOARD_EVENTS_POLL_SECONDS = float(os.environ.get('LEADERBOARD_EVENTS_POLL_SECONDS', 0.5))
+LEADERBOARD_EVENTS_TTL_SECONDS = int(os.environ.get('LEADERBOARD_EVENTS_TTL_SECONDS', 3600))
+
 # CORS Settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_METHODS = [
@@ -160,6 +302,7 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'idempotency-key',
     'origin',
     'user-agent',
     'x-csrftoken',
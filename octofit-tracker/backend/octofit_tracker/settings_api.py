@@ -0,0 +1,53 @@
+"""
+API-only settings profile for production web workers.
+
+Extends ``settings`` but boots only what the JSON API serves. The admin,
+sessions, messages, static files, auth and content types apps are not
+installed, nor their middleware. The admin URLs are not mounted, and the
+browsable API renderer is dropped. The API has no logins, so nothing it
+serves uses those apps; each worker just skips importing them on boot.
+Management commands and the admin keep using ``octofit_tracker.settings``.
+
+Select it with ``DJANGO_SETTINGS_MODULE=octofit_tracker.settings_api``.
+``manage.py profile_startup`` compares the cold start of both profiles.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK, TEMPLATES
+
+API_UNUSED_APPS = {
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+}
+API_UNUSED_MIDDLEWARE = {
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+}
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in API_UNUSED_APPS]
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in API_UNUSED_MIDDLEWARE]
+
+TEMPLATES = [{
+    **TEMPLATES[0],
+    'OPTIONS': {
+        'context_processors': [
+            'django.template.context_processors.debug',
+            'django.template.context_processors.request',
+        ],
+    },
+}]
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': [
+        renderer for renderer in REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES']
+        if renderer != 'rest_framework.renderers.BrowsableAPIRenderer'
+    ],
+    # Without django.contrib.auth there is no AnonymousUser; no endpoint authenticates
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'UNAUTHENTICATED_USER': None,
+}
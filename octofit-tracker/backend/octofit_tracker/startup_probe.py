@@ -0,0 +1,126 @@
+"""
+Cold-start probe run in a fresh interpreter by ``manage.py profile_startup``.
+
+Boots Django the way a WSGI worker does: settings, the app registry, the
+URLconf and the middleware chain. It then serves one request through the
+WSGI handler and prints a JSON line with the wall-clock time of each phase
+and the import, model-import and ``ready()`` time of each installed app.
+It also counts the loaded modules that had no cached bytecode to import:
+those were compiled from source during the boot. Only the standard library
+is imported before timing starts.
+
+    python -m octofit_tracker.startup_probe /api/leaderboard/?page_size=1
+"""
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+
+def _timed(function, into, key):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            into[key] = into.get(key, 0.0) + time.perf_counter() - started
+    return wrapper
+
+
+def uncompiled_modules():
+    """Return the loaded source modules whose bytecode cache is missing or older than the source."""
+    missing = []
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None)
+        # Scripts run as __main__ are never cached
+        if name in ('__main__', '__mp_main__') or not path or not path.endswith('.py'):
+            continue
+        try:
+            cached = importlib.util.cache_from_source(path)
+            if os.stat(cached).st_mtime < os.stat(path).st_mtime:
+                missing.append(name)
+        except (NotImplementedError, ValueError):
+            continue
+        except OSError:
+            missing.append(name)
+    return missing
+
+
+def probe(url):
+    phases, apps = {}, {}
+    last = time.perf_counter()
+
+    def phase(name):
+        nonlocal last
+        now = time.perf_counter()
+        phases[name] = now - last
+        last = now
+
+    import django
+    from django.apps import config
+
+    create = config.AppConfig.create.__func__
+
+    def timed_create(cls, entry):
+        started = time.perf_counter()
+        app_config = create(cls, entry)
+        timings = apps.setdefault(app_config.name, {'import': time.perf_counter() - started})
+        app_config.import_models = _timed(app_config.import_models, timings, 'models')
+        app_config.ready = _timed(app_config.ready, timings, 'ready')
+        return app_config
+
+    config.AppConfig.create = classmethod(timed_create)
+    phase('django')
+
+    from django.conf import settings
+    settings.INSTALLED_APPS
+    phase('settings')
+
+    django.setup(set_prefix=False)
+    phase('apps')
+
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    phase('urls')
+
+    from django.core.handlers.wsgi import WSGIHandler
+    application = WSGIHandler()
+    phase('middleware')
+
+    parts = urlsplit(url)
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': parts.path,
+        'QUERY_STRING': parts.query,
+        'SERVER_NAME': settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split()[0])
+
+    body = application(environ, start_response)
+    b''.join(body)
+    body.close()
+    phase('first_request')
+
+    return {
+        'finished_at': time.time(),
+        'status': response.get('status'),
+        'phases': phases,
+        'apps': apps,
+        'modules': len(sys.modules),
+        'uncompiled': uncompiled_modules(),
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(probe(sys.argv[1] if len(sys.argv) > 1 else '/api/leaderboard/?page_size=1')))
@@ -0,0 +1,143 @@
+"""
+Activity statistics computed with native MongoDB aggregation pipelines.
+
+These bypass djongo's SQL translation entirely: every pipeline runs on the
+``activities`` collection through PyMongo and does its grouping and summing
+in the database. Each report takes a ``match`` filter (a MongoDB query
+document) that is applied first so it can use the activity indexes. Reports
+whose date range reaches archived activities also aggregate the archive.
+
+The ``*_pipeline`` builders return ``(pipeline, key)`` so the same pipelines
+can be run by the synchronous helpers here or by the async read path.
+"""
+from .archive import with_archive
+from .leaderboard import POINTS_PER_ACTIVITY, POINTS_PER_KM
+from .models import Activity, User
+from .mongo import get_collection
+
+BUCKET_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%G-W%V',
+    'month': '%Y-%m',
+}
+
+TOTALS = {
+    'activities': {'$sum': 1},
+    'total_duration': {'$sum': '$duration'},
+    'total_distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+    'total_calories': {'$sum': '$calories_burned'},
+    'total_points': {'$sum': {'$add': [
+        '$calories_burned',
+        POINTS_PER_ACTIVITY,
+        {'$trunc': {'$multiply': [{'$ifNull': ['$distance', 0]}, POINTS_PER_KM]}},
+    ]}},
+}
+
+
+def with_match(pipeline, match=None):
+    return ([{'$match': match}] if match else []) + pipeline
+
+
+def rows(documents, key):
+    """Rename ``_id`` to ``key`` and round distances for output."""
+    result = []
+    for document in documents:
+        row = {key: document.pop('_id')}
+        row.update(document)
+        if 'total_distance' in row:
+            row['total_distance'] = round(row['total_distance'], 2)
+        result.append(row)
+    return result
+
+
+def run(pipeline, key):
+    """Run a report pipeline on the activities collection and return its rows."""
+    return rows(get_collection(Activity).aggregate(with_archive(pipeline), allowDiskUse=True), key)
+
+
+def user_totals_pipeline(match=None, limit=None):
+    """Totals per ``user_email``, highest calories first."""
+    pipeline = [
+        {'$group': {'_id': '$user_email', **TOTALS}},
+        {'$sort': {'total_calories': -1, '_id': 1}},
+    ]
+    if limit:
+        pipeline.append({'$limit': limit})
+    return with_match(pipeline, match), 'user_email'
+
+
+def team_totals_pipeline(match=None):
+    """
+    Totals per team, highest calories first.
+
+    Activities are grouped per user before joining ``users`` so the lookup
+    runs once per user rather than once per activity.
+    """
+    sums = {field: {'$sum': f'${field}'} for field in TOTALS}
+    pipeline = [
+        {'$group': {'_id': '$user_email', **TOTALS}},
+        {'$lookup': {
+            'from': User._meta.db_table,
+            'localField': '_id',
+            'foreignField': 'email',
+            'as': 'user',
+        }},
+        {'$unwind': {'path': '$user', 'preserveNullAndEmptyArrays': True}},
+        {'$group': {
+            '_id': {'$ifNull': ['$user.team', 'No Team']},
+            'members': {'$sum': 1},
+            **sums,
+        }},
+        {'$sort': {'total_calories': -1, '_id': 1}},
+    ]
+    return with_match(pipeline, match), 'team'
+
+
+def activity_type_totals_pipeline(match=None):
+    """Totals per ``activity_type``, most frequent first."""
+    pipeline = [
+        {'$group': {'_id': '$activity_type', **TOTALS}},
+        {'$sort': {'activities': -1, '_id': 1}},
+    ]
+    return with_match(pipeline, match), 'activity_type'
+
+
+def timeline_pipeline(bucket='day', match=None):
+    """Totals per day, ISO week or month (UTC), oldest first."""
+    pipeline = [
+        {'$group': {
+            '_id': {'$dateToString': {'format': BUCKET_FORMATS[bucket], 'date': '$date'}},
+            **TOTALS,
+        }},
+        {'$sort': {'_id': 1}},
+    ]
+    return with_match(pipeline, match), bucket
+
+
+def user_totals(match=None, limit=None):
+    return run(*user_totals_pipeline(match, limit))
+
+
+def team_totals(match=None):
+    return run(*team_totals_pipeline(match))
+
+
+def activity_type_totals(match=None):
+    return run(*activity_type_totals_pipeline(match))
+
+
+def timeline(bucket='day', match=None):
+    return run(*timeline_pipeline(bucket, match))
+
+
+def iter_user_totals_by_points(match=None, batch_size=1000):
+    """
+    Stream raw per-user totals, highest points first, without building a list.
+
+    Documents keep the email in ``_id``; used to rebuild the leaderboard for
+    datasets too large to hold in memory, so archived activities count too.
+    """
+    return get_collection(Activity).aggregate(with_archive(with_match([
+        {'$group': {'_id': '$user_email', **TOTALS}},
+        {'$sort': {'total_points': -1, '_id': 1}},
+    ], match), whole_history=True), allowDiskUse=True, batchSize=batch_size)
@@ -0,0 +1,128 @@
+"""
+Team standings kept as running totals, credited to each user's current team.
+
+Per-team running totals live in the ``team_leaderboard`` collection.
+Activity writes add each user's leaderboard delta to their current team.
+``user_teams`` reads the teams of a write's users from the users collection
+with one ``$in`` query, so a team change made by any process counts from the
+next write on. When a user joins, leaves or changes team, their current
+leaderboard totals are moved between the two teams with ``$inc`` updates,
+so no activities are rescanned. ``rebuild_team_leaderboard`` recomputes
+everything from the users and the user leaderboard.
+"""
+from collections import defaultdict
+
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from .models import Leaderboard, TeamLeaderboard, User
+from .mongo import get_collection
+
+TOTAL_FIELDS = ('total_points', 'total_calories', 'total_activities', 'members')
+
+
+def user_teams(emails):
+    """Return ``email -> team name`` (None without a team) for the given emails with one ``$in`` query."""
+    emails = list(set(emails))
+    if not emails:
+        return {}
+    cursor = get_collection(User).find({'email': {'$in': emails}}, {'_id': 0, 'email': 1, 'team': 1})
+    return {user['email']: user.get('team') or None for user in cursor}
+
+
+def apply_team_deltas(deltas):
+    """Apply ``{team: [points, calories, activities, members]}`` with one bulk write."""
+    deltas = {team: delta for team, delta in deltas.items() if team and any(delta)}
+    if not deltas:
+        return
+    now = timezone.now()
+    get_collection(TeamLeaderboard).bulk_write([
+        UpdateOne(
+            {'team': team},
+            {'$inc': dict(zip(TOTAL_FIELDS, delta)), '$set': {'updated_at': now}},
+            upsert=True,
+        )
+        for team, delta in deltas.items()
+    ], ordered=False)
+
+
+def record_user_deltas(user_deltas):
+    """Credit ``leaderboard.activity_deltas`` output to each user's current team."""
+    teams = user_teams(user_deltas)
+    deltas = defaultdict(lambda: [0, 0, 0, 0])
+    for email, (points, calories, activities) in user_deltas.items():
+        delta = deltas[teams.get(email)]
+        delta[0] += points
+        delta[1] += calories
+        delta[2] += activities
+    apply_team_deltas(deltas)
+
+
+def user_totals(email):
+    """Return ``[points, calories, activities]`` from the user's leaderboard entry."""
+    entry = get_collection(Leaderboard).find_one(
+        {'user_email': email}, {'total_points': 1, 'total_calories': 1, 'total_activities': 1},
+    ) or {}
+    return [entry.get('total_points') or 0, entry.get('total_calories') or 0, entry.get('total_activities') or 0]
+
+
+def record_user_change(before=None, after=None):
+    """
+    Keep the team totals current when a user is created, updated or deleted.
+
+    ``before`` and ``after`` are ``(email, team)`` pairs for the user's old
+    and new state; pass None for the missing side of a create or delete.
+    """
+    if before == after:
+        return
+    deltas = defaultdict(lambda: [0, 0, 0, 0])
+    for sign, state in ((-1, before), (1, after)):
+        if state and state[1]:
+            delta = deltas[state[1]]
+            for position, amount in enumerate(user_totals(state[0]) + [1]):
+                delta[position] += sign * amount
+    apply_team_deltas(deltas)
+
+
+def team_standings():
+    """Return every team with members, highest points first, with competition ranks."""
+    cursor = get_collection(TeamLeaderboard).find(
+        {'members': {'$gt': 0}}, {'_id': 0, 'updated_at': 0},
+    ).sort([('total_points', -1), ('team', 1)])
+    rows = []
+    for position, row in enumerate(cursor):
+        if rows and rows[-1]['total_points'] == row['total_points']:
+            rank = rows[-1]['rank']
+        else:
+            rank = position + 1
+        rows.append({'rank': rank, **row})
+    return rows
+
+
+def rebuild_team_leaderboard():
+    """Recompute every team's totals from the users and the user leaderboard."""
+    documents = list(get_collection(User).aggregate([
+        {'$match': {'team': {'$nin': [None, '']}}},
+        {'$lookup': {
+            'from': Leaderboard._meta.db_table,
+            'localField': 'email',
+            'foreignField': 'user_email',
+            'as': 'entry',
+        }},
+        {'$unwind': {'path': '$entry', 'preserveNullAndEmptyArrays': True}},
+        {'$group': {
+            '_id': '$team',
+            'members': {'$sum': 1},
+            'total_points': {'$sum': {'$ifNull': ['$entry.total_points', 0]}},
+            'total_calories': {'$sum': {'$ifNull': ['$entry.total_calories', 0]}},
+            'total_activities': {'$sum': {'$ifNull': ['$entry.total_activities', 0]}},
+        }},
+    ]))
+    now = timezone.now()
+    collection = get_collection(TeamLeaderboard)
+    collection.delete_many({})
+    if documents:
+        collection.insert_many([
+            {'team': document.pop('_id'), **document, 'updated_at': now} for document in documents
+        ])
+    return len(documents)
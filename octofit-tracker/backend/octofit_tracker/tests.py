@@ -1,6 +1,52 @@
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import close_old_connections, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
-from .models import User, Team, Activity, Leaderboard, Workout
+from django.utils.translation import gettext_lazy
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import patch
+from bson import ObjectId
+from pymongo.errors import ServerSelectionTimeoutError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from . import async_views, jobs, leaderboard, live, settings_api
+from .archive import get_archive_collection
+from .caching import invalidate_responses
+from .export import BoundedUserCache, iter_activity_batches
+from .health import pool_report
+from .live import (
+    RESET, STREAM_PATH, ChangeFeed, EventRelay, get_events_collection, stored_events, with_leaderboard_stream,
+)
+from .middleware import CompressionMiddleware, gzip_compressor
+from .metrics import REGISTRY, CommandMetricsListener, PoolMetricsListener, finish_request, start_request
+from .renderers import ORJSONRenderer
+from .management.commands.benchmark_api import endpoint_cases
+from .management.commands.ensure_indexes import HOT_QUERIES, declared_indexes
+from .management.commands.profile_startup import import_times
+from .mongo import get_collection
+from .models import User, Team, Activity, ActivityRollup, IdempotencyKey, Job, Leaderboard, TeamLeaderboard, Workout, WorkoutProfile
+from .process_cache import ProcessCache
+from .rank_index import RankIndex, get_rank_index, reset_rank_index
+from .recommendations import reset_catalog
+from .search import SearchIndex, reset_search_index
+from .rollups import rebuild_rollups
+from .team_leaderboard import rebuild_team_leaderboard
 
 
 class UserModelTest(TestCase):
@@ -136,3 +182,1669 @@ class WorkoutModelTest(TestCase):
     def test_workout_string_representation(self):
         """Test the string representation of a workout."""
         self.assertEqual(str(self.workout), "Morning Run")
+
+
+class UserLookupQueryCountTest(TestCase):
+    """Tests that list endpoints resolve users with a constant number of queries."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        User.objects.filter(email__startswith='lookup').delete()
+
+    def create_user_with_stats(self, index):
+        email = f"lookup{index}@example.com"
+        User.objects.create(username=f"lookup{index}", name=f"Lookup {index}", email=email, team="Team Lookup")
+        Activity.objects.create(
+            user_email=email,
+            activity_type="Running",
+            duration=30,
+            calories_burned=250,
+            date=timezone.now()
+        )
+        Leaderboard.objects.create(user_email=email, total_calories=250, total_activities=1, rank=index)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+    def assert_constant_queries(self, url):
+        for index in range(1, 3):
+            self.create_user_with_stats(index)
+        small_count, _ = self.count_queries(url)
+        for index in range(3, 9):
+            self.create_user_with_stats(index)
+        large_count, data = self.count_queries(url)
+        self.assertEqual(small_count, large_count)
+        return data
+
+    def test_activity_list_query_count_is_constant(self):
+        """Test that /api/activities/ does not query users per row."""
+        data = self.assert_constant_queries('/api/activities/')
+        self.assertEqual({row['user'] for row in data['results']}, {f"Lookup {index}" for index in range(1, 9)})
+
+    def test_leaderboard_list_query_count_is_constant(self):
+        """Test that /api/leaderboard/ does not query users per row."""
+        data = self.assert_constant_queries('/api/leaderboard/')
+        self.assertEqual({row['team'] for row in data['results']}, {"Team Lookup"})
+
+
+class ActivityPaginationTest(TestCase):
+    """Tests for cursor pagination and filtering of /api/activities/."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        User.objects.filter(email__startswith='page').delete()
+        User.objects.create(username="page1", name="Page One", email="page1@example.com", team="Team Page")
+        User.objects.create(username="page2", name="Page Two", email="page2@example.com", team="Team Other")
+        start = timezone.now().replace(microsecond=0)
+        for index in range(7):
+            Activity.objects.create(
+                user_email="page1@example.com" if index % 2 else "page2@example.com",
+                activity_type="Running" if index < 4 else "Cycling",
+                duration=30,
+                calories_burned=100 + index,
+                # Two activities share each timestamp to exercise the _id tie-breaker
+                date=start - timedelta(days=index // 2)
+            )
+
+    def collect_pages(self, url):
+        rows = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            rows.extend(data['results'])
+            url = data['next']
+        return rows
+
+    def test_cursor_walks_every_row_once_newest_first(self):
+        """Test that following next links returns each activity exactly once."""
+        rows = self.collect_pages('/api/activities/?page_size=2')
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(len({row['id'] for row in rows}), 7)
+        dates = [row['date'] for row in rows]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_invalid_cursor_returns_404(self):
+        """Test that a tampered cursor is rejected."""
+        response = self.client.get('/api/activities/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_filters(self):
+        """Test the user_email, activity_type, team and date range filters."""
+        rows = self.collect_pages('/api/activities/?user_email=page1@example.com')
+        self.assertEqual({row['user_email'] for row in rows}, {"page1@example.com"})
+        rows = self.collect_pages('/api/activities/?activity_type=Cycling')
+        self.assertEqual(len(rows), 3)
+        rows = self.collect_pages('/api/activities/?team=Team%20Other')
+        self.assertEqual({row['user_email'] for row in rows}, {"page2@example.com"})
+        today = timezone.now().date().isoformat()
+        rows = self.collect_pages(f'/api/activities/?date_from={today}&date_to={today}')
+        self.assertEqual(len(rows), 2)
+
+    def test_invalid_date_returns_400(self):
+        """Test that a malformed date filter is rejected."""
+        response = self.client.get('/api/activities/?date_from=yesterday')
+        self.assertEqual(response.status_code, 400)
+
+
+class IncrementalLeaderboardTest(TestCase):
+    """Tests that activity writes keep leaderboard totals and ranks current."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        reset_rank_index()
+
+    def post_activity(self, email, calories, distance=0.0):
+        response = self.client.post('/api/activities/', {
+            'user_email': email,
+            'activity_type': 'Running',
+            'duration': 30,
+            'distance': distance,
+            'calories_burned': calories,
+            'date': timezone.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def standings(self):
+        return {entry.user_email: (entry.total_points, entry.rank) for entry in Leaderboard.objects.all()}
+
+    def test_create_adds_points_and_ranks(self):
+        """Test that created activities update totals and competition ranks."""
+        self.post_activity("a@example.com", 100, distance=2.0)
+        self.post_activity("b@example.com", 300)
+        self.post_activity("c@example.com", 100, distance=2.0)
+        entry = Leaderboard.objects.get(user_email="a@example.com")
+        self.assertEqual(entry.total_calories, 100)
+        self.assertEqual(entry.total_activities, 1)
+        self.assertEqual(self.standings(), {
+            "b@example.com": (310, 1),
+            "a@example.com": (210, 2),
+            "c@example.com": (210, 2),
+        })
+
+    def test_update_and_delete_shift_affected_ranks(self):
+        """Test that updates and deletes move only the users in between."""
+        self.post_activity("a@example.com", 100)
+        self.post_activity("b@example.com", 200)
+        activity = self.post_activity("c@example.com", 50)
+        self.assertEqual(self.standings()["c@example.com"], (60, 3))
+
+        response = self.client.patch(f"/api/activities/{activity['id']}/", {'calories_burned': 500}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.standings(), {
+            "c@example.com": (510, 1),
+            "b@example.com": (210, 2),
+            "a@example.com": (110, 3),
+        })
+
+        response = self.client.delete(f"/api/activities/{activity['id']}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.standings(), {
+            "c@example.com": (0, 3),
+            "b@example.com": (210, 1),
+            "a@example.com": (110, 2),
+        })
+
+
+class RankIndexTest(TestCase):
+    """Tests for the in-process leaderboard rank index."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.index = RankIndex([
+            ("a@example.com", 10),
+            ("b@example.com", 20),
+            ("c@example.com", 20),
+            ("d@example.com", 5),
+        ])
+
+    def test_rank_uses_competition_ranking(self):
+        """Test that tied users share a rank and the next rank is skipped."""
+        self.assertEqual(self.index.rank("b@example.com"), 1)
+        self.assertEqual(self.index.rank("c@example.com"), 1)
+        self.assertEqual(self.index.rank("a@example.com"), 3)
+        self.assertIsNone(self.index.rank("missing@example.com"))
+
+    def test_update_moves_user(self):
+        """Test that a score change is reflected in ranks and top K."""
+        self.index.update("d@example.com", 30)
+        top = self.index.top(2)
+        self.assertEqual([row['user_email'] for row in top], ["d@example.com", "b@example.com"])
+        self.assertEqual([row['rank'] for row in top], [1, 2])
+        self.index.remove("d@example.com")
+        self.assertEqual(len(self.index), 3)
+
+    def test_around(self):
+        """Test that around returns the user with neighbours on each side."""
+        rows = self.index.around("a@example.com", 1)
+        self.assertEqual([row['user_email'] for row in rows], ["c@example.com", "a@example.com", "d@example.com"])
+        self.assertEqual([row['rank'] for row in rows], [1, 3, 4])
+
+    def test_changes_during_a_build_are_replayed(self):
+        """Test that a score change made while the index is being built reaches the built index."""
+        loading, release = threading.Event(), threading.Event()
+
+        def load():
+            loading.set()
+            release.wait(5)
+            return RankIndex([("a@example.com", 10)])
+
+        cache = ProcessCache(load, 'RANK_INDEX_REFRESH_SECONDS', 'test index')
+        builder = threading.Thread(target=cache.get)
+        builder.start()
+        loading.wait(5)
+        cache.apply(lambda index: index.update("b@example.com", 20))
+        release.set()
+        builder.join(5)
+        self.assertEqual(cache.value.rank("b@example.com"), 1)
+
+
+class LeaderboardRankActionTest(TestCase):
+    """Tests for the rank index actions on /api/leaderboard/."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Leaderboard.objects.all().delete()
+        reset_rank_index()
+        for rank, (email, points) in enumerate([("x@example.com", 300), ("y@example.com", 200), ("z@example.com", 100)], start=1):
+            Leaderboard.objects.create(user_email=email, total_points=points, total_calories=points, total_activities=1, rank=rank)
+
+    def test_me_and_around(self):
+        """Test that me and around report the user's rank and neighbours."""
+        response = self.client.get('/api/leaderboard/me/?email=y@example.com&radius=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['rank'], 2)
+        self.assertEqual(len(response.json()['results']), 3)
+        response = self.client.get('/api/leaderboard/around/?email=z@example.com&radius=1')
+        self.assertEqual([row['user_email'] for row in response.json()['results']], ["y@example.com", "z@example.com"])
+
+    def test_top_and_missing_user(self):
+        """Test the top action and the 404/400 responses."""
+        response = self.client.get('/api/leaderboard/top/?k=1')
+        self.assertEqual(response.json()['results'][0]['user_email'], "x@example.com")
+        self.assertEqual(self.client.get('/api/leaderboard/around/?email=nobody@example.com').status_code, 404)
+        self.assertEqual(self.client.get('/api/leaderboard/around/').status_code, 400)
+
+    def test_stale_index_is_served_while_refreshing(self):
+        """Test that a stale index keeps answering while a background rebuild picks up other writes."""
+        index = get_rank_index()
+        index.loaded_at -= 3600
+        Leaderboard.objects.create(user_email="w@example.com", total_points=400, total_calories=400, total_activities=1, rank=1)
+        self.assertIs(get_rank_index(), index)
+        deadline = time.monotonic() + 5
+        while get_rank_index() is index and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(get_rank_index().rank("w@example.com"), 1)
+
+    @override_settings(RANK_INDEX_REFRESH_SECONDS=0)
+    def test_zero_disables_refreshing(self):
+        """Test that a refresh interval of 0 keeps the first index however old it gets."""
+        index = get_rank_index()
+        index.loaded_at -= 3600
+        Leaderboard.objects.create(user_email="w@example.com", total_points=400, total_calories=400, total_activities=1, rank=1)
+        self.assertIs(get_rank_index(), index)
+        time.sleep(0.05)
+        self.assertIs(get_rank_index(), index)
+        self.assertIsNone(index.rank("w@example.com"))
+
+
+class IndexDeclarationTest(TestCase):
+    """Tests for the model index declarations used by ensure_indexes."""
+
+    def test_hot_filters_are_indexed(self):
+        """Test that every hot query's leading field has a declared index."""
+        prefixes = {(model, keys[0][0]) for model, _, keys, _ in declared_indexes()}
+        for model, query, sort in HOT_QUERIES:
+            leading = next(iter(query), None) or sort[0][0]
+            self.assertIn((model, leading), prefixes)
+
+
+class StatsEndpointTest(TestCase):
+    """Tests for the aggregation-pipeline /api/stats/ endpoints."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        User.objects.filter(email__startswith='stats').delete()
+        User.objects.create(username="stats1", name="Stats One", email="stats1@example.com", team="Team Stats")
+        User.objects.create(username="stats2", name="Stats Two", email="stats2@example.com", team="Team Stats")
+        day = timezone.now().replace(hour=12)
+        for email, activity_type, calories, distance in [
+            ("stats1@example.com", "running", 300, 5.0),
+            ("stats1@example.com", "yoga", 100, 0.0),
+            ("stats2@example.com", "running", 200, 2.5),
+            ("solo@example.com", "running", 50, 0.0),
+        ]:
+            Activity.objects.create(
+                user_email=email,
+                activity_type=activity_type,
+                duration=30,
+                distance=distance,
+                calories_burned=calories,
+                date=day
+            )
+
+    def results(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_user_totals(self):
+        """Test per-user sums and points computed in the database."""
+        rows = self.results('/api/stats/users/')
+        self.assertEqual(rows[0]['user_email'], "stats1@example.com")
+        self.assertEqual(rows[0]['activities'], 2)
+        self.assertEqual(rows[0]['total_calories'], 400)
+        self.assertEqual(rows[0]['total_distance'], 5.0)
+        self.assertEqual(rows[0]['total_points'], 400 + 20 + 250)
+
+    def test_team_and_activity_type_totals(self):
+        """Test per-team and per-activity-type grouping."""
+        teams = {row['team']: row for row in self.results('/api/stats/teams/')}
+        self.assertEqual(teams["Team Stats"]['members'], 2)
+        self.assertEqual(teams["Team Stats"]['total_calories'], 600)
+        self.assertEqual(teams["No Team"]['total_calories'], 50)
+        types = {row['activity_type']: row['activities'] for row in self.results('/api/stats/activity-types/')}
+        self.assertEqual(types, {"running": 3, "yoga": 1})
+
+    def test_timeline_and_filters(self):
+        """Test daily buckets and the team filter."""
+        rows = self.results('/api/stats/timeline/?bucket=day&team=Team%20Stats')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['total_calories'], 600)
+        self.assertEqual(self.client.get('/api/stats/timeline/?bucket=hour').status_code, 400)
+
+
+class BulkActivityIngestionTest(TestCase):
+    """Tests for POST /api/activities/bulk/."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        reset_rank_index()
+
+    def row(self, email, calories):
+        return {
+            'user_email': email,
+            'activity_type': 'cycling',
+            'duration': 45,
+            'calories_burned': calories,
+            'date': timezone.now().isoformat(),
+        }
+
+    def test_json_array_with_partial_failure(self):
+        """Test that valid rows are stored and invalid ones reported by index."""
+        rows = [self.row("bulk@example.com", 100), {'user_email': 'not-an-email'}, self.row("bulk@example.com", 200)]
+        response = self.client.post('/api/activities/bulk/', rows, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1])
+        self.assertEqual(Activity.objects.filter(user_email="bulk@example.com").count(), 2)
+        entry = Leaderboard.objects.get(user_email="bulk@example.com")
+        self.assertEqual((entry.total_calories, entry.total_activities, entry.rank), (300, 2, 1))
+
+    def test_ndjson_body(self):
+        """Test that NDJSON bodies are accepted."""
+        body = "\n".join(json.dumps(self.row("ndjson@example.com", 50 + index)) for index in range(5))
+        response = self.client.post('/api/activities/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 5)
+        activity = Activity.objects.filter(user_email="ndjson@example.com").first()
+        self.assertEqual(activity.distance, 0.0)
+        self.assertIsNotNone(activity.created_at)
+
+    def test_rejects_non_list(self):
+        """Test that a single object is rejected."""
+        response = self.client.post('/api/activities/bulk/', self.row("x@example.com", 1), format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ActivityDeduplicationTest(TestCase):
+    """Tests for natural-key deduplication and Idempotency-Key support on activity creates."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        get_collection(IdempotencyKey).delete_many({})
+        reset_rank_index()
+        # Other tests store repeated activities, so the index only exists here
+        self.activities = get_collection(Activity)
+        for model, name, keys, unique in declared_indexes():
+            if name == 'activity_natural_key_uniq':
+                self.activities.create_index(keys, name=name, unique=unique)
+        self.date = timezone.now().replace(microsecond=0)
+
+    def tearDown(self):
+        self.activities.drop_index('activity_natural_key_uniq')
+
+    def row(self, email="dedupe@example.com", calories=300, activity_type="running"):
+        return {'user_email': email, 'activity_type': activity_type, 'duration': 30,
+                'calories_burned': calories, 'date': self.date.isoformat()}
+
+    def test_repeated_create_returns_stored_activity(self):
+        """Test that a repeated activity is answered with the stored one and counted once."""
+        first = self.client.post('/api/activities/', self.row(), format='json')
+        self.assertEqual(first.status_code, 201)
+        again = self.client.post('/api/activities/', self.row(calories=999), format='json')
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json(), first.json())
+        other = self.client.post('/api/activities/', self.row(activity_type="yoga"), format='json')
+        self.assertEqual(other.status_code, 201)
+        entry = Leaderboard.objects.get(user_email="dedupe@example.com")
+        self.assertEqual((entry.total_activities, entry.total_calories), (2, 600))
+
+    def test_bulk_reports_duplicates(self):
+        """Test that bulk rows repeating stored or earlier rows are skipped, not failed."""
+        self.client.post('/api/activities/', self.row(), format='json')
+        rows = [self.row(), self.row(activity_type="yoga"), self.row(activity_type="yoga"), {'user_email': 'bad'}]
+        response = self.client.post('/api/activities/bulk/', rows, format='json')
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual((body['created'], body['duplicates'], body['failed']), (1, [0, 2], 1))
+        self.assertEqual(Activity.objects.filter(user_email="dedupe@example.com").count(), 2)
+        self.assertEqual(Leaderboard.objects.get(user_email="dedupe@example.com").total_activities, 2)
+
+    def test_update_onto_existing_key_is_rejected(self):
+        """Test that an update cannot turn an activity into a duplicate of another."""
+        self.client.post('/api/activities/', self.row(), format='json')
+        yoga = self.client.post('/api/activities/', self.row(activity_type="yoga"), format='json').json()
+        response = self.client.patch(f"/api/activities/{yoga['id']}/", {'activity_type': 'running'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_idempotency_key_replays_response(self):
+        """Test that a retried request with the same key gets the stored response."""
+        first = self.client.post('/api/activities/', self.row(), format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+        retry = self.client.post('/api/activities/', self.row(), format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        misuse = self.client.post('/api/activities/', self.row(calories=1), format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(misuse.status_code, 422)
+        bulk = self.client.post('/api/activities/bulk/', [self.row(activity_type="yoga")], format='json',
+                                HTTP_IDEMPOTENCY_KEY='k2')
+        replayed = self.client.post('/api/activities/bulk/', [self.row(activity_type="yoga")], format='json',
+                                    HTTP_IDEMPOTENCY_KEY='k2')
+        self.assertEqual(replayed.json(), bulk.json())
+        self.assertEqual(replayed.json()['created'], 1)
+
+    def test_in_progress_and_expired_keys(self):
+        """Test that in-progress keys conflict, abandoned or expired ones are reclaimed and failures release."""
+        keys = get_collection(IdempotencyKey)
+        now = timezone.now()
+        keys.insert_one({'key': 'busy', 'fingerprint': 'x', 'created_at': now,
+                         'response_status': None, 'response_body': None})
+        keys.insert_one({'key': 'stale', 'fingerprint': 'x', 'created_at': now - timedelta(minutes=5),
+                         'response_status': None, 'response_body': None})
+        keys.insert_one({'key': 'old', 'fingerprint': 'x', 'created_at': now - timedelta(days=2),
+                         'response_status': 201, 'response_body': '{}'})
+        response = self.client.post('/api/activities/', self.row(), format='json', HTTP_IDEMPOTENCY_KEY='busy')
+        self.assertEqual(response.status_code, 409)
+        for key, activity_type in (('stale', 'yoga'), ('old', 'cycling')):
+            response = self.client.post('/api/activities/', self.row(activity_type=activity_type), format='json',
+                                        HTTP_IDEMPOTENCY_KEY=key)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(keys.find_one({'key': key})['response_status'], 201)
+        invalid = self.client.post('/api/activities/', {'user_email': 'bad'}, format='json', HTTP_IDEMPOTENCY_KEY='v')
+        self.assertEqual(invalid.status_code, 400)
+        self.assertIsNone(keys.find_one({'key': 'v'}))
+
+    def test_dedupe_then_ensure_indexes(self):
+        """Test that dedupe_activities clears existing duplicates so the indexes, TTL included, can be built."""
+        self.activities.drop_index('activity_natural_key_uniq')
+        self.client.post('/api/activities/bulk/', [self.row(), self.row(), self.row()], format='json')
+        call_command('dedupe_activities', stdout=io.StringIO())
+        self.assertEqual(self.activities.count_documents({}), 1)
+        self.assertEqual(Leaderboard.objects.get(user_email="dedupe@example.com").total_activities, 1)
+        call_command('ensure_indexes', stdout=io.StringIO())
+        self.assertTrue(self.activities.index_information()['activity_natural_key_uniq'].get('unique'))
+        ttl = get_collection(IdempotencyKey).index_information()['idempotency_key_ttl_idx']
+        self.assertEqual(ttl['expireAfterSeconds'], 86400)
+
+
+@override_settings(ACTIVITY_ARCHIVE_COMPRESSOR='')
+class ActivityArchiveTest(TestCase):
+    """Tests for archive_activities and reads that fall through to the archive."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        get_collection(ActivityRollup).delete_many({})
+        get_archive_collection().drop()
+        reset_rank_index()
+        self.now = timezone.now().replace(microsecond=0)
+        self.old = [self.post_activity(self.now - timedelta(days=400 + index), 100 + index) for index in range(2)]
+        self.recent = self.post_activity(self.now - timedelta(days=1), 300)
+        self.rollups = list(get_collection(ActivityRollup).find({}, {'_id': 0}).sort([('scope', 1), ('key', 1),
+                                                                                      ('period', 1), ('bucket_start', 1)]))
+        call_command('archive_activities', older_than='365d', stdout=io.StringIO())
+
+    def tearDown(self):
+        get_archive_collection().drop()
+
+    def post_activity(self, date, calories, expected=201):
+        response = self.client.post('/api/activities/', {
+            'user_email': 'archive@example.com', 'activity_type': 'running', 'duration': 30,
+            'calories_burned': calories, 'date': date.isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, expected)
+        return response.json()
+
+    def ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_moves_old_activities_and_keeps_totals(self):
+        """Test that old activities move to the archive without changing the leaderboard or rollups."""
+        self.assertEqual(get_collection(Activity).count_documents({}), 1)
+        self.assertEqual(get_archive_collection().count_documents({}), 2)
+        entry = Leaderboard.objects.get(user_email='archive@example.com')
+        self.assertEqual((entry.total_activities, entry.total_calories), (3, 501))
+        rollups = list(get_collection(ActivityRollup).find({}, {'_id': 0}).sort([('scope', 1), ('key', 1),
+                                                                                ('period', 1), ('bucket_start', 1)]))
+        self.assertEqual(rollups, self.rollups)
+        out = io.StringIO()
+        call_command('archive_activities', older_than='52w', dry_run=True, stdout=out)
+        self.assertIn('0 activities', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('archive_activities', older_than='a year', stdout=io.StringIO())
+
+    def test_historical_reads_fall_through(self):
+        """Test that lists, detail reads and exports reaching back past the archive boundary include it."""
+        self.assertEqual(self.ids('/api/activities/'), [self.recent['id']])
+        since = (self.now - timedelta(days=500)).date().isoformat()
+        expected = [self.recent['id'], self.old[0]['id'], self.old[1]['id']]
+        self.assertEqual(self.ids(f'/api/activities/?date_from={since}'), expected)
+        self.assertEqual(self.ids(f'/api/activities/?date_from={self.now.date().isoformat()}'), [])
+        paged, url = [], f'/api/activities/?date_from={since}&page_size=2'
+        while url:
+            body = self.client.get(url).json()
+            paged += [row['id'] for row in body['results']]
+            url = body['next']
+        self.assertEqual(paged, expected)
+        self.assertEqual(self.client.get(f"/api/activities/{self.old[0]['id']}/").json(), self.old[0])
+        export = self.client.get(f'/api/activities/export/?date_from={since}')
+        rows = [json.loads(line) for line in b''.join(export.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], expected[::-1])
+
+        async def get():
+            return await self.async_client.get(f'/api/async/activities/?date_from={since}')
+        self.assertEqual([row['id'] for row in async_to_sync(get)().json()['results']], expected)
+
+    def test_reseeding_clears_the_archive(self):
+        """Test that populate_db drops archived activities so the rebuilt leaderboard does not count them."""
+        call_command('populate_db', activities_per_user=1, stdout=io.StringIO())
+        self.assertEqual(get_archive_collection().count_documents({}), 0)
+        self.assertEqual(get_collection(Activity).count_documents({}), Leaderboard.objects.count())
+        self.assertFalse(Leaderboard.objects.filter(user_email='archive@example.com').exists())
+
+    def test_archived_activities_still_deduplicate(self):
+        """Test that re-sending an archived activity is answered with the archived one."""
+        date = self.now - timedelta(days=400)
+        self.assertEqual(self.post_activity(date, 999, expected=200)['id'], self.old[0]['id'])
+        row = {'user_email': 'archive@example.com', 'activity_type': 'running', 'duration': 30,
+               'calories_burned': 1, 'date': date.isoformat()}
+        response = self.client.post('/api/activities/bulk/', [row, {**row, 'activity_type': 'yoga'}], format='json')
+        self.assertEqual((response.json()['created'], response.json()['duplicates']), (1, [0]))
+
+
+class ActivityRollupTest(TestCase):
+    """Tests for the incremental per-user and per-team rollups."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        get_collection(ActivityRollup).delete_many({})
+        User.objects.filter(email__startswith='rollup').delete()
+        User.objects.create(username="rollup1", name="Rollup One", email="rollup1@example.com", team="Team Rollup")
+        User.objects.create(username="rollup2", name="Rollup Two", email="rollup2@example.com", team="Team Rollup")
+        reset_rank_index()
+
+    def post_activity(self, email, date, calories, distance=0.0):
+        response = self.client.post('/api/activities/', {
+            'user_email': email,
+            'activity_type': 'running',
+            'duration': 30,
+            'distance': distance,
+            'calories_burned': calories,
+            'date': date,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def rollups(self, **params):
+        response = self.client.get('/api/stats/rollups/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def stored(self):
+        return sorted(
+            (doc['scope'], doc['key'], doc['period'], doc['bucket_start'], doc['activities'], doc['total_points'])
+            for doc in get_collection(ActivityRollup).find()
+        )
+
+    def test_writes_update_user_and_team_buckets(self):
+        """Test that creates, updates and deletes keep every bucket current."""
+        self.post_activity("rollup1@example.com", "2024-01-15T08:00:00Z", 100, distance=2.0)
+        self.post_activity("rollup2@example.com", "2024-01-16T08:00:00Z", 200)
+        activity = self.post_activity("rollup1@example.com", "2024-02-01T08:00:00Z", 50)
+
+        self.assertEqual(self.rollups(team="Team Rollup", period="month"), [
+            {'month': '2024-01', 'activities': 2, 'total_duration': 60, 'total_distance': 2.0,
+             'total_calories': 300, 'total_points': 420},
+            {'month': '2024-02', 'activities': 1, 'total_duration': 30, 'total_distance': 0.0,
+             'total_calories': 50, 'total_points': 60},
+        ])
+        self.assertEqual(
+            [row['week'] for row in self.rollups(user_email="rollup1@example.com", period="week")],
+            ['2024-W03', '2024-W05'],
+        )
+        days = self.rollups(team="Team Rollup", date_from="2024-01-16", date_to="2024-01-31")
+        self.assertEqual([row['day'] for row in days], ['2024-01-16'])
+
+        self.client.patch(f"/api/activities/{activity['id']}/", {'date': '2024-01-15T09:00:00Z'}, format='json')
+        self.assertEqual([row['day'] for row in self.rollups(user_email="rollup1@example.com")], ['2024-01-15'])
+        self.assertEqual(self.rollups(user_email="rollup1@example.com")[0]['activities'], 2)
+
+        self.client.delete(f"/api/activities/{activity['id']}/")
+        self.assertEqual(self.rollups(user_email="rollup1@example.com")[0]['activities'], 1)
+        self.assertEqual(self.rollups(team="Team Rollup", period="month")[0]['total_points'], 420)
+
+    def test_removals_leave_the_team_the_activity_was_recorded_for(self):
+        """Test that editing or deleting an activity after a team change updates the original team's buckets."""
+        edited = self.post_activity("rollup1@example.com", "2024-04-01T08:00:00Z", 100)
+        deleted = self.post_activity("rollup1@example.com", "2024-04-02T08:00:00Z", 100)
+        user = User.objects.get(email="rollup1@example.com")
+        response = self.client.patch(f"/api/users/{user._id}/", {'team': "Team Moved"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.patch(f"/api/activities/{edited['id']}/", {'calories_burned': 50}, format='json')
+        self.client.delete(f"/api/activities/{deleted['id']}/")
+        self.assertEqual(self.rollups(team="Team Rollup", period="month")[0]['total_calories'], 50)
+        self.assertEqual(self.rollups(team="Team Moved", period="month"), [])
+        self.post_activity("rollup1@example.com", "2024-04-03T08:00:00Z", 70)
+        self.assertEqual(self.rollups(team="Team Moved", period="month")[0]['total_calories'], 70)
+
+        incremental = self.stored()
+        rebuild_rollups()
+        self.assertEqual(self.stored(), incremental)
+
+    def test_seeded_activities_record_their_team(self):
+        """Test that populate_db stores each activity's team, as activity writes through the API do."""
+        call_command('populate_db', activities_per_user=1, stdout=io.StringIO())
+        teams = {user['email']: user['team'] for user in get_collection(User).find({}, {'email': 1, 'team': 1})}
+        activities = get_collection(Activity).find({}, {'user_email': 1, 'team': 1})
+        self.assertEqual({activity['user_email']: activity['team'] for activity in activities}, teams)
+
+    def test_rebuild_matches_incremental(self):
+        """Test that rebuild_rollups reproduces the incrementally maintained rollups."""
+        self.post_activity("rollup1@example.com", "2024-03-03T23:30:00Z", 120, distance=1.5)
+        self.post_activity("rollup2@example.com", "2024-03-04T00:30:00Z", 80)
+        self.client.post('/api/activities/bulk/', [{
+            'user_email': "rollup2@example.com", 'activity_type': 'cycling', 'duration': 45,
+            'calories_burned': 300, 'date': "2024-03-31T12:00:00Z",
+        }], format='json')
+        incremental = self.stored()
+        self.assertEqual(rebuild_rollups(), len(incremental))
+        self.assertEqual(self.stored(), incremental)
+
+    def test_requires_one_key(self):
+        """Test that exactly one of user_email or team is required."""
+        self.assertEqual(self.client.get('/api/stats/rollups/').status_code, 400)
+        self.assertEqual(self.client.get('/api/stats/rollups/?team=x&period=year').status_code, 400)
+
+
+class TeamLeaderboardTest(TestCase):
+    """Tests for the incrementally maintained team standings."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        TeamLeaderboard.objects.all().delete()
+        User.objects.all().delete()
+        reset_rank_index()
+        self.users = {}
+        for name, team in (("red1", "Red"), ("red2", "Red"), ("blue1", "Blue")):
+            response = self.client.post('/api/users/', {
+                'username': name, 'name': name, 'email': f"{name}@example.com", 'team': team,
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.users[name] = response.json()['id']
+
+    def post_activity(self, name, calories):
+        response = self.client.post('/api/activities/', {
+            'user_email': f"{name}@example.com",
+            'activity_type': 'running',
+            'duration': 30,
+            'calories_burned': calories,
+            'date': timezone.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def standings(self):
+        response = self.client.get('/api/leaderboard/teams/')
+        self.assertEqual(response.status_code, 200)
+        return [(row['rank'], row['team'], row['members'], row['total_points']) for row in response.json()['results']]
+
+    def test_activities_credit_the_users_team(self):
+        """Test that activity points accumulate per team."""
+        self.post_activity("red1", 100)
+        self.post_activity("red2", 50)
+        self.post_activity("blue1", 300)
+        self.assertEqual(self.standings(), [(1, "Blue", 1, 310), (2, "Red", 2, 170)])
+
+    def test_team_change_moves_user_totals(self):
+        """Test that changing team moves the user's points without a rescan."""
+        self.post_activity("red1", 100)
+        self.post_activity("blue1", 50)
+        response = self.client.patch(f"/api/users/{self.users['red1']}/", {'team': 'Blue'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.standings(), [(1, "Blue", 2, 170), (2, "Red", 1, 0)])
+
+        self.post_activity("red1", 40)
+        self.client.delete(f"/api/users/{self.users['blue1']}/")
+        self.assertEqual(self.standings(), [(1, "Blue", 1, 160), (2, "Red", 1, 0)])
+
+        incremental = self.standings()
+        rebuild_team_leaderboard()
+        self.assertEqual(self.standings(), incremental)
+
+    def test_team_changes_from_other_processes_count(self):
+        """Test that activities credit the team stored on the user, even if another process changed it."""
+        self.post_activity("red1", 100)
+        get_collection(User).update_one({'email': "red1@example.com"}, {'$set': {'team': "Blue"}})
+        self.post_activity("red1", 200)
+        points = {row['team']: row['total_points'] for row in get_collection(TeamLeaderboard).find()}
+        self.assertEqual(points, {"Red": 110, "Blue": 210})
+
+
+class ActivityExportTest(TestCase):
+    """Tests for the streaming GET /api/activities/export/."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        User.objects.filter(email__startswith='export').delete()
+        User.objects.create(username="export1", name="Export One", email="export1@example.com", team="Team Export")
+        day = timezone.now().replace(hour=12)
+        for offset, email in enumerate(["export1@example.com", "export2@example.com", "export1@example.com"]):
+            Activity.objects.create(
+                user_email=email, activity_type="running", duration=30, distance=1.5,
+                calories_burned=100 + offset, date=day - timedelta(days=2 - offset),
+            )
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson_matches_list_rows(self):
+        """Test that NDJSON rows equal the list endpoint's rows, oldest first."""
+        response = self.client.get('/api/activities/export/', {'format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        listed = self.client.get('/api/activities/').json()['results']
+        self.assertEqual(rows, list(reversed(listed)))
+        self.assertEqual(rows[0]['user'], "Export One")
+
+    def test_csv_with_team_filter_and_small_batches(self):
+        """Test CSV output, the team filter and batching across cursor batches."""
+        with self.settings(ACTIVITY_EXPORT_BATCH_SIZE=1):
+            response = self.client.get('/api/activities/export/', {'format': 'csv', 'team': 'Team Export'})
+        lines = self.content(response).splitlines()
+        self.assertEqual(lines[0], "id,user,user_email,activity_type,duration,distance,calories_burned,date,created_at")
+        self.assertEqual([line.split(',')[6] for line in lines[1:]], ["100", "102"])
+
+    def test_bounded_user_cache(self):
+        """Test that the user cache evicts the least recently used entries."""
+        users = BoundedUserCache(max_size=1)
+        users.load(["export1@example.com", "export1@example.com"])
+        self.assertEqual(users.get("export1@example.com")['name'], "Export One")
+        users.load(["missing@example.com"])
+        self.assertEqual(len(users), 1)
+        self.assertIsNone(users.get("export1@example.com"))
+
+
+    def test_user_cache_smaller_than_a_batch(self):
+        """Test that a batch keeps the users it loaded when it has more of them than the cache holds."""
+        User.objects.create(username="export2", name="Export Two", email="export2@example.com")
+        [rows] = list(iter_activity_batches({}, batch_size=3, user_cache_size=1))
+        self.assertEqual([row['user'] for row in rows], ["Export One", "Export Two", "Export One"])
+        users = BoundedUserCache(max_size=1)
+        users.load(["export1@example.com", "export2@example.com"])
+        self.assertEqual(len(users), 2)
+        users.load(["export2@example.com"])
+        self.assertEqual(len(users), 1)
+
+class FastListSerializationTest(TestCase):
+    """Tests that the document fast path renders lists exactly like the serializers."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        User.objects.filter(email__startswith='fast').delete()
+        User.objects.create(username="fast1", name="Fast One", email="fast1@example.com", team="Team Fast")
+        User.objects.create(username="fast2", name="Fast Two", email="fast2@example.com")
+        reset_rank_index()
+        day = timezone.now()
+        for offset, email in enumerate(["fast1@example.com", "fast2@example.com", "ghost@example.com"] * 2):
+            self.client.post('/api/activities/', {
+                'user_email': email, 'activity_type': 'swimming', 'duration': 20 + offset,
+                'distance': 0.5 * offset, 'calories_burned': 90 + offset,
+                'date': (day - timedelta(hours=offset)).isoformat(),
+            }, format='json')
+
+    def pages(self, url):
+        """Follow a list through every cursor page and return the page bodies."""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json())
+            url = pages[-1]['next']
+        return pages
+
+    def test_lists_match_serializers(self):
+        """Test that every fast list page, including cursors, matches the serializer output."""
+        for url in ['/api/activities/?page_size=4', '/api/activities/?team=Team%20Fast',
+                    '/api/leaderboard/?page_size=2', '/api/users/?page_size=1']:
+            with self.settings(API_FAST_LIST_SERIALIZATION=True):
+                fast = self.pages(url)
+            with self.settings(API_FAST_LIST_SERIALIZATION=False):
+                slow = self.pages(url)
+            self.assertEqual([page['results'] for page in fast], [page['results'] for page in slow], url)
+            self.assertEqual(json.dumps(fast[0]['results']), json.dumps(slow[0]['results']), url)
+
+
+class RenderingAndCompressionTest(TestCase):
+    """Tests for the orjson renderer and the compression middleware."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        for index in range(40):
+            Activity.objects.create(
+                user_email=f"render{index}@example.com", activity_type="rowing", duration=40,
+                calories_burned=250, date=timezone.now() - timedelta(minutes=index),
+            )
+
+    def test_orjson_handles_mongo_types(self):
+        """Test that ObjectIds and naive UTC datetimes are encoded natively."""
+        object_id = ObjectId()
+        rendered = ORJSONRenderer().render({'id': object_id, 'at': datetime(2024, 1, 2, 3, 4, 5)})
+        self.assertEqual(json.loads(rendered), {'id': str(object_id), 'at': '2024-01-02T03:04:05Z'})
+
+    def test_renderers_agree(self):
+        """Test that the orjson and DRF renderers produce the same document."""
+        data = self.client.get('/api/activities/', format='json').data
+        self.assertEqual(json.loads(ORJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+    def test_renderers_agree_on_errors(self):
+        """Test that validation errors, lazy translations and decimals render as with DRF's renderer."""
+        response = self.client.post('/api/activities/', {'duration': 'long'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        data = {**response.data, 'message': gettext_lazy('This field is required.'), 'distance': Decimal('1.5')}
+        rendered = json.loads(ORJSONRenderer().render(data))
+        self.assertEqual(rendered, json.loads(JSONRenderer().render(data)))
+        self.assertEqual(rendered['message'], 'This field is required.')
+        self.assertEqual(rendered['duration'], ['A valid integer is required.'])
+
+    def test_negotiated_compression(self):
+        """Test gzip/brotli negotiation and the size threshold."""
+        plain = self.client.get('/api/activities/', format='json')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+
+        zipped = self.client.get('/api/activities/', format='json', HTTP_ACCEPT_ENCODING='gzip;q=1, br;q=0')
+        self.assertEqual(zipped['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', zipped['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(zipped.content)), plain.json())
+
+        with self.settings(API_COMPRESSION_MIN_SIZE=10 ** 9):
+            small = self.client.get('/api/activities/', format='json', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+    def test_async_compression(self):
+        """Test that async views and async streams are compressed as well."""
+        async def get():
+            return await self.async_client.get('/api/async/activities/', ACCEPT_ENCODING='gzip')
+        response = async_to_sync(get)()
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['results']), 40)
+
+        async def chunks():
+            yield b'{"a": 1}\n'
+            yield b'{"b": 2}\n'
+
+        async def compress_stream():
+            stream = CompressionMiddleware.compress_async_stream(chunks(), *gzip_compressor())
+            return b''.join([chunk async for chunk in stream])
+        self.assertEqual(gzip.decompress(async_to_sync(compress_stream)()), b'{"a": 1}\n{"b": 2}\n')
+
+    def test_streaming_compression(self):
+        """Test that streamed exports are compressed chunk by chunk."""
+        response = self.client.get('/api/activities/export/', {'format': 'ndjson'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 40)
+
+
+class RequestMetricsTest(TestCase):
+    """Tests for the Server-Timing header and the /metrics endpoint."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        REGISTRY.reset()
+
+    def test_server_timing_header(self):
+        """Test that responses report DB, serializer and render timings."""
+        response = self.client.get('/api/users/', format='json')
+        names = [part.split(';')[0].strip() for part in response['Server-Timing'].split(',')]
+        self.assertEqual(names, ['db', 'serialize', 'render', 'total'])
+
+    def test_middleware_runs_async_under_asgi(self):
+        """Test that the ASGI handler does not move the project middleware onto a thread."""
+        with self.settings(DEBUG=True), self.assertLogs('django.request', 'DEBUG') as logs:
+            logging.getLogger('django.request').debug('Loading the middleware')
+            ASGIHandler()
+        self.assertEqual([line for line in logs.output if 'octofit_tracker.middleware' in line], [])
+
+    def test_server_timing_on_async_views(self):
+        """Test that async views get the Server-Timing header too."""
+        async def get():
+            return await self.async_client.get('/api/async/leaderboard/')
+        response = async_to_sync(get)()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    def test_command_listener_counts_against_current_request(self):
+        """Test that MongoDB command events are attributed to the open request."""
+        CommandMetricsListener.record(SimpleNamespace(duration_micros=500))
+        metrics, token = start_request()
+        try:
+            CommandMetricsListener.record(SimpleNamespace(duration_micros=1500))
+            CommandMetricsListener.record(SimpleNamespace(duration_micros=500))
+        finally:
+            finish_request(token)
+        self.assertEqual((metrics.db_commands, metrics.db_seconds), (2, 0.002))
+
+    def test_prometheus_endpoint(self):
+        """Test that /metrics exposes per-view request counters and histograms."""
+        self.client.get('/api/users/', format='json')
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('octofit_http_requests_total{view="user-list",method="GET",status="200"} 1', body)
+        self.assertIn('octofit_db_commands_per_request_count{view="user-list",method="GET"} 1', body)
+        self.assertIn('# TYPE octofit_serializer_seconds_total counter', body)
+
+
+class MongoPoolHealthTest(TestCase):
+    """Tests for connection pool metrics and the /health endpoint."""
+
+    ADDRESS = ('db.test', 27017)
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        self.listener = PoolMetricsListener()
+        self.event = SimpleNamespace(address=self.ADDRESS, options={'maxPoolSize': 4})
+
+    def test_pool_listener_tracks_checkouts(self):
+        """Test that checkouts, waiters and failures are tracked per pool."""
+        self.listener.pool_created(self.event)
+        for _ in range(3):
+            self.listener.connection_created(self.event)
+            self.listener.connection_check_out_started(self.event)
+            self.listener.connection_checked_out(self.event)
+        self.listener.connection_check_out_started(self.event)
+        self.listener.connection_check_out_started(self.event)
+        self.listener.connection_check_out_failed(self.event)
+        self.listener.connection_checked_in(self.event)
+        pool = self.listener.snapshot()['db.test:27017']
+        self.assertEqual((pool.connections, pool.in_use, pool.waiting, pool.checkout_failures), (3, 2, 1, 1))
+        self.assertEqual(pool.saturation, 0.5)
+
+    def test_pool_report_flags_saturation(self):
+        """Test that pools at the warning threshold or with waiters are saturated."""
+        self.listener.pool_created(self.event)
+        for _ in range(3):
+            self.listener.connection_check_out_started(self.event)
+            self.listener.connection_checked_out(self.event)
+        saturated, rows = pool_report(self.listener.snapshot(), 0.8)
+        self.assertFalse(saturated)
+        self.assertEqual(rows['db.test:27017']['saturation'], 0.75)
+        self.listener.connection_check_out_started(self.event)
+        self.assertTrue(pool_report(self.listener.snapshot(), 0.8)[0])
+
+    def test_pool_report_counts_reopened_pools(self):
+        """Test that a pool closed and opened again is reported as opened twice."""
+        self.listener.pool_created(self.event)
+        self.listener.pool_closed(self.event)
+        self.listener.pool_created(self.event)
+        rows = pool_report(self.listener.snapshot(), 0.8)[1]
+        self.assertEqual(rows['db.test:27017']['opened'], 2)
+        self.assertGreaterEqual(rows['db.test:27017']['age_seconds'], 0)
+
+    def test_connection_outlives_requests(self):
+        """Test that the MongoClient and its pool are kept, not closed, when a request finishes."""
+        self.client.get('/health')
+        database = connection.connection
+        with patch.object(database.client, 'close') as close:
+            # Run by request_finished, which the test client skips
+            close_old_connections()
+            self.client.get('/health')
+        close.assert_not_called()
+        self.assertIs(connection.connection, database)
+
+    def test_health_endpoint(self):
+        """Test that /health pings the database and lists pool state."""
+        response = self.client.get('/health')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(response.json()['status'], ('ok', 'degraded'))
+        self.assertIn('pools', response.json())
+
+    def test_health_endpoint_reports_database_errors(self):
+        """Test that a failed ping returns 503."""
+        with patch('octofit_tracker.health.get_database', side_effect=ServerSelectionTimeoutError('down')):
+            response = self.client.get('/health')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'error')
+
+    def test_pool_gauges_in_prometheus_output(self):
+        """Test that /metrics exposes the pool gauges."""
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('# TYPE octofit_mongo_pool_in_use gauge', body)
+
+
+class LiveLeaderboardStreamTest(TestCase):
+    """Tests for the server-sent leaderboard change stream."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        reset_rank_index()
+        Leaderboard.objects.create(user_email="live1@example.com", total_points=500, total_calories=400,
+                                   total_activities=2, rank=1)
+
+    def post_activity(self, email, calories):
+        response = self.client.post('/api/activities/', {
+            'user_email': email,
+            'activity_type': 'running',
+            'duration': 30,
+            'calories_burned': calories,
+            'date': timezone.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_activity_write_publishes_changed_rows(self):
+        """Test that subscribers get only the changed row and the rank shift it caused, under its stored seq."""
+        get_events_collection().drop()
+        feed = ChangeFeed()
+        relay = EventRelay(feed)
+        relay.poll()
+
+        async def receive():
+            subscription, backlog = feed.subscribe()
+            try:
+                await sync_to_async(self.post_activity)("live2@example.com", 590)
+                self.assertEqual(await sync_to_async(relay.poll)(), 1)
+                return backlog, await asyncio.wait_for(subscription.get(), 5)
+            finally:
+                subscription.close()
+
+        backlog, (event_id, data) = async_to_sync(receive)()
+        self.assertEqual(backlog, [])
+        self.assertEqual(event_id, get_events_collection().find_one({'seq': {'$exists': True}})['seq'])
+        [change] = json.loads(data)
+        self.assertEqual(change['row']['user_email'], "live2@example.com")
+        self.assertEqual((change['row']['total_points'], change['row']['rank']), (600, 1))
+        self.assertEqual(change['shift'], {'from_points': 0, 'to_points': 600, 'by': 1})
+        get_events_collection().drop()
+
+    def test_queued_writes_reach_subscribers_through_the_relay(self):
+        """Test that leaderboard changes applied by a job worker are relayed to another process's feed."""
+        get_events_collection().drop()
+        feed = ChangeFeed()
+        relay = EventRelay(feed)
+        self.assertEqual(relay.poll(), 0)
+        with override_settings(ACTIVITY_POSTPROCESSING='queue'):
+            self.post_activity("live3@example.com", 590)
+        call_command('run_workers', burst=True, stdout=io.StringIO())
+
+        async def receive():
+            subscription, _ = feed.subscribe()
+            try:
+                self.assertEqual(await sync_to_async(relay.poll)(), 1)
+                return await asyncio.wait_for(subscription.get(), 5)
+            finally:
+                subscription.close()
+
+        _, data = async_to_sync(receive)()
+        [change] = json.loads(data)
+        self.assertEqual((change['row']['user_email'], change['row']['rank']), ("live3@example.com", 1))
+        get_events_collection().drop()
+
+    def test_relay_waits_for_earlier_events(self):
+        """Test that an event stored ahead of an earlier sequence number is held until that one arrives."""
+        get_events_collection().drop()
+        relay = EventRelay(ChangeFeed(), gap_seconds=60)
+        relay.poll()
+        get_events_collection().insert_one({'seq': 2, 'changes': ['b'], 'created_at': timezone.now()})
+        self.assertEqual(relay.poll(), 0)
+        get_events_collection().insert_one({'seq': 1, 'changes': ['a'], 'created_at': timezone.now()})
+        self.assertEqual(relay.poll(), 2)
+        self.assertEqual(relay.last_seq, 2)
+        get_events_collection().drop()
+
+    def test_stream_path_under_wsgi(self):
+        """Test that the stream path answers 501 at once when served by WSGI instead of the ASGI stream app."""
+        response = self.client.get(STREAM_PATH)
+        self.assertEqual(response.status_code, 501)
+        self.assertIn('ASGI', response.json()['detail'])
+
+    def test_relay_resets_subscribers_after_a_skipped_event(self):
+        """Test that subscribers are told to re-fetch when the relay gives up waiting for an event."""
+        get_events_collection().drop()
+        feed = ChangeFeed()
+        relay = EventRelay(feed, gap_seconds=0)
+        relay.poll()
+        get_events_collection().insert_one({'seq': 2, 'changes': ['b'], 'created_at': timezone.now()})
+
+        async def receive():
+            subscription, _ = feed.subscribe()
+            try:
+                await sync_to_async(relay.poll)()
+                return [await asyncio.wait_for(subscription.get(), 5) for _ in range(2)]
+            finally:
+                subscription.close()
+
+        self.assertEqual(async_to_sync(receive)(), [RESET, (2, '["b"]')])
+        get_events_collection().drop()
+
+    def test_reconnect_replays_missed_events(self):
+        """Test that Last-Event-ID replays the history, defers to the store, or skips events already sent."""
+        feed = ChangeFeed(history_size=2)
+        for seq, data in ((1, 'a'), (2, 'b'), (3, 'c')):
+            feed.publish(seq, [data])
+
+        async def subscribe(last_event_id):
+            subscription, backlog = feed.subscribe(last_event_id)
+            subscription.close()
+            return backlog, subscription.missing
+
+        backlog, missing = async_to_sync(subscribe)(1)
+        self.assertEqual(([data for _, data in backlog], missing), (['["b"]', '["c"]'], None))
+        self.assertEqual(async_to_sync(subscribe)(0), (None, (0, 3)))
+        self.assertEqual(async_to_sync(subscribe)(5), ([], None))
+
+        async def ahead():
+            # The client already has event 5 from another process
+            subscription, _ = feed.subscribe(5)
+            try:
+                feed.publish(4, ['d'])
+                feed.publish(6, ['f'])
+                return await asyncio.wait_for(subscription.get(), 5)
+            finally:
+                subscription.close()
+
+        self.assertEqual(async_to_sync(ahead)(), (6, '["f"]'))
+
+    def test_missed_events_are_read_from_the_store(self):
+        """Test that events older than the history are read back by seq, or reset when some are gone."""
+        get_events_collection().drop()
+        get_events_collection().insert_many([
+            {'seq': seq, 'changes': [str(seq)], 'created_at': timezone.now()} for seq in (1, 2, 3)
+        ])
+        self.assertEqual(stored_events(1, 3), [(2, '["2"]'), (3, '["3"]')])
+        get_events_collection().delete_one({'seq': 2})
+        self.assertEqual(stored_events(1, 3), [RESET])
+        get_events_collection().drop()
+
+    def run_stream(self, headers=(), publish=None):
+        """Open the ASGI stream on a fresh feed; returns its start, first body, published event and subscribers."""
+        async def stream():
+            communicator = ApplicationCommunicator(with_leaderboard_stream(None), {
+                'type': 'http', 'method': 'GET', 'path': STREAM_PATH, 'headers': list(headers),
+            })
+            await communicator.send_input({'type': 'http.request', 'body': b''})
+            start = await communicator.receive_output(5)
+            greeting = await communicator.receive_output(5)
+            event = None
+            if publish is not None:
+                while not live.FEED.has_subscribers:
+                    await asyncio.sleep(0.01)
+                publish(live.FEED)
+                event = await communicator.receive_output(5)
+            await communicator.send_input({'type': 'http.disconnect'})
+            await communicator.wait(5)
+            return start, greeting, event, live.FEED.has_subscribers
+
+        with patch.object(live, 'FEED', ChangeFeed()), patch.object(live, '_relay', None):
+            return async_to_sync(stream)()
+
+    def test_asgi_stream(self):
+        """Test that the ASGI app streams events under their seq until the client disconnects."""
+        get_events_collection().drop()
+        start, greeting, event, subscribed = self.run_stream(
+            publish=lambda feed: feed.publish(7, [{'row': {'rank': 1}, 'shift': None}]),
+        )
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertTrue(greeting['body'].startswith(b'retry: '))
+        self.assertEqual(event['body'], b'id: 7\nevent: leaderboard\ndata: [{"row":{"rank":1},"shift":null}]\n\n')
+        self.assertFalse(subscribed)
+
+    def test_asgi_stream_resumes_from_last_event_id(self):
+        """Test that a client reconnecting to a process that never served it resumes from the stored seq."""
+        get_events_collection().drop()
+        get_events_collection().insert_many([
+            {'seq': seq, 'changes': [str(seq)], 'created_at': timezone.now()} for seq in (1, 2, 3)
+        ])
+        get_events_collection().insert_one({'_id': 'counter', 'value': 3})
+        _, greeting, _, _ = self.run_stream(headers=[(b'last-event-id', b'1')])
+        self.assertTrue(greeting['body'].endswith(
+            b'id: 2\nevent: leaderboard\ndata: ["2"]\n\nid: 3\nevent: leaderboard\ndata: ["3"]\n\n'
+        ))
+        get_events_collection().drop()
+
+
+class JobQueueTest(TestCase):
+    """Tests for the background job queue and queued activity post-processing."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        get_collection(Job).delete_many({})
+        reset_rank_index()
+        self.calls = []
+
+    def tearDown(self):
+        jobs.HANDLERS.pop('test_job', None)
+
+    def register(self, failures=0):
+        @jobs.handler('test_job')
+        def run(payload, done, mark):
+            self.calls.append((payload, done))
+            mark('first')
+            if len(self.calls) <= failures:
+                raise RuntimeError('boom')
+
+    def test_enqueue_is_idempotent(self):
+        """Test that a key can only be queued once."""
+        self.assertEqual(jobs.enqueue('test_job', {'n': 1}, key='k'), ('k', True))
+        self.assertEqual(jobs.enqueue('test_job', {'n': 2}, key='k'), ('k', False))
+        self.assertEqual(get_collection(Job).count_documents({'key': 'k'}), 1)
+
+    @override_settings(JOB_RETRY_BACKOFF_SECONDS=0)
+    def test_failed_job_is_retried_skipping_completed_steps(self):
+        """Test that a retry sees the steps the failed attempt completed."""
+        self.register(failures=1)
+        jobs.enqueue('test_job', {'n': 1}, key='retry')
+        with self.assertLogs('octofit_tracker.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_job(jobs.claim('test')), 'pending')
+        self.assertEqual(jobs.run_job(jobs.claim('test')), 'done')
+        self.assertEqual([done for _, done in self.calls], [frozenset(), frozenset({'first'})])
+        job = get_collection(Job).find_one({'key': 'retry'})
+        self.assertEqual((job['status'], job['attempts']), ('done', 2))
+
+    @override_settings(JOB_RETRY_BACKOFF_SECONDS=0, JOB_MAX_ATTEMPTS=2)
+    def test_job_fails_after_max_attempts(self):
+        """Test that a job that keeps failing ends up failed with its error."""
+        self.register(failures=5)
+        jobs.enqueue('test_job', {}, key='doomed')
+        with self.assertLogs('octofit_tracker.jobs', 'ERROR'):
+            statuses = [jobs.run_job(jobs.claim('test')) for _ in range(2)]
+        self.assertEqual(statuses, ['pending', 'failed'])
+        self.assertIsNone(jobs.claim('test'))
+        self.assertIn('boom', get_collection(Job).find_one({'key': 'doomed'})['last_error'])
+
+    def test_queued_activity_postprocessing(self):
+        """Test that queued activity writes update the leaderboard once the workers run."""
+        with override_settings(ACTIVITY_POSTPROCESSING='queue'):
+            response = self.client.post('/api/activities/', {
+                'user_email': 'queued@example.com',
+                'activity_type': 'running',
+                'duration': 30,
+                'calories_burned': 90,
+                'date': timezone.now().isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Leaderboard.objects.count(), 0)
+        self.assertEqual(jobs.queue_stats()['pending'], 1)
+        self.assertIn('octofit_jobs{status="pending"} 1', self.client.get('/metrics').content.decode())
+
+        call_command('run_workers', threads=2, burst=True, stdout=io.StringIO())
+        entry = get_collection(Leaderboard).find_one({'user_email': 'queued@example.com'})
+        self.assertEqual((entry['total_points'], entry['rank']), (100, 1))
+        job = get_collection(Job).find_one({'key': f"activity:{response.json()['id']}:created"})
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(set(job['steps_done']), {f'{step}:queued@example.com' for step in
+                                                  ('leaderboard', 'team_leaderboard', 'rollups', 'recommendations')})
+
+    @override_settings(JOB_RETRY_BACKOFF_SECONDS=0)
+    def test_retried_activity_change_skips_users_already_applied(self):
+        """Test that a change failing part-way through its users does not count the others twice on retry."""
+        activity = {'duration': 30, 'distance': 0.0, 'calories_burned': 90, 'date': timezone.now(), 'team': ''}
+        jobs.enqueue('activity_change', {'removed': [], 'added': [
+            {**activity, 'user_email': 'first@example.com'}, {**activity, 'user_email': 'second@example.com'},
+        ]}, key='partial')
+        apply_delta = leaderboard.apply_delta
+
+        def fail_second(user_email, *delta):
+            if user_email == 'second@example.com':
+                raise RuntimeError('connection lost')
+            return apply_delta(user_email, *delta)
+
+        with patch.object(leaderboard, 'apply_delta', fail_second), self.assertLogs('octofit_tracker.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_job(jobs.claim('test')), 'pending')
+        self.assertEqual(jobs.run_job(jobs.claim('test')), 'done')
+        points = {entry.user_email: entry.total_points for entry in Leaderboard.objects.all()}
+        self.assertEqual(points, {'first@example.com': 100, 'second@example.com': 100})
+
+
+class WorkoutRecommendationTest(TestCase):
+    """Tests for /api/workouts/recommended/ and its precomputed profiles."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        Workout.objects.all().delete()
+        get_collection(WorkoutProfile).delete_many({})
+        reset_rank_index()
+        reset_catalog()
+        self.easy = Workout.objects.create(name="Easy Walk", description="d", difficulty="beginner",
+                                           duration=20, calories_estimate=100)
+        self.hard = Workout.objects.create(name="Hard Run", description="d", difficulty="advanced",
+                                           duration=60, calories_estimate=900)
+
+    def post_activity(self, email, duration, calories):
+        response = self.client.post('/api/activities/', {
+            'user_email': email,
+            'activity_type': 'running',
+            'duration': duration,
+            'calories_burned': calories,
+            'date': timezone.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def recommended(self, email, **params):
+        response = self.client.get('/api/workouts/recommended/', {'email': email, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.json()['results']]
+
+    def test_newcomers_get_beginner_workouts(self):
+        """Test that users without activities are pointed at light workouts."""
+        self.assertEqual(self.recommended('new@example.com'), ["Easy Walk", "Hard Run"])
+
+    def test_activity_writes_update_profile_incrementally(self):
+        """Test that activity writes update the stored totals and top workouts."""
+        for _ in range(3):
+            self.post_activity('athlete@example.com', 60, 850)
+        profile = get_collection(WorkoutProfile).find_one({'user_email': 'athlete@example.com'})
+        self.assertEqual((profile['activities'], profile['total_duration'], profile['total_calories']),
+                         (3, 180, 2550))
+        self.assertEqual(profile['recommendations'][0]['workout_id'], str(self.hard._id))
+        self.assertEqual(self.recommended('athlete@example.com', limit=1), ["Hard Run"])
+
+    def test_catalog_change_rescores_on_read(self):
+        """Test that profiles scored against an older catalog are rescored when read."""
+        self.post_activity('athlete@example.com', 60, 850)
+        response = self.client.post('/api/workouts/', {
+            'name': "Tempo Run", 'description': 'd', 'difficulty': 'advanced', 'duration': 66, 'calories_estimate': 1000,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.recommended('athlete@example.com')[0], "Tempo Run")
+
+    def test_rebuild_matches_incremental_profiles(self):
+        """Test that the batch rebuild reproduces the incrementally maintained profiles."""
+        self.post_activity('a@example.com', 30, 150)
+        self.post_activity('b@example.com', 60, 850)
+        incremental = {
+            profile['user_email']: profile['recommendations']
+            for profile in get_collection(WorkoutProfile).find({})
+        }
+        call_command('rebuild_recommendations', batch_size=1, stdout=io.StringIO())
+        rebuilt = {profile['user_email']: profile['recommendations'] for profile in get_collection(WorkoutProfile).find({})}
+        self.assertEqual(rebuilt, incremental)
+
+    def test_email_is_required(self):
+        """Test that the email parameter is required."""
+        self.assertEqual(self.client.get('/api/workouts/recommended/').status_code, 400)
+
+
+class SearchTest(TestCase):
+    """Tests for /api/search/ and the in-process search index."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        User.objects.filter(email__endswith='@search.test').delete()
+        Team.objects.all().delete()
+        Workout.objects.all().delete()
+        reset_search_index()
+        User.objects.create(username="speedy", name="Barry Allen", email="barry@search.test", team="Team Flash")
+        Team.objects.create(name="Speedsters", description="Fast runners")
+        Workout.objects.create(name="Speed Force Cardio", description="Lightning-fast cardio routine",
+                               difficulty="intermediate", duration=30, calories_estimate=700)
+        Workout.objects.create(name="Core Crusher", description="Abdominal strength", difficulty="beginner",
+                               duration=20, calories_estimate=250)
+
+    def search(self, query, **params):
+        response = self.client.get('/api/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(row['type'], row['title']) for row in response.json()['results']]
+
+    def test_prefix_matches_across_types(self):
+        """Test that a prefix matches users, teams and workouts."""
+        self.assertEqual(
+            sorted(self.search('spee')),
+            [('team', "Speedsters"), ('user', "Barry Allen"), ('workout', "Speed Force Cardio")],
+        )
+
+    def test_every_word_must_match(self):
+        """Test that multi-word queries narrow the results."""
+        self.assertEqual(self.search('spee card'), [('workout', "Speed Force Cardio")])
+        self.assertEqual(self.search('core cardio'), [])
+
+    def test_type_filter_and_validation(self):
+        """Test the type filter and that unknown types are rejected."""
+        self.assertEqual(self.search('spee', type='team'), [('team', "Speedsters")])
+        self.assertEqual(self.client.get('/api/search/', {'q': 'x', 'type': 'activity'}).status_code, 400)
+
+    def test_writes_update_loaded_index(self):
+        """Test that viewset writes are reflected without rebuilding the index."""
+        self.assertEqual(self.search('zumba'), [])
+        response = self.client.post('/api/workouts/', {
+            'name': "Zumba Party", 'description': 'Dance', 'difficulty': 'beginner', 'duration': 45,
+            'calories_estimate': 400,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.search('zum'), [('workout', "Zumba Party")])
+        self.client.delete(f"/api/workouts/{response.json()['id']}/")
+        self.assertEqual(self.search('zum'), [])
+
+    def test_whole_words_and_names_rank_first(self):
+        """Test that whole-word title matches outrank description and prefix matches."""
+        Workout.objects.create(name="Morning Stretch", description="Gentle core warm-up", difficulty="beginner",
+                               duration=10, calories_estimate=50)
+        reset_search_index()
+        self.assertEqual(self.search('core'), [('workout', "Core Crusher"), ('workout', "Morning Stretch")])
+
+    def test_index_removes_unused_tokens(self):
+        """Test that removing an entry drops tokens no other entry uses."""
+        index = SearchIndex()
+        index.add('team', {'_id': 1, 'name': "Unique Name"})
+        index.add('team', {'_id': 2, 'name': "Other Name"})
+        index.remove('team', 1)
+        self.assertEqual(index.search('uni'), [])
+        self.assertEqual([row['id'] for row in index.search('name')], ['2'])
+
+    def test_built_index_matches_incremental_one(self):
+        """Test that building an index in one pass gives the same tokens and results as adding entries."""
+        documents = [('team', {'_id': 1, 'name': "Zeta Name"}), ('workout', {'_id': 2, 'name': "Alpha Zeta"})]
+        built, incremental = SearchIndex.build(documents), SearchIndex()
+        for kind, document in documents:
+            incremental.add(kind, document)
+        self.assertEqual(built._tokens, incremental._tokens)
+        self.assertEqual(built.search('ze'), incremental.search('ze'))
+        built.remove('team', 1)
+        self.assertEqual(built._tokens, ['alpha', 'zeta'])
+
+
+class BenchmarkApiTest(TestCase):
+    """Tests for the benchmark_api management command."""
+
+    def setUp(self):
+        """Set up test data."""
+        Workout.objects.all().delete()
+        Workout.objects.create(name="Bench", description="d", difficulty="Beginner", duration=10, calories_estimate=50)
+
+    def test_covers_every_router_endpoint(self):
+        """Test that list, detail and create cases are generated for the registered viewsets."""
+        labels = {label for label, _, _, _ in endpoint_cases({'email': 'a@example.com', 'team': 'Team A'})}
+        self.assertTrue({'workout-list', 'workout-detail', 'workout-create', 'activity-create',
+                         'leaderboard-top', 'stats-timeline'} <= labels)
+        self.assertNotIn('activity-export', labels)
+
+    def test_reports_and_saves_results(self):
+        """Test a short run against existing data and its baseline comparison."""
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            call_command('benchmark_api', skip_seed=True, requests=3, concurrency=2, endpoint=['workout-list'],
+                         save_baseline=path, stdout=out)
+            self.assertIn('workout-list', out.getvalue())
+            call_command('benchmark_api', skip_seed=True, requests=3, concurrency=2, endpoint=['workout-list'],
+                         baseline=path, tolerance=100, stdout=out)
+        self.assertIn('No regressions', out.getvalue())
+
+
+    def test_refuses_to_seed_over_existing_data(self):
+        """Test that seeding, which wipes the database, needs --reset when there is data."""
+        with self.assertRaisesMessage(CommandError, '--reset'):
+            call_command('benchmark_api', requests=1, concurrency=1, endpoint=['workout-list'], stdout=io.StringIO())
+        self.assertEqual(get_collection(Workout).count_documents({"name": "Bench"}), 1)
+
+class ResponseCacheTest(TestCase):
+    """Tests for cached /api/teams/ responses."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.client = APIClient()
+        Team.objects.all().delete()
+        invalidate_responses('team')
+        Team.objects.create(name="Team Cache", description="Cached")
+
+    def test_etag_revalidation_returns_304(self):
+        """Test that a matching If-None-Match gets a 304."""
+        response = self.client.get('/api/teams/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        response = self.client.get('/api/teams/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_invalidates_cached_list(self):
+        """Test that a write through the viewset is visible on the next read."""
+        first = self.client.get('/api/teams/')
+        self.assertEqual(len(first.json()['results']), 1)
+        response = self.client.post('/api/teams/', {'name': "Team Fresh", 'description': "New"}, format='json')
+        self.assertEqual(response.status_code, 201)
+        second = self.client.get('/api/teams/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual({team['name'] for team in second.json()['results']}, {"Team Cache", "Team Fresh"})
+
+
+class AsyncReadPathTest(TestCase):
+    """Tests that the async read path returns the same JSON as the DRF endpoints."""
+
+    def setUp(self):
+        """Set up test data."""
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        User.objects.filter(email__startswith='async').delete()
+        User.objects.create(username="async1", name="Async One", email="async1@example.com", team="Team Async")
+        for index in range(3):
+            Activity.objects.create(
+                user_email="async1@example.com" if index else "async2@example.com",
+                activity_type="Running",
+                duration=30,
+                distance=1.5,
+                calories_burned=100 + index,
+                date=timezone.now() - timedelta(hours=index)
+            )
+        Leaderboard.objects.create(user_email="async1@example.com", total_points=300, total_calories=250, total_activities=2, rank=1)
+        Leaderboard.objects.create(user_email="async2@example.com", total_points=200, total_calories=100, total_activities=1, rank=2)
+
+    def async_get(self, url):
+        async def get():
+            return await self.async_client.get(url)
+        return async_to_sync(get)()
+
+    def assert_parity(self, sync_url, async_url):
+        expected = self.client.get(sync_url)
+        actual = self.async_get(async_url)
+        self.assertEqual(actual.status_code, 200)
+        self.assertEqual(actual.json(), expected.json())
+
+    def test_leaderboard_parity(self):
+        """Test /api/async/leaderboard/ against /api/leaderboard/."""
+        self.assert_parity('/api/leaderboard/', '/api/async/leaderboard/')
+        self.assert_parity('/api/leaderboard/?team=Team%20Async', '/api/async/leaderboard/?team=Team%20Async')
+
+    def test_activities_parity_and_cursor(self):
+        """Test /api/async/activities/ against /api/activities/, including its next cursor."""
+        self.assert_parity('/api/activities/', '/api/async/activities/')
+        first = self.async_get('/api/async/activities/?page_size=2').json()
+        second = self.async_get(first['next']).json()
+        self.assertEqual(len(first['results']) + len(second['results']), 3)
+        self.assertIsNone(second['next'])
+
+    def test_calls_run_beyond_the_default_executor(self):
+        """Test that database calls get a thread per pooled connection, not the loop's small default pool."""
+        calls = async_views.THREADS
+        self.assertGreater(calls, min(32, (os.cpu_count() or 1) + 4))
+        barrier = threading.Barrier(calls, timeout=10)
+
+        async def call_all():
+            # Each call blocks until all of them are running at once
+            return await asyncio.gather(*(async_views.run(barrier.wait) for _ in range(calls)))
+        self.assertEqual(sorted(async_to_sync(call_all)()), list(range(calls)))
+
+    def test_stats_parity(self):
+        """Test /api/async/stats/teams/ against /api/stats/teams/."""
+        self.assert_parity('/api/stats/teams/', '/api/async/stats/teams/')
+
+
+class StartupProfileTest(TestCase):
+    def test_import_times_by_package(self):
+        """Test that -X importtime self times are summed by top-level package."""
+        stderr = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       500 |        500 |   django.utils\n'
+            'import time:      1500 |       2000 | django\n'
+            'import time:       250 |        250 | yaml\n'
+        )
+        totals = import_times(stderr)
+        self.assertAlmostEqual(totals['django'], 0.002)
+        self.assertAlmostEqual(totals['yaml'], 0.00025)
+
+    def test_router_endpoints_under_api_settings(self):
+        """Test that the router endpoints serve reads without server errors under the API-only profile."""
+        client = APIClient()
+        Team.objects.create(name="Team Profile", description="Profile team")
+        User.objects.create(username="profile", name="Profile", email="profile@example.com", team="Team Profile")
+        client.post('/api/activities/', {
+            'user_email': 'profile@example.com', 'activity_type': 'Running', 'duration': 30, 'distance': 2.0,
+            'calories_burned': 200, 'date': timezone.now().isoformat(),
+        }, format='json')
+        sample = {'email': 'profile@example.com', 'team': 'Team Profile'}
+        with override_settings(MIDDLEWARE=settings_api.MIDDLEWARE, REST_FRAMEWORK=settings_api.REST_FRAMEWORK):
+            for label, method, url, _ in endpoint_cases(sample):
+                if method == 'GET':
+                    with self.subTest(label):
+                        self.assertLess(client.get(url).status_code, 500)
+            response = client.get('/api/leaderboard/me/?email=profile@example.com')
+        self.assertEqual(response.status_code, 200)
+
+    def test_profiles_api_settings(self):
+        """Test that the API-only profile boots without the admin and serves the first request."""
+        out = io.StringIO()
+        call_command('profile_startup', modules=['octofit_tracker.settings_api'], runs=1, url='/api/', stdout=out)
+        report = out.getvalue()
+        self.assertIn('HTTP 200', report)
+        self.assertIn('octofit_tracker', report)
+        self.assertNotIn('django.contrib.admin', report)
@@ -13,7 +13,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework.decorators import api_view
@@ -24,8 +24,14 @@ from .views import (
     TeamViewSet,
     ActivityViewSet,
     LeaderboardViewSet,
-    WorkoutViewSet
+    WorkoutViewSet,
+    StatsViewSet,
+    SearchViewSet
 )
+from . import async_views
+from .health import health_view
+from .live import STREAM_PATH, stream_unavailable
+from .metrics import metrics_view
 import os
 
 # Get codespace URL or default to localhost
@@ -42,6 +48,8 @@ router.register(r'teams', TeamViewSet, basename='team')
 router.register(r'activities', ActivityViewSet, basename='activity')
 router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 router.register(r'workouts', WorkoutViewSet, basename='workout')
+router.register(r'stats', StatsViewSet, basename='stats')
+router.register(r'search', SearchViewSet, basename='search')
 
 
 @api_view(['GET'])
@@ -55,12 +63,26 @@ def api_root(request, format=None):
         'activities': f"{base_url}/api/activities/",
         'leaderboard': f"{base_url}/api/leaderboard/",
         'workouts': f"{base_url}/api/workouts/",
+        'stats': f"{base_url}/api/stats/",
+        'search': f"{base_url}/api/search/",
     })
 
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/', api_root, name='api-root'),
+    path('api/async/leaderboard/', async_views.leaderboard, name='async-leaderboard'),
+    path('api/async/activities/', async_views.activities, name='async-activities'),
+    path('api/async/stats/<str:report>/', async_views.stats_report, name='async-stats'),
+    # Served by live.leaderboard_stream under ASGI; this only answers over WSGI
+    path(STREAM_PATH.lstrip('/'), stream_unavailable, name='leaderboard-stream'),
     path('api/', include(router.urls)),
+    path('metrics', metrics_view, name='metrics'),
+    path('health', health_view, name='health'),
     path('', api_root, name='api-root'),  # Root path points to api_root
 ]
+
+# The API-only settings profile (settings_api) does not install the admin
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
@@ -0,0 +1,15 @@
+from .models import User
+
+
+def load_user_map(emails):
+    """
+    Resolve a collection of user emails to User objects with a single query.
+
+    Every requested email is present in the returned dict; emails without a
+    matching user map to None so callers can tell a miss from "not loaded".
+    """
+    users = {email: None for email in set(emails)}
+    if users:
+        for user in User.objects.filter(email__in=list(users)).only('_id', 'email', 'name', 'team'):
+            users[user.email] = user
+    return users
@@ -1,4 +1,15 @@
+from datetime import datetime, time, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.db import DatabaseError
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework import status
 from .models import User, Team, Activity, Leaderboard, Workout
@@ -9,48 +20,558 @@ from .serializers import (
     LeaderboardSerializer,
     WorkoutSerializer
 )
+from .archive import activity_collections, find_archived
+from .bulk import create_activity, insert_activities, validate_rows
+from .documents import activity_row, leaderboard_row, load_user_documents, user_row
+from .caching import CachedResponseMixin
+from .activity_changes import record_activity_change
+from .export import STREAMS
+from .idempotency import idempotent
+from .metrics import timed
+from .mongo import is_duplicate_key
+from .parsers import NDJSONParser
+from .rank_index import get_rank_index
+from .renderers import CSVRenderer, NDJSONRenderer
+from .team_leaderboard import record_user_change, team_standings, user_teams
+from . import rollups, search, stats
+from .recommendations import recommended_workouts, reset_catalog
+from .user_lookup import load_user_map
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class ObjectIdLookupMixin:
+    """
+    Convert the URL primary key to an ObjectId before the detail lookup.
+
+    djongo's ObjectIdField does not coerce string lookups, so without this
+    ``/api/<resource>/<id>/`` never matches a document.
+    """
+
+    def get_object(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            self.kwargs[lookup_url_kwarg] = ObjectId(self.kwargs[lookup_url_kwarg])
+        except (InvalidId, TypeError):
+            raise Http404
+        return super().get_object()
+
+
+class UserMapMixin:
+    """
+    Preload every user referenced by a page of results with a single query.
+
+    The resulting ``email -> User`` map is passed to the serializer context so
+    ``get_user``/``get_team`` never hit the database per row.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many') and args:
+            instances = list(args[0])
+            args = (instances,) + args[1:]
+            context = kwargs.setdefault('context', self.get_serializer_context())
+            context['users'] = load_user_map(obj.user_email for obj in instances)
+        return super().get_serializer(*args, **kwargs)
+
+
+class DocumentListMixin:
+    """
+    Serve ``list`` straight from MongoDB documents through a precompiled ``RowPlan``.
+
+    Skips model instances and per-object DRF field handling while producing
+    the same JSON as the serializer. Views set ``row_plan`` and implement
+    ``get_document_match()`` with the MongoDB equivalent of their queryset
+    filters. ``API_FAST_LIST_SERIALIZATION = False`` falls back to the
+    serializer. ``get_document_collections(match)`` may name several
+    collections to merge; by default only the model's is read.
+    """
+    row_plan = None
+
+    def get_document_match(self):
+        return {}
+
+    def get_document_collections(self, match):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is None or not getattr(settings, 'API_FAST_LIST_SERIALIZATION', True):
+            return super().list(request, *args, **kwargs)
+        match = self.get_document_match()
+        documents = self.paginator.paginate_documents(
+            self.queryset.model, match, request, view=self, collections=self.get_document_collections(match),
+        )
+        users = None
+        if self.row_plan.needs_users:
+            users = load_user_documents(document['user_email'] for document in documents)
+        with timed('serializer'):
+            rows = self.row_plan.rows(documents, users)
+        return self.paginator.get_paginated_response(rows)
+
+
+def parse_date_param(params, name, end_of_day=False):
+    """
+    Parse an ISO date or datetime query parameter into an aware datetime.
+
+    Plain dates resolve to midnight, or to the following midnight when
+    ``end_of_day`` is set so that ``date_to=2024-01-31`` includes that day.
+    """
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+        if day is not None:
+            parsed = datetime.combine(day + timedelta(days=1) if end_of_day else day, time.min)
+        else:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                raise ValueError
+    except ValueError:
+        raise ValidationError({name: 'Expected an ISO 8601 date or datetime.'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def int_param(params, name, default, maximum):
+    """Parse a positive integer query parameter, capped at ``maximum``."""
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValidationError({name: 'Expected an integer.'})
+    if value < 0:
+        raise ValidationError({name: 'Expected a non-negative integer.'})
+    return min(value, maximum)
+
+
+def team_emails(team):
+    """Return the emails of every member of ``team`` for ``user_email__in`` filters."""
+    return list(User.objects.filter(team=team).values_list('email', flat=True))
+
+
+def activity_match(params, team_members=None):
+    """
+    Build a MongoDB filter for the activity query parameters.
+
+    ``team_members`` holds the emails for the ``team`` parameter; callers
+    resolve it so the same filter serves the sync and async read paths.
+    """
+    match = {}
+    if params.get('user_email'):
+        match['user_email'] = params['user_email']
+    if params.get('team'):
+        members = {'$in': list(team_members or [])}
+        if 'user_email' in match:
+            members['$eq'] = match['user_email']
+        match['user_email'] = members
+    if params.get('activity_type'):
+        match['activity_type'] = params['activity_type']
+    date_range = {}
+    date_from = parse_date_param(params, 'date_from')
+    if date_from:
+        date_range['$gte'] = date_from
+    date_to = parse_date_param(params, 'date_to', end_of_day=True)
+    if date_to:
+        date_range['$lt'] = date_to
+    if date_range:
+        match['date'] = date_range
+    return match
+
+
+class UserViewSet(DocumentListMixin, ObjectIdLookupMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing User operations.
     Provides list, create, retrieve, update, and destroy actions.
+    Writes keep the email -> team map, the team leaderboard and the search index current.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    row_plan = user_row
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        team = self.request.query_params.get('team')
+        if team:
+            queryset = queryset.filter(team=team)
+        return queryset
 
-class TeamViewSet(viewsets.ModelViewSet):
+    def get_document_match(self):
+        team = self.request.query_params.get('team')
+        return {'team': team} if team else {}
+
+    def perform_create(self, serializer):
+        user = serializer.save()
+        record_user_change(after=(user.email, user.team))
+        search.record_change('user', user)
+
+    def perform_update(self, serializer):
+        before = (serializer.instance.email, serializer.instance.team)
+        user = serializer.save()
+        record_user_change(before=before, after=(user.email, user.team))
+        search.record_change('user', user)
+
+    def perform_destroy(self, instance):
+        user_id = instance._id
+        instance.delete()
+        record_user_change(before=(instance.email, instance.team))
+        search.record_delete('user', user_id)
+
+
+class TeamViewSet(CachedResponseMixin, ObjectIdLookupMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Team operations.
     Provides list, create, retrieve, update, and destroy actions.
+    Reads are served from the response cache until the next write.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
 
+    def perform_create(self, serializer):
+        search.record_change('team', serializer.save())
+
+    def perform_update(self, serializer):
+        search.record_change('team', serializer.save())
 
-class ActivityViewSet(viewsets.ModelViewSet):
+    def perform_destroy(self, instance):
+        team_id = instance._id
+        instance.delete()
+        search.record_delete('team', team_id)
+
+
+class ActivityViewSet(DocumentListMixin, ObjectIdLookupMixin, UserMapMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Activity operations.
     Provides list, create, retrieve, update, and destroy actions.
+
+    Lists are cursor-paginated newest first, built from raw documents, and
+    can be filtered with ``user_email``, ``activity_type``, ``team`` and a
+    ``date_from``/``date_to`` range. Every write applies its delta to the
+    user's leaderboard entry and to the user and team rollups. ``bulk``
+    ingests many activities per request and ``export`` streams every
+    matching activity as NDJSON or CSV.
+
+    Creates are deduplicated on ``(user_email, date, activity_type)``: a
+    repeated activity is answered with the stored one and status 200.
+    ``create`` and ``bulk`` also accept an ``Idempotency-Key`` header.
+
+    Lists whose date range reaches archived activities (see ``archive``)
+    merge them in, and archived activities can be retrieved by id.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    row_plan = activity_row
+    cursor_ordering = ('-date', '-_id')
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if params.get('user_email'):
+            queryset = queryset.filter(user_email=params['user_email'])
+        if params.get('activity_type'):
+            queryset = queryset.filter(activity_type=params['activity_type'])
+        if params.get('team'):
+            queryset = queryset.filter(user_email__in=team_emails(params['team']))
+        date_from = parse_date_param(self.request.query_params, 'date_from')
+        if date_from:
+            queryset = queryset.filter(date__gte=date_from)
+        date_to = parse_date_param(self.request.query_params, 'date_to', end_of_day=True)
+        if date_to:
+            queryset = queryset.filter(date__lt=date_to)
+        return queryset
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+    def get_document_match(self):
+        params = self.request.query_params
+        return activity_match(params, team_emails(params['team']) if params.get('team') else None)
+
+    def get_document_collections(self, match):
+        return activity_collections(match)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            object_id = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            document = find_archived(object_id) if isinstance(object_id, ObjectId) else None
+            if document is None:
+                raise
+        return Response(activity_row(document, load_user_documents([document['user_email']])))
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        document, created = create_activity(serializer.validated_data)
+        data = activity_row(document, load_user_documents([document['user_email']]))
+        if not created:
+            return Response(data, status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        before = {
+            'user_email': instance.user_email,
+            'duration': instance.duration,
+            'calories_burned': instance.calories_burned,
+            'distance': instance.distance,
+            'date': instance.date,
+            'team': instance.team,
+        }
+        # The activity stays with the team it was recorded for unless it moves to another user
+        email = serializer.validated_data.get('user_email', instance.user_email)
+        team = instance.team
+        if team is None or email != instance.user_email:
+            team = user_teams([email]).get(email) or ''
+        try:
+            activity = serializer.save(team=team)
+        except DatabaseError as exc:
+            if not is_duplicate_key(exc):
+                raise
+            raise ValidationError({'non_field_errors': [
+                'The fields user_email, date, activity_type must make a unique set.',
+            ]})
+        record_activity_change(removed=[before], added=[activity])
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        record_activity_change(removed=[instance], key=f'activity:{instance._id}:deleted')
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    @idempotent
+    def bulk(self, request):
+        """
+        Create many activities from a JSON array or an NDJSON body.
+
+        Valid rows are inserted even when others fail; the response lists
+        the failures by their index in the request, and the indexes of rows
+        skipped as duplicates of stored activities.
+        """
+        rows = request.data
+        if not isinstance(rows, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of activities.']})
+        max_rows = getattr(settings, 'ACTIVITY_BULK_MAX_ROWS', 10000)
+        if len(rows) > max_rows:
+            raise ValidationError({'non_field_errors': [f'At most {max_rows} activities per request.']})
+
+        valid, errors = validate_rows(self.get_serializer(data=rows, many=True), rows)
+        inserted, duplicates, write_errors = insert_activities(valid)
+        errors = sorted(errors + write_errors, key=lambda error: error['index'])
+        return Response(
+            {'created': len(inserted), 'duplicates': sorted(duplicates), 'failed': len(errors), 'errors': errors},
+            status=status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED,
+        )
+
+    @action(detail=False, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """
+        Stream every matching activity, oldest first, as ``?format=ndjson`` (default) or ``csv``.
+
+        Accepts the list filters; rows are read from a MongoDB cursor in
+        batches rather than loaded up front.
+        """
+        params = request.query_params
+        match = activity_match(params, team_emails(params['team']) if params.get('team') else None)
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(STREAMS[renderer.format](match), content_type=renderer.media_type)
+        response['Content-Disposition'] = f'attachment; filename="activities.{renderer.format}"'
+        return response
+
+
+class LeaderboardViewSet(DocumentListMixin, ObjectIdLookupMixin, UserMapMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Leaderboard operations.
     Provides list, create, retrieve, update, and destroy actions.
+
+    Lists are cursor-paginated by rank and can be filtered with
+    ``user_email`` and ``team``. The ``top``, ``me`` and ``around`` actions
+    answer rank queries from the in-process rank index; ``teams`` returns
+    the maintained team standings.
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    row_plan = leaderboard_row
+    cursor_ordering = ('rank', '_id')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if params.get('user_email'):
+            queryset = queryset.filter(user_email=params['user_email'])
+        if params.get('team'):
+            queryset = queryset.filter(user_email__in=team_emails(params['team']))
+        return queryset
+
+    def get_document_match(self):
+        params = self.request.query_params
+        match = {}
+        if params.get('user_email'):
+            match['user_email'] = params['user_email']
+        if params.get('team'):
+            members = {'$in': team_emails(params['team'])}
+            if 'user_email' in match:
+                members['$eq'] = match['user_email']
+            match['user_email'] = members
+        return match
+
+    def rank_rows(self, rows):
+        """Add user names and teams to rank index rows with a single user query."""
+        users = load_user_map(row['user_email'] for row in rows)
+        for row in rows:
+            user = users[row['user_email']]
+            row['user'] = user.name if user else row['user_email']
+            row['team'] = user.team if user and user.team else 'No Team'
+        return rows
+
+    def rank_response(self, email):
+        if not email:
+            raise ValidationError({'email': 'This query parameter is required.'})
+        radius = int_param(self.request.query_params, 'radius', 5, 50)
+        rows = get_rank_index().around(email, radius)
+        if rows is None:
+            raise Http404
+        return Response({
+            'user_email': email,
+            'rank': next(row['rank'] for row in rows if row['user_email'] == email),
+            'results': self.rank_rows(rows),
+        })
 
+    @action(detail=False)
+    def top(self, request):
+        """The ``k`` (default 10) highest-ranked users, served from the rank index."""
+        k = int_param(request.query_params, 'k', 10, 500)
+        return Response({'results': self.rank_rows(get_rank_index().top(k))})
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+    @action(detail=False)
+    def me(self, request):
+        """The requesting user's rank and neighbours; ``?email=`` when not authenticated."""
+        # settings_api has no auth app, so request.user is None there
+        user = request.user
+        email = user.email if getattr(user, 'is_authenticated', False) else request.query_params.get('email')
+        return self.rank_response(email)
+
+    @action(detail=False)
+    def around(self, request):
+        """Users ranked around ``?email=``, ``radius`` (default 5) places on each side."""
+        return self.rank_response(request.query_params.get('email'))
+
+    @action(detail=False)
+    def teams(self, request):
+        """Team standings by total points, read from the running team totals."""
+        return Response({'results': team_standings()})
+
+
+class WorkoutViewSet(CachedResponseMixin, ObjectIdLookupMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Workout operations.
     Provides list, create, retrieve, update, and destroy actions.
+    Reads are served from the response cache until the next write.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+
+    def perform_create(self, serializer):
+        search.record_change('workout', serializer.save())
+        reset_catalog()
+
+    def perform_update(self, serializer):
+        search.record_change('workout', serializer.save())
+        reset_catalog()
+
+    def perform_destroy(self, instance):
+        workout_id = instance._id
+        instance.delete()
+        search.record_delete('workout', workout_id)
+        reset_catalog()
+
+    @action(detail=False)
+    def recommended(self, request):
+        """Workouts matched to ``?email=``'s activity history, best first; ``limit`` caps the rows."""
+        email = request.query_params.get('email')
+        if not email:
+            raise ValidationError({'email': 'This query parameter is required.'})
+        limit = int_param(request.query_params, 'limit', None, settings.WORKOUT_RECOMMENDATIONS_K)
+        return Response({'email': email, 'results': recommended_workouts(email, limit)})
+
+
+class StatsViewSet(viewsets.ViewSet):
+    """
+    Read-only activity statistics computed by MongoDB aggregation pipelines.
+
+    Every endpoint accepts ``user_email``, ``activity_type``, ``team`` and a
+    ``date_from``/``date_to`` range to narrow the activities aggregated.
+    """
+
+    def get_match(self):
+        params = self.request.query_params
+        return activity_match(params, team_emails(params['team']) if params.get('team') else None)
+
+    def list(self, request):
+        return Response({
+            name: request.build_absolute_uri(f'{name}/')
+            for name in ('users', 'teams', 'activity-types', 'timeline', 'rollups')
+        })
+
+    @action(detail=False)
+    def users(self, request):
+        """Totals per user; ``limit`` caps the number of rows."""
+        limit = int_param(request.query_params, 'limit', 100, 1000)
+        return Response({'results': stats.user_totals(self.get_match(), limit=limit)})
+
+    @action(detail=False)
+    def teams(self, request):
+        """Totals per team."""
+        return Response({'results': stats.team_totals(self.get_match())})
+
+    @action(detail=False, url_path='activity-types')
+    def activity_types(self, request):
+        """Totals per activity type."""
+        return Response({'results': stats.activity_type_totals(self.get_match())})
+
+    @action(detail=False)
+    def timeline(self, request):
+        """Totals per ``bucket``: ``day`` (default), ``week`` or ``month``."""
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in stats.BUCKET_FORMATS:
+            raise ValidationError({'bucket': f"Expected one of {', '.join(stats.BUCKET_FORMATS)}."})
+        return Response({'results': stats.timeline(bucket, self.get_match())})
+
+    @action(detail=False)
+    def rollups(self, request):
+        """
+        Precomputed totals per ``period`` for one ``user_email`` or ``team``.
+
+        Same rows as ``timeline`` but read from the rollup collection; the
+        ``date_from``/``date_to`` range selects whole buckets.
+        """
+        params = request.query_params
+        period = params.get('period', 'day')
+        if period not in rollups.PERIODS:
+            raise ValidationError({'period': f"Expected one of {', '.join(rollups.PERIODS)}."})
+        if bool(params.get('user_email')) == bool(params.get('team')):
+            raise ValidationError({'non_field_errors': ['Pass exactly one of user_email or team.']})
+        scope, key = ('user', params['user_email']) if params.get('user_email') else ('team', params['team'])
+        return Response({'results': rollups.rollup_series(
+            scope, key, period,
+            parse_date_param(params, 'date_from'),
+            parse_date_param(params, 'date_to', end_of_day=True),
+        )})
+
+
+class SearchViewSet(viewsets.ViewSet):
+    """
+    Typeahead search over users, teams and workouts from an in-process index.
+
+    ``q`` matches entries with a word starting with each of its words;
+    ``type`` (repeatable) narrows to ``user``, ``team`` or ``workout`` and
+    ``limit`` caps the results (default 10, at most 50).
+    """
+
+    def list(self, request):
+        params = request.query_params
+        kinds = params.getlist('type')
+        unknown = set(kinds) - set(search.SOURCES)
+        if unknown:
+            raise ValidationError({'type': f"Expected one of {', '.join(search.SOURCES)}."})
+        limit = int_param(params, 'limit', 10, 50)
+        results = search.get_search_index().search(params.get('q', ''), kinds or None, limit)
+        return Response({'query': params.get('q', ''), 'results': results})
@@ -1,4 +1,7 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
+
+// How often to re-fetch when the live stream is unavailable
+const POLL_INTERVAL_MS = 15000;
 
 function Leaderboard() {
   const [leaderboard, setLeaderboard] = useState([]);
@@ -7,11 +10,12 @@ function Leaderboard() {
   const [sortColumn, setSortColumn] = useState('rank');
   const [sortDirection, setSortDirection] = useState('asc');
 
-  useEffect(() => {
-    const apiUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/leaderboard/`;
-    console.log('Fetching leaderboard from:', apiUrl);
+  const apiBase = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/leaderboard/`;
+
+  const fetchLeaderboard = useCallback(() => {
+    console.log('Fetching leaderboard from:', apiBase);
 
-    fetch(apiUrl)
+    return fetch(apiBase)
       .then(response => {
         if (!response.ok) {
           throw new Error(`HTTP error! status: ${response.status}`);
@@ -31,7 +35,70 @@ function Leaderboard() {
         setError(error.message);
         setLoading(false);
       });
-  }, []);
+  }, [apiBase]);
+
+  useEffect(() => {
+    fetchLeaderboard();
+
+    // Live updates: each event lists the rows that changed, in order. Rows we
+    // hold are replaced; everyone else in the shifted points range moves by
+    // one rank. New users only appear once they rank within the loaded page.
+    // Event ids are the server's sequence numbers, the same on every backend
+    // process, and the browser resumes from the last one when it reconnects.
+    // The stream needs the ASGI server; under runserver or another WSGI server
+    // it answers 501, so fall back to polling if it never connects.
+    let poller = null;
+    let connected = false;
+    let lastSeq = 0;
+    const source = new EventSource(`${apiBase}stream/`);
+    source.onopen = () => {
+      connected = true;
+    };
+    source.onerror = () => {
+      // Once connected, the browser reconnects by itself
+      if (!connected || source.readyState === EventSource.CLOSED) {
+        source.close();
+        if (!poller) {
+          poller = setInterval(fetchLeaderboard, POLL_INTERVAL_MS);
+        }
+      }
+    };
+    source.addEventListener('leaderboard', event => {
+      // Shifts are relative, so an event must never be applied twice
+      const seq = Number(event.lastEventId);
+      if (seq <= lastSeq) {
+        return;
+      }
+      lastSeq = seq;
+      const changes = JSON.parse(event.data);
+      setLeaderboard(current => {
+        let rows = current;
+        changes.forEach(({ row, shift }) => {
+          rows = rows.map(entry => {
+            if (entry.user_email === row.user_email) {
+              return row;
+            }
+            if (shift && entry.total_points >= shift.from_points && entry.total_points < shift.to_points) {
+              return { ...entry, rank: entry.rank + shift.by };
+            }
+            return entry;
+          });
+          const lastRank = rows.length ? Math.max(...rows.map(entry => entry.rank)) : Infinity;
+          if (!rows.some(entry => entry.user_email === row.user_email) && row.rank <= lastRank) {
+            rows = [...rows, row];
+          }
+        });
+        return rows;
+      });
+    });
+    // Sent when updates were missed; start over from the REST endpoint
+    source.addEventListener('reset', () => fetchLeaderboard());
+
+    return () => {
+      source.close();
+      clearInterval(poller);
+    };
+  }, [apiBase, fetchLeaderboard]);
 
   const handleSort = (column) => {
     if (sortColumn === column) {